@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from sys import argv
+from datetime import datetime
+from os import path
+
+from code_builder.agent import BuildAgent
+from code_builder.utils.driver import open_config
+
+parser = ArgumentParser(description='Build agent of a build farm, builds the projects of coordinator.py')
+parser.add_argument('coordinator', type=str, help='URL of the coordinator, e.g. http://host:8750')
+parser.add_argument('--source-dir', dest='source_dir', default='source', action='store',
+        help='Directory used to store source codes')
+parser.add_argument('--build-dir', dest='build_dir', default='build', action='store',
+        help='Directory used to build projects')
+parser.add_argument('--results-dir', dest='results_dir', default='compiler_output', action='store',
+        help='Directory used to store resulting bitcodes and AST')
+parser.add_argument('--workers', dest='workers', default=None, type=int, action='store',
+        help='Projects built at the same time, threads of the clone section by default')
+parser.add_argument('--name', dest='name', default=None, action='store',
+        help='Name of the agent, host and pid by default')
+parser.add_argument('--user-config-file', dest='user_config_file', default='user.cfg', action='store',
+        help='User config file')
+parser.add_argument('--config-file', dest='config_file', default='build.cfg', action='store',
+        help='Application config file')
+parser.add_argument('--log-to-file', dest='out_to_file', action='store',
+        help='Store output and error logs to a file')
+parser.add_argument('--verbose', dest='verbose', action='store_true',
+        help='Verbose output.')
+parser.add_argument('-j', dest='n_jobs', default=None, action='store',
+        help='-j flag to invoke compiler with')
+
+parsed_args = parser.parse_args(argv[1:])
+cfg = open_config(parsed_args, path.dirname(path.realpath(__file__)))
+cfg['output'] = {'verbose' : parsed_args.verbose}
+if parsed_args.out_to_file:
+    cfg['output']['file'] = parsed_args.out_to_file
+# replaced by the run of the coordinator with the first lease
+cfg['output']['time'] = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+if parsed_args.n_jobs:
+    cfg["build"]["jobs"] = parsed_args.n_jobs
+workers = parsed_args.workers or int(cfg["clone"]["threads"])
+
+BuildAgent(
+    parsed_args.coordinator,
+    cfg,
+    parsed_args.source_dir,
+    parsed_args.build_dir,
+    parsed_args.results_dir,
+    workers,
+    parsed_args.name,
+).run()
@@ -3,13 +3,14 @@
 import json
 
 from argparse import ArgumentParser
-from sys import argv, stdout, stderr
+from sys import argv, exit, stdout, stderr
 from configparser import ConfigParser
 from datetime import datetime
 from os import path
 
 from code_builder.fetcher import fetch_projects
 from code_builder.code_builder import build_projects
+from code_builder.repositories import load_repositories, parse_shard
 from code_builder.utils.driver import open_config, open_logfiles
 
 # https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
@@ -46,6 +47,10 @@ parser.add_argument('--log_dir', dest='log_dir', default='buildlogs', action='st
         help='Directory used to store the logs and build stats')
 parser.add_argument('-j', dest='n_jobs', default=None, action='store',
         help='-j flag to invoke compiler with')
+parser.add_argument('--shard', dest='shard', default=None, action='store',
+        help='Build only shard i/N of the database, e.g. 0/4, to split it between builders')
+parser.add_argument('--limit', dest='limit', default=None, type=int, action='store',
+        help='Build at most this many projects (of the shard)')
 
 parsed_args = parser.parse_args(argv[1:])
 cfg = open_config(parsed_args, path.dirname(path.realpath(__file__)))
@@ -56,8 +61,14 @@ cfg['output']['time'] = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
 if parsed_args.n_jobs:
     cfg["build"]["jobs"] = parsed_args.n_jobs
 
-with open(parsed_args.repositories_db) as repo_db:
-    repositories = json.load(repo_db)
+try:
+    shard = parse_shard(parsed_args.shard) if parsed_args.shard else None
+except ValueError as e:
+    error_print(e)
+    exit(1)
+# read project by project, only the selected ones are kept: without --shard or
+# --limit that is the whole database, build_projects orders all of it
+repositories = load_repositories(parsed_args.repositories_db, shard, parsed_args.limit)
 
 repositories = build_projects(  source_dir = parsed_args.source_dir, 
                                 build_dir = parsed_args.build_dir,
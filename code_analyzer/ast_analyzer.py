@@ -124,6 +124,13 @@ def start_docker(
         "ANALYSES={}".format(str(ctx.cfg["analyze"]["analyses"])),
     ]
 
+    limits = {}
+    memory_limit = ctx.cfg["analyze"].get("memory_limit", "").strip()
+    if memory_limit:
+        # no swap, a container over the limit is killed instead of slowing
+        # down the host
+        limits["mem_limit"] = limits["memswap_limit"] = int(float(memory_limit) * 2 ** 30)
+
     print(f"Got dockerfile for project {project_name}, running container...")
 
     container_created = False
@@ -137,7 +144,7 @@ def start_docker(
                 volumes=volumes,
                 auto_remove=False,
                 remove=False,
-                # mem_limit="3g"  # limit memory to 3GB to protect the host
+                **limits,
             )
             container_created = True
         except Exception as e:
@@ -230,6 +237,13 @@ def start_docker(
         docker_log_file = dump_logs(container, project_name, results_dir)
         project["status"] = "crash"
         project["crash_reason"] = "analyzer docker container crashed"
+        try:
+            container.reload()
+            if container.attrs["State"].get("OOMKilled"):
+                project["oom_killed"] = True
+                project["crash_reason"] = "analyzer docker container ran out of memory"
+        except Exception:
+            pass
         container.remove(force = True)
         return False
     docker_log_file = dump_logs(container, project_name, results_dir)
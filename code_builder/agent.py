@@ -0,0 +1,283 @@
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+from multiprocessing import Manager
+from os.path import exists
+from time import sleep
+
+from .code_builder import (
+    Context,
+    download_and_build,
+    initializer_func,
+    package_build,
+    start_workers,
+)
+from .coordinator import farm_config
+from .database import get_database
+from .resources import BuildResources
+from .scheduling import CostModel, load_history
+from .statistics import Statistics
+from .supervisor import ContainerSupervisor
+
+
+def build_and_package(
+    database, source_dir, idx, name, project, target_dir, build_dir, ctx, stats, running_builds
+):
+    # the whole build of a leased project in one process of the agent
+    cloner = get_database(database)(source_dir, ctx)
+    idx, name, project = download_and_build(
+        cloner, idx, name, project, target_dir, build_dir, ctx, stats, running_builds
+    )
+    return package_build(idx, name, project, target_dir, build_dir, ctx, running_builds)
+
+
+class BuildAgent:
+    """Builds projects leased from a Coordinator with the local docker.
+
+    Leases as many projects as it has free workers, renews the leases of the
+    running builds every heartbeat seconds and posts every finished project
+    back. Leased projects wait until the cores and memory for them are free,
+    like the builds of build_projects. A build whose lease was lost (the
+    coordinator gave it to another agent) still finishes, the coordinator
+    keeps the first result. A coordinator that does not answer
+    request_retries requests in a row ended the run (or went away), the agent
+    lets its running builds finish, drops their results and exits.
+    """
+
+    def __init__(self, url, cfg, source_dir, build_dir, target_dir, workers, name=None):
+        farm = farm_config(cfg)
+        self.url = url.rstrip("/")
+        self.cfg = cfg
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.target_dir = target_dir
+        self.workers = workers
+        self.name = name or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.heartbeat_interval = float(farm.get("heartbeat", 30))
+        self.poll_interval = float(farm.get("poll", 10))
+        self.request_retries = int(farm.get("request_retries", 8))
+        # the coordinator said that the run is done
+        self.done = False
+        self.running = {}
+        # leased projects waiting for cores and memory
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def request(self, path, payload, retries=None):
+        # POST to the coordinator, retried while it is not reachable, at most
+        # request_retries times
+        if retries is None:
+            # once the run is done the coordinator only lingers a while
+            retries = 1 if self.done else self.request_retries
+        data = json.dumps(payload).encode()
+        attempt = 0
+        while True:
+            try:
+                req = urllib.request.Request(
+                    self.url + path,
+                    data=data,
+                    headers={"Content-Type": "application/json"},
+                )
+                with urllib.request.urlopen(req, timeout=60) as response:
+                    return json.loads(response.read())
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                attempt += 1
+                if attempt > retries:
+                    raise
+                print("coordinator {} not reachable: {}".format(self.url, e), flush=True)
+                sleep(min(60, 2 ** attempt))
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            with self.lock:
+                names = list(self.running.values()) + [
+                    item[1] for item in self.pending
+                ]
+            if not names:
+                continue
+            try:
+                reply = self.request(
+                    "/heartbeat", {"agent": self.name, "names": names}, retries=0
+                )
+            except (urllib.error.URLError, OSError, ValueError):
+                # the next heartbeat tries again, the lease lasts longer
+                continue
+            if reply.get("done"):
+                self.done = True
+            for name in reply["lost"]:
+                print("lease of {} lost, finishing the build anyway".format(name))
+
+    def run(self):
+        for path in (self.source_dir, self.build_dir, self.target_dir):
+            if not exists(path):
+                os.makedirs(path)
+        ctx = Context(0, self.cfg)
+        manager = Manager()
+        running_builds = manager.dict()
+        running_builds["builds_left"] = 0
+        stats = Statistics(
+            0,
+            fuzzy_matching=self.cfg["build"].get("fuzzy_matching", "index"),
+            contents_index=self.cfg["build"].get("contents_index") or None,
+        )
+        history_files = [
+            p.strip()
+            for p in self.cfg["build"].get("schedule_history", "").split(",")
+            if p.strip()
+        ]
+        history = load_history(history_files)
+        resources = BuildResources(self.cfg, self.workers, CostModel(history), history)
+        # reserved resources and leased projects of the running futures
+        allocated = {}
+        submitted = {}
+        # projects built again with their missing dependencies, once
+        deps_retried = set()
+        # forked before the supervisor and heartbeat threads start
+        pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        start_workers(pool)
+        ctx.container_stats = manager.dict()
+        supervisor = ContainerSupervisor(
+            ctx.container_stats,
+            float(self.cfg["build"].get("memory_sample_interval", 10)),
+        )
+        ctx.supervisor_run = supervisor.run_id
+        supervisor.start()
+        heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+        heartbeat.start()
+        built = 0
+        done = False
+
+        def submit():
+            # start the pending builds there are workers, cores and memory for
+            while self.pending and len(self.running) < self.workers:
+                idx, name, database, project = self.pending[0]
+                reservation = resources.admit(name, project)
+                if reservation is None:
+                    return
+                with self.lock:
+                    self.pending.pop(0)
+                start(idx, name, database, project, reservation)
+
+        def start(idx, name, database, project, reservation):
+            future = pool.submit(
+                initializer_func,
+                ctx,
+                build_and_package,
+                (
+                    database,
+                    self.source_dir,
+                    idx,
+                    name,
+                    project,
+                    self.target_dir,
+                    self.build_dir,
+                    ctx,
+                    stats,
+                    running_builds,
+                ),
+            )
+            allocated[future] = reservation
+            submitted[future] = (idx, name, database, project)
+            with self.lock:
+                self.running[future] = name
+
+        def unreachable(error):
+            # nothing can be reported anymore, running builds finish (the
+            # pool waits for them) but queued ones are not started
+            if self.done:
+                print("coordinator finished the run and went away", flush=True)
+            else:
+                print("coordinator {} not reachable, giving up: {}".format(self.url, error))
+            with self.lock:
+                for future in self.running:
+                    future.cancel()
+                names = list(self.running.values()) + [item[1] for item in self.pending]
+                self.pending = []
+                if names:
+                    print("dropping the results of {}".format(
+                        ", ".join(sorted(names))), flush=True)
+
+        gone = False
+        with pool:
+            while True:
+                slots = self.workers - len(self.running) - len(self.pending)
+                if not done and slots > 0:
+                    try:
+                        reply = self.request(
+                            "/lease", {"agent": self.name, "slots": slots}
+                        )
+                    except (urllib.error.URLError, OSError, ValueError) as e:
+                        unreachable(e)
+                        break
+                    done = reply["done"]
+                    self.done = self.done or done
+                    self.cfg["output"]["time"] = reply["run"]
+                    for item in reply["items"]:
+                        ctx.projects_count = max(ctx.projects_count, item["idx"])
+                        running_builds["builds_left"] += 1
+                        with self.lock:
+                            self.pending.append(
+                                (item["idx"], item["name"], item["database"], item["project"])
+                            )
+                submit()
+                if not self.running:
+                    if done:
+                        break
+                    # the queue is empty, wait for projects other agents lose
+                    sleep(self.poll_interval)
+                    continue
+                completed, _ = concurrent.futures.wait(
+                    list(self.running),
+                    timeout=self.poll_interval,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in completed:
+                    with self.lock:
+                        name = self.running.pop(future)
+                    resources.release(allocated.pop(future))
+                    leased = submitted.pop(future)
+                    try:
+                        idx, _, project = future.result()
+                    except Exception as e:
+                        # the process died, nothing to report, the lease runs
+                        # out and another agent builds the project
+                        print("build of {} failed: {}".format(name, e), flush=True)
+                        continue
+                    if project.pop("oom_retry_queued", False):
+                        # build it again under the same lease, next
+                        resources.oom_retry(name, leased[3])
+                        running_builds["builds_left"] += 1
+                        with self.lock:
+                            self.pending.insert(0, leased)
+                        continue
+                    if project.pop("retry_queued", False) and name not in deps_retried:
+                        deps_retried.add(name)
+                        # missing dependencies, build it again under the same lease
+                        running_builds["builds_left"] += 1
+                        with self.lock:
+                            self.pending.insert(0, (idx, name, leased[2], project))
+                        continue
+                    try:
+                        reply = self.request(
+                            "/result",
+                            {"agent": self.name, "name": name, "project": project},
+                        )
+                    except (urllib.error.URLError, OSError, ValueError) as e:
+                        print("result of {} dropped".format(name))
+                        unreachable(e)
+                        gone = True
+                        break
+                    built += 1
+                    if not reply["accepted"]:
+                        print("{} was built by another agent already".format(name))
+                if gone:
+                    break
+        self.stopped.set()
+        supervisor.stop()
+        print("agent {} built {} projects".format(self.name, built), flush=True)
@@ -2,6 +2,7 @@ from code_builder.statistics import Statistics
 import subprocess
 import os
 import docker
+import requests
 import io
 import tarfile
 import json
@@ -14,13 +15,20 @@ from os.path import abspath, join, exists, basename, dirname
 from os import makedirs, mkdir
 from glob import iglob
 from sys import version_info
-from time import sleep, time
-from datetime import datetime, timedelta, timezone
+from time import time
+from datetime import datetime
 
 from . import cmake, debian, autotools, make, conan
 from ..ci_systems import travis, circle_ci, gh_actions, debian_install, conan_install
+from ..ci_systems.apt_cache import AptCache
+from ..ci_systems.dep_index import index_path
+from ..image_cache import ImageCache
+from ..result_cache import ResultCache
+from ..supervisor import FAILED, NAME_LABEL, RUN_LABEL, TIMEOUT_LABEL, last_log_time
 
 DOCKER_MOUNT_POINT = "/home/fba_code"
+# seconds between the checks of wait_container without a supervisor
+WAIT_INTERVAL = 60
 
 def run(command, cwd=None, stdout=None, stderr=None, capture_output=False, text=False):
 
@@ -59,6 +67,41 @@ ci_systems = {
 # double_build_ci = {"travis", "gh_actions", "debian_install"}
 
 
+def container_oom_killed(container):
+    try:
+        container.reload()
+        return bool(container.attrs["State"].get("OOMKilled"))
+    except Exception:
+        return False
+
+
+def wait_container(container, ctx, timeout):
+    """container.wait(), stopping a container that printed nothing for
+    timeout seconds if no ContainerSupervisor does that.
+
+    Returns the result of wait and whether the container was stopped here.
+    """
+    started = time()
+    while True:
+        try:
+            return container.wait(timeout=WAIT_INTERVAL), False
+        except requests.exceptions.RequestException:
+            pass
+        results = getattr(ctx, "container_stats", None)
+        if results is not None and FAILED not in results:
+            continue
+        try:
+            last = max(last_log_time(container) or 0, started)
+        except Exception:
+            continue
+        if timeout and time() - last >= timeout:
+            try:
+                container.stop(timeout=3)
+            except Exception:
+                pass
+            return container.wait(), True
+
+
 def start_docker(
     idx,
     name,
@@ -96,6 +139,13 @@ def start_docker(
         "mode": "ro",
         "bind": f"{DOCKER_MOUNT_POINT}/dep_mapping.json",
     }
+    # docker would create a directory for a missing file
+    dep_index = index_path(join(dirname(__file__), "../dep_mapping.json"))
+    if exists(dep_index):
+        volumes[dep_index] = {
+            "mode": "ro",
+            "bind": index_path(f"{DOCKER_MOUNT_POINT}/dep_mapping.json"),
+        }
     volumes[abspath(build_dir)] = {"mode": "rw", "bind": f"{DOCKER_MOUNT_POINT}/build"}
     volumes[abspath(bitcodes_dir)] = {
         "mode": "rw",
@@ -117,19 +167,58 @@ def start_docker(
         "CI_SYSTEM={}".format(ci_system),
         # "DEPENDENCY_INSTALL={}".format(str(project["install_deps"])),
         "SKIP_BUILD={}".format(str(ctx.cfg["build"]["skip_build"])),
-        "JOBS={}".format(str(ctx.cfg["build"]["jobs"])),
+        # the cores reserved by the CorePool of build_projects, if any
+        "JOBS={}".format(str(project.get("resources", {}).get("jobs", ctx.cfg["build"]["jobs"]))),
         "SAVE_IR={}".format(str(ctx.cfg["build"]["save_ir"])),
         "SAVE_AST={}".format(str(ctx.cfg["build"]["save_ast"])),
         "SAVE_HEADERS={}".format(str(ctx.cfg["build"]["save_headers"]))
     ]
+    # archives and lists shared with the other containers of the image
+    apt_cache = AptCache.from_config(ctx.cfg)
+    if apt_cache is not None:
+        volumes.update(apt_cache.volumes(dockerfile))
+        environment.extend(apt_cache.environment())
+    # start from an image with the build dependencies of the package, or
+    # commit one after they are installed
+    image = dockerfile
+    commit_deps = False
+    image_cache = None
+    if ci_system == "debian_install":
+        image_cache = ImageCache.from_config(ctx.cfg, apt_cache)
+    if image_cache is not None:
+        try:
+            image, commit_deps = image_cache.select(
+                docker_client, dockerfile, name, build_dir
+            )
+        except Exception as e:
+            ctx.err_log.print_error(idx, "image cache not usable: {}".format(e))
+        environment.append("DEPS_IMAGE={}".format("commit" if commit_deps else image))
+    limits = {}
+    resources = project.get("resources", {})
+    if "cpuset" in resources:
+        limits["cpuset_cpus"] = resources["cpuset"]
+    if "memory" in resources:
+        # no swap, a container over its budget is killed instead of slowing
+        # down the host
+        limits["mem_limit"] = resources["memory"]
+        limits["memswap_limit"] = resources["memory"]
+    labels = {
+        NAME_LABEL: name,
+        TIMEOUT_LABEL: str(docker_timeout * 60),
+    }
+    if getattr(ctx, "supervisor_run", None):
+        labels[RUN_LABEL] = ctx.supervisor_run
     container = docker_client.containers.run(
-        dockerfile,
+        image,
         detach=True,
         environment=environment,
         volumes=volumes,
         auto_remove=False,
         remove=False,
+        # found and watched by the ContainerSupervisor through these
+        labels=labels,
         # mem_limit="3g"  # limit memory to 3GB to protect the host
+        **limits,
     )
     if project.get("is_first_build", False):
         ctx.out_log.print_info(
@@ -145,33 +234,31 @@ def start_docker(
                 name, container.name, build_name, ci_system, dockerfile
             ),
         )
-    sleep(10)
-    reload_fail = 0
-    try:
-        container.reload()
-    except Exception:
-        print("{}: container.reload failed {} times".format(name, reload_fail))
-        reload_fail += 1
-    while reload_fail < 3 and container.status == "running":
-        # get the current time of the container, can differ from host bc timezone
-        # time = container.stats(stream=False)["read"]
-        # try with utc time, should be faster
-        # TODO: make timeout configurable
-        timeout = datetime.now(timezone.utc) - timedelta(minutes=docker_timeout)
-        logs = container.logs(since=timeout.timestamp(), tail=10)
-        # ctx.out_log.print_info(idx, logs)
-        if logs == b"":
-            ctx.out_log.print_info(idx, "stopping container, no progress in 30min")
-            container.stop(timeout=3)
-        sleep(10)
-        try:
-            container.reload()
-            reload_fail = 0
-        except Exception:
-            print("{}: container.reload failed {} times".format(name, reload_fail))
-            reload_fail += 1
-    # just use this to get exit code
-    return_code = container.wait()
+    if image != dockerfile:
+        ctx.out_log.print_info(idx, "build dependencies from {}".format(image))
+    elif commit_deps:
+        # returns once init.py installed the dependencies and goes on
+        image = image_cache.commit(docker_client, container, dockerfile, name, build_dir)
+    # the ContainerSupervisor of build_projects stops the container if it
+    # stalls and samples its memory, wait blocks in docker until it exits
+    # and checks the progress itself if the supervisor failed
+    return_code, stalled = wait_container(container, ctx, docker_timeout * 60)
+    supervised = {}
+    if getattr(ctx, "container_stats", None) is not None:
+        supervised = ctx.container_stats.pop(container.id, {})
+    if stalled or supervised.get("stalled"):
+        ctx.out_log.print_info(
+            idx, "stopped container, no progress in {} min".format(docker_timeout)
+        )
+    memory_peak = supervised.get("memory_peak", 0)
+    if memory_peak:
+        # learned by the MemoryPool of the next run
+        project["memory_peak"] = memory_peak
+    if supervised.get("oom") or container_oom_killed(container):
+        ctx.err_log.print_error(
+            idx, "{} ran out of memory in container {}".format(name, container.name)
+        )
+        project["oom_killed"] = True
     ctx.out_log.print_info(
         idx,
         "Project {} in container {} finished with return code:{}".format(
@@ -202,7 +289,10 @@ def start_docker(
                 ),
             )
         project["status"] = "crash"
-        project["crash_reason"] = "docker container crashed"
+        if project.get("oom_killed"):
+            project["crash_reason"] = "docker container ran out of memory"
+        else:
+            project["crash_reason"] = "docker container crashed"
         container.remove()
         return False
     docker_log = container.logs()
@@ -236,6 +326,8 @@ def start_docker(
         return False
     container.remove()
     project["build"]["docker_log"] = docker_log_file
+    if image is not None and image != dockerfile:
+        project["build"]["deps_image"] = image
     return True
 
 
@@ -309,7 +401,31 @@ def recognize_and_build(idx, name, project, build_dir, target_dir, ctx, stats=No
                 "dockerfile": dockerfile,
             }
 
-            start_docker(idx, name, project, ctx, **docker_conf)
+            # an identical earlier build replaces the container run
+            result_cache = ResultCache.from_config(ctx.cfg)
+            cache_key = None
+            if result_cache is not None:
+                cache_key = result_cache.key(
+                    name, project, source_dir, dockerfile, ctx.cfg, build_name, ci_system
+                )
+            if cache_key is not None and result_cache.restore(
+                cache_key, project, build_dir, ast_dir, bitcodes_dir
+            ):
+                ctx.out_log.print_info(idx, "reusing the cached build of {}".format(name))
+                project["result_cache"] = "hit"
+            else:
+                start_docker(idx, name, project, ctx, **docker_conf)
+                if result_cache is not None:
+                    project["result_cache"] = "miss"
+                    if cache_key is None:
+                        # the image was pulled by the run
+                        cache_key = result_cache.key(
+                            name, project, source_dir, dockerfile, ctx.cfg, build_name, ci_system
+                        )
+                    if cache_key is not None and project["status"] == "success":
+                        result_cache.store(
+                            cache_key, project, build_dir, ast_dir, bitcodes_dir
+                        )
 
             # ----------- Ignoring what is below for now ------------
             # - Because we no longer try to build twice. Just build once and save the header files that are required. -
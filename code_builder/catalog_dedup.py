@@ -0,0 +1,207 @@
+import math
+import re
+
+from collections import Counter, OrderedDict, defaultdict
+from time import time
+
+from fuzzywuzzy import utils
+
+from .error_matcher import ErrorMatcher, FuzzyIndex
+from .project_sets import ProjectSet
+from .statistics import FIXED_ENTRIES, Statistics
+
+PATH_PLACEHOLDER = "PATH/FILE.EXT"
+
+
+def normalize_key(key):
+    # numbers are what usually differs between near duplicates, they carry no
+    # meaning for the similarity at all. case does, "Error: " is not "error: "
+    return re.sub(r"\d+", "0", key)
+
+
+def ngram_vector(key, n=3):
+    text = " {} ".format(normalize_key(key))
+    return Counter(text[i : i + n] for i in range(max(1, len(text) - n + 1)))
+
+
+class CatalogVectors:
+    """Sparse tf-idf vectors over the character n-grams of the catalog keys.
+
+    The vectors are L2 normalized, so the cosine similarity of two entries is
+    the dot product, computed for all entries sharing an n-gram at once
+    through the inverted index.
+    """
+
+    def __init__(self, keys, n=3):
+        self.keys = list(keys)
+        counts = [ngram_vector(k, n) for k in self.keys]
+        df = Counter()
+        for c in counts:
+            df.update(c.keys())
+        total = len(self.keys)
+        self.vectors = []
+        self.postings = defaultdict(list)
+        for idx, c in enumerate(counts):
+            vec = {g: tf * math.log(1 + total / df[g]) for g, tf in c.items()}
+            norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+            vec = {g: w / norm for g, w in vec.items()}
+            self.vectors.append(vec)
+            for g, w in vec.items():
+                self.postings[g].append((idx, w))
+
+    def similarities(self, idx, candidates):
+        # cosine similarity of entry idx to every entry in candidates
+        scores = defaultdict(float)
+        for g, w in self.vectors[idx].items():
+            for other, other_w in self.postings[g]:
+                if other in candidates:
+                    scores[other] += w * other_w
+        return scores
+
+
+def cluster_entries(catalog, threshold=0.9, n=3):
+    # leader clustering: entries are visited from the most to the least
+    # frequent one, every entry joins the most similar leader of the same
+    # origin or becomes a leader itself. Unlike single linkage, this can not
+    # chain unrelated entries together through a series of similar ones
+    # crash entries are not learned from logs, they are never merged
+    keys = [k for k in catalog if k not in FIXED_ENTRIES]
+    order = sorted(
+        range(len(keys)), key=lambda i: catalog[keys[i]].get("amount", 0), reverse=True
+    )
+    vectors = CatalogVectors(keys, n)
+    leaders = defaultdict(set)
+    clusters = OrderedDict()
+    for idx in order:
+        origin = catalog[keys[idx]].get("origin")
+        scores = vectors.similarities(idx, leaders[origin])
+        best = max(scores.items(), key=lambda i: (i[1], -i[0]), default=(None, 0))
+        if best[0] is not None and best[1] >= threshold:
+            clusters[keys[best[0]]].append(keys[idx])
+        else:
+            leaders[origin].add(idx)
+            clusters[keys[idx]] = [keys[idx]]
+    return clusters
+
+
+def escape_token(token):
+    return re.escape(token).replace(re.escape(PATH_PLACEHOLDER), Statistics.path_regex)
+
+
+def generalize_regex(keys):
+    # one regex for keys that only differ in some tokens, e.g. identifiers or
+    # numbers. the literal parts stay literal, so the prefilter of the
+    # ErrorMatcher keeps working. None if the keys do not line up
+    split = [re.split(r"(\s+)", k) for k in keys]
+    if len({len(s) for s in split}) != 1:
+        return None
+    parts = []
+    for tokens in zip(*split):
+        first = tokens[0]
+        if all(t == first for t in tokens):
+            parts.append(escape_token(first))
+            continue
+        if first.isspace() or any(t.isspace() for t in tokens):
+            # never across lines, the regexes run on the whole log
+            parts.append(r"[ \t]+")
+            continue
+        prefix = _common_prefix(tokens)
+        suffix = _common_prefix([t[len(prefix) :][::-1] for t in tokens])[::-1]
+        middles = [t[len(prefix) : len(t) - len(suffix)] for t in tokens]
+        if all(m.isdigit() for m in middles):
+            middle = r"\d+"
+        elif all(middles):
+            middle = r"\S+"
+        else:
+            middle = r"\S*"
+        parts.append(escape_token(prefix) + middle + escape_token(suffix))
+    return "".join(parts)
+
+
+def _common_prefix(strings):
+    prefix = strings[0]
+    for s in strings[1:]:
+        while not s.startswith(prefix):
+            prefix = prefix[:-1]
+    return prefix
+
+
+def merged_regex(catalog, keys):
+    if len(keys) == 1:
+        return catalog[keys[0]].get("regex")
+    regex = generalize_regex(keys)
+    if regex is not None:
+        try:
+            compiled = re.compile(regex)
+        except re.error:
+            compiled = None
+        # the new regex has to find every key that the old regexes found
+        if compiled is not None and all(
+            compiled.search(k)
+            for k in keys
+            if catalog[k].get("regex") and re.search(catalog[k]["regex"], k)
+        ):
+            return regex
+    regexes = [catalog[k]["regex"] for k in keys if catalog[k].get("regex")]
+    return "|".join("(?:{})".format(r) for r in dict.fromkeys(regexes)) or None
+
+
+def merge_cluster(catalog, keys):
+    canonical = keys[0]
+    entry = dict(catalog[canonical])
+    projects = ProjectSet()
+    amount = 0
+    for key in keys:
+        for name in catalog[key].get("projects", []):
+            projects.append(name)
+        amount += catalog[key].get("amount", 0)
+    entry["projects"] = projects.to_list()
+    entry["amount"] = amount
+    entry["regex"] = merged_regex(catalog, keys)
+    if len(keys) > 1:
+        entry["merged"] = keys[1:]
+    return entry
+
+
+def dedup_catalog(catalog, threshold=0.9, n=3):
+    """Merge near duplicate entries of an errortypes catalog.
+
+    Returns the slimmed catalog and the mapping from every old key to the key
+    of its canonical entry.
+    """
+    clusters = cluster_entries(catalog, threshold, n)
+    slim = OrderedDict()
+    mapping = OrderedDict()
+    for key in catalog:
+        if key in FIXED_ENTRIES:
+            slim[key] = catalog[key]
+            mapping[key] = key
+    for canonical, keys in clusters.items():
+        slim[canonical] = merge_cluster(catalog, keys)
+        for key in keys:
+            mapping[key] = canonical
+    slim = OrderedDict(
+        sorted(slim.items(), key=lambda i: i[1].get("amount", 0), reverse=True)
+    )
+    return slim, mapping
+
+
+def matching_time(catalog, lines):
+    # time the regex and fuzzy stages of the error analysis for the given log
+    # lines against the catalog, returns (regex seconds, fuzzy seconds)
+    matcher = ErrorMatcher()
+    index = FuzzyIndex()
+    index.sync(catalog)
+    start = time()
+    matcher.search(catalog, "\n".join(lines))
+    regex_time = time() - start
+    start = time()
+    for line in lines:
+        if len(line) >= 1000:
+            continue
+        processed = utils.full_process(
+            re.sub(Statistics.path_regex, "PATH/FILE.TXT", line)
+        )
+        if processed:
+            index.extract(processed, catalog, limit=5)
+    return regex_time, time() - start
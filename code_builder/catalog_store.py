@@ -0,0 +1,298 @@
+import json
+import os
+import sqlite3
+import tempfile
+
+from collections import OrderedDict, defaultdict
+from os.path import dirname, abspath
+
+from .ci_systems.dep_index import write_index
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS errors (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT,
+    origin TEXT,
+    regex TEXT,
+    amount INTEGER NOT NULL DEFAULT 0,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS error_projects (
+    error_id INTEGER NOT NULL,
+    project TEXT NOT NULL,
+    PRIMARY KEY (error_id, project)
+);
+CREATE TABLE IF NOT EXISTS dep_mapping (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    missing TEXT NOT NULL UNIQUE,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS dep_mapping_deps (
+    mapping_id INTEGER NOT NULL,
+    package TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mapping_id, package)
+);
+CREATE TABLE IF NOT EXISTS dep_mapping_projects (
+    mapping_id INTEGER NOT NULL,
+    project TEXT NOT NULL,
+    PRIMARY KEY (mapping_id, project)
+);
+"""
+
+ERROR_COLUMNS = ("name", "origin", "regex")
+
+
+class CatalogChanges:
+    """Changes to errortypes and dep_mapping since the last write to the store.
+
+    Counters are kept as deltas, so several runs can add to the same entry
+    without overwriting each other.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.new_errors = OrderedDict()
+        self.error_amounts = defaultdict(int)
+        self.error_projects = defaultdict(list)
+        self.dep_sources = OrderedDict()
+        self.dep_counts = defaultdict(int)
+        self.dep_projects = defaultdict(list)
+
+    def __bool__(self):
+        return bool(
+            self.new_errors
+            or self.error_amounts
+            or self.error_projects
+            or self.dep_sources
+            or self.dep_counts
+            or self.dep_projects
+        )
+
+    def add_error(self, err, entry):
+        self.new_errors[err] = entry
+        for name in entry.get("projects", []):
+            self.error_projects[err].append(name)
+
+    def add_error_amount(self, err, amount=1):
+        self.error_amounts[err] += amount
+
+    def add_error_project(self, err, name):
+        self.error_projects[err].append(name)
+
+    def add_dependency(self, missing, source):
+        self.dep_sources.setdefault(missing, source)
+
+    def add_dependency_install(self, missing, package, count=1):
+        self.dep_counts[(missing, package)] += count
+
+    def add_dependency_project(self, missing, name):
+        self.dep_projects[missing].append(name)
+
+
+class CatalogStore:
+    """SQLite store for the errortypes and dependency mapping catalogs.
+
+    The database runs in WAL mode, every write is a short IMMEDIATE
+    transaction, so several builder runs on the same host can share it.
+    export_errors_json/export_dep_mapping_json produce the JSON files
+    in the format of code_builder/errortypes.json and dep_mapping.json.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        # created by the main thread, used by the StatisticsWorker, never by
+        # both at the same time
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # entries up to this id are known to the caller, see load_new_errors
+        self.last_error_id = 0
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        return _Transaction(self.connection)
+
+    def is_empty(self, cur=None):
+        cur = cur or self.connection.cursor()
+        errors = cur.execute("SELECT COUNT(*) FROM errors").fetchone()[0]
+        return errors == 0 and cur.execute(
+            "SELECT COUNT(*) FROM dep_mapping"
+        ).fetchone()[0] == 0
+
+    def import_json(self, errors, dep_mapping):
+        # initial import of the existing JSON catalogs into an empty store.
+        # The check and the import are one transaction, of several runs
+        # starting on an empty store only the first imports. Returns whether
+        # this one did
+        changes = CatalogChanges()
+        for err, entry in errors.items():
+            changes.add_error(err, entry)
+            changes.add_error_amount(err, entry.get("amount", 0))
+        for m, entry in dep_mapping.items():
+            changes.add_dependency(m, entry.get("source"))
+            for pkg, count in entry.get("deps", {}).items():
+                changes.add_dependency_install(m, pkg, count)
+            for name in entry.get("projects", []):
+                changes.add_dependency_project(m, name)
+        with self.transaction() as cur:
+            if not self.is_empty(cur):
+                return False
+            self._apply(cur, changes)
+        changes.clear()
+        return True
+
+    def apply(self, changes):
+        # write all changes in a single transaction, cost is O(changed entries)
+        with self.transaction() as cur:
+            self._apply(cur, changes)
+        changes.clear()
+
+    def _apply(self, cur, changes):
+        for err, entry in changes.new_errors.items():
+            extra = {
+                k: v
+                for k, v in entry.items()
+                if k not in ERROR_COLUMNS and k not in ("projects", "amount")
+            }
+            cur.execute(
+                "INSERT OR IGNORE INTO errors (key, name, origin, regex, extra) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    err,
+                    entry.get("name"),
+                    entry.get("origin"),
+                    entry.get("regex"),
+                    json.dumps(extra) if extra else None,
+                ),
+            )
+        for err, amount in changes.error_amounts.items():
+            cur.execute(
+                "UPDATE errors SET amount = amount + ? WHERE key = ?", (amount, err)
+            )
+        for err, projects in changes.error_projects.items():
+            cur.executemany(
+                "INSERT OR IGNORE INTO error_projects (error_id, project) "
+                "SELECT id, ? FROM errors WHERE key = ?",
+                [(name, err) for name in projects],
+            )
+        for m, source in changes.dep_sources.items():
+            cur.execute(
+                "INSERT OR IGNORE INTO dep_mapping (missing, source) VALUES (?, ?)",
+                (m, source),
+            )
+        for (m, pkg), count in changes.dep_counts.items():
+            cur.execute(
+                "INSERT INTO dep_mapping_deps (mapping_id, package, count) "
+                "SELECT id, ?, ? FROM dep_mapping WHERE missing = ? "
+                "ON CONFLICT (mapping_id, package) "
+                "DO UPDATE SET count = count + excluded.count",
+                (pkg, count, m),
+            )
+        for m, projects in changes.dep_projects.items():
+            cur.executemany(
+                "INSERT OR IGNORE INTO dep_mapping_projects (mapping_id, project) "
+                "SELECT id, ? FROM dep_mapping WHERE missing = ?",
+                [(name, m) for name in projects],
+            )
+
+    def _load_errors(self, where="", params=()):
+        errors = OrderedDict()
+        cur = self.connection.execute(
+            "SELECT id, key, name, origin, regex, amount, extra FROM errors "
+            + where
+            + " ORDER BY amount DESC, id",
+            params,
+        )
+        ids = {}
+        for id, key, name, origin, regex, amount, extra in cur.fetchall():
+            entry = {"name": name, "projects": [], "origin": origin, "regex": regex}
+            if extra:
+                entry.update(json.loads(extra))
+            entry["amount"] = amount
+            errors[key] = entry
+            ids[id] = key
+            self.last_error_id = max(self.last_error_id, id)
+        if ids:
+            cur = self.connection.execute(
+                "SELECT error_id, project FROM error_projects WHERE error_id >= ? "
+                "ORDER BY rowid",
+                (min(ids),),
+            )
+            for error_id, project in cur:
+                if error_id in ids:
+                    errors[ids[error_id]]["projects"].append(project)
+        return errors
+
+    def load_errors(self):
+        return self._load_errors()
+
+    def load_new_errors(self):
+        # entries other runs added since our last load
+        return self._load_errors("WHERE id > ?", (self.last_error_id,))
+
+    def load_dep_mapping(self):
+        mapping = OrderedDict()
+        ids = {}
+        cur = self.connection.execute(
+            "SELECT id, missing, source FROM dep_mapping ORDER BY id"
+        )
+        for id, missing, source in cur.fetchall():
+            mapping[missing] = {"deps": OrderedDict(), "source": source, "projects": []}
+            ids[id] = missing
+        cur = self.connection.execute(
+            "SELECT mapping_id, package, count FROM dep_mapping_deps ORDER BY rowid"
+        )
+        for mapping_id, package, count in cur:
+            mapping[ids[mapping_id]]["deps"][package] = count
+        cur = self.connection.execute(
+            "SELECT mapping_id, project FROM dep_mapping_projects ORDER BY rowid"
+        )
+        for mapping_id, project in cur:
+            mapping[ids[mapping_id]]["projects"].append(project)
+        return mapping
+
+    def export_errors_json(self, path):
+        write_json_atomic(path, self.load_errors())
+
+    def export_dep_mapping_json(self, path):
+        dep_mapping = self.load_dep_mapping()
+        write_json_atomic(path, dep_mapping)
+        write_index(dep_mapping, path)
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        # take the write lock right away, avoids deadlocks between readers
+        # that want to upgrade to writers
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.cursor.execute("COMMIT")
+        else:
+            self.cursor.execute("ROLLBACK")
+        self.cursor.close()
+        return False
+
+
+def write_json_atomic(path, data):
+    # other runs might read the file while we write it
+    fd, tmp = tempfile.mkstemp(dir=dirname(abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w") as o:
+        o.write(json.dumps(data, indent=2))
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
@@ -0,0 +1,249 @@
+import fcntl
+import os
+import re
+
+from contextlib import contextmanager
+from os.path import exists, getmtime, isdir, join
+from subprocess import PIPE, CompletedProcess
+from time import time
+
+# where the cache of the image is mounted in the container. apt uses it
+# through -o options instead of its default directories, so apt-get calls in
+# CI scripts keep their own directories and never run into the (non-blocking)
+# apt locks of another container
+MOUNT = "/var/cache/apt/shared"
+LOCK = "builder.lock"
+UPDATED = "builder.updated"
+# recently downloaded archives are never evicted, a container might be
+# about to install them
+EVICTION_GRACE = 600
+# set once this container updated (or found fresh) the shared lists, later
+# installs use them instead of the lists of the image
+_shared_lists = False
+
+
+# container side, the host sets APT_CACHE to the mount point
+
+
+def cache_dir():
+    return os.environ.get("APT_CACHE") or None
+
+
+@contextmanager
+def locked(shared):
+    # flock on the mounted lock file, containers share the kernel of the host.
+    # installs from the cache hold it shared, writers (update, download,
+    # eviction) exclusive
+    fd = os.open(join(cache_dir(), LOCK), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def apt_command(args, lists=False, no_locking=False):
+    cmd = "apt-get -o Dir::Cache::Archives={}/ ".format(join(cache_dir(), "archives"))
+    if lists:
+        cmd += "-o Dir::State::Lists={}/ ".format(join(cache_dir(), "lists"))
+    if no_locking:
+        # concurrent installs from the cache, our flock protects it
+        cmd += "-o Debug::NoLocking=1 "
+    return cmd + args
+
+
+def update(run, cwd=None):
+    # apt-get update into the shared lists, skipped if another container
+    # updated them less than APT_CACHE_MAX_AGE seconds ago
+    global _shared_lists
+    max_age = float(os.environ.get("APT_CACHE_MAX_AGE", 3600))
+    stamp = join(cache_dir(), UPDATED)
+    with locked(False):
+        if exists(stamp) and time() - getmtime(stamp) < max_age:
+            print(
+                "apt lists updated {:.0f} seconds ago, skipping update".format(
+                    time() - getmtime(stamp)
+                )
+            )
+            _shared_lists = True
+            return CompletedProcess(["apt-get", "update"], 0, "", "")
+        out = run(["bash", "-c", apt_command("update -y", lists=True)], cwd, stderr=PIPE)
+        if out.returncode == 0:
+            with open(stamp, "w"):
+                pass
+            _shared_lists = True
+    return out
+
+
+def install(run, args, cwd=None):
+    """Run apt-get args (install or build-dep) through the shared archives.
+
+    The archives are downloaded with the cache locked exclusively, the
+    install itself only holds it shared, so containers install in parallel.
+    Returns the CompletedProcess of the failing or the last apt-get call.
+    """
+    command, _, rest = args.partition(" ")
+    with locked(False):
+        out = run(
+            [
+                "bash",
+                "-c",
+                apt_command(command + " --download-only " + rest, _shared_lists),
+            ],
+            cwd,
+            stderr=PIPE,
+        )
+    if out.returncode != 0:
+        return out
+    with locked(True):
+        out = run(
+            ["bash", "-c", apt_command(args, _shared_lists, no_locking=True)],
+            cwd,
+            stderr=PIPE,
+        )
+        if out.returncode == 0:
+            touch_installed(run)
+    return out
+
+
+def touch_installed(run):
+    # the mtime of an archive is its last use, see AptCache.evict
+    out = run(
+        [
+            "dpkg-query",
+            "-W",
+            "-f",
+            "${Package}_${Version}_${Architecture}.deb\\n",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+    )
+    if out.returncode != 0:
+        return
+    # epochs are escaped in archive names
+    installed = set(out.stdout.replace(":", "%3a").splitlines())
+    archives = join(cache_dir(), "archives")
+    for name in os.listdir(archives):
+        if name in installed:
+            try:
+                os.utime(join(archives, name))
+            except OSError:
+                pass
+
+
+# host side
+
+
+class AptCache:
+    """Host directory with apt archives and lists shared by the build containers.
+
+    Every image has its own directory, archives/ and lists/ of different
+    distributions must not mix. The archives of all images are evicted least
+    recently used first when they exceed max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, max_age=3600, evict_interval=600):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+
+    @classmethod
+    def from_config(cls, cfg):
+        # None if the cache is disabled in build.cfg
+        root = cfg["build"].get("apt_cache")
+        if not root:
+            return None
+        return cls(
+            root,
+            int(float(cfg["build"].get("apt_cache_size", 20)) * 2 ** 30),
+            float(cfg["build"].get("apt_lists_max_age", 3600)),
+        )
+
+    def image_dir(self, image):
+        return join(self.root, re.sub(r"[^\w.-]", "_", image))
+
+    def prepare(self, image):
+        # create the directories of the image, evict from time to time
+        path = self.image_dir(image)
+        for sub in ("archives/partial", "lists/partial"):
+            os.makedirs(join(path, sub), exist_ok=True)
+        self.maybe_evict()
+        return path
+
+    def volumes(self, image):
+        return {self.prepare(image): {"mode": "rw", "bind": MOUNT}}
+
+    def environment(self):
+        return [
+            "APT_CACHE={}".format(MOUNT),
+            "APT_CACHE_MAX_AGE={}".format(self.max_age),
+        ]
+
+    def maybe_evict(self):
+        stamp = join(self.root, "builder.evicted")
+        if exists(stamp) and time() - getmtime(stamp) < self.evict_interval:
+            return
+        with open(stamp, "w"):
+            pass
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used archives until the cache fits.
+
+        Images whose cache is in use are skipped, never waited for. Returns
+        the number of bytes removed.
+        """
+        archives = []
+        for image in os.listdir(self.root):
+            path = join(self.root, image, "archives")
+            if not isdir(path):
+                continue
+            for name in os.listdir(path):
+                if not name.endswith(".deb"):
+                    continue
+                try:
+                    st = os.stat(join(path, name))
+                except OSError:
+                    continue
+                archives.append((st.st_mtime, st.st_size, image, name))
+        total = sum(a[1] for a in archives)
+        if total <= self.max_bytes:
+            return 0
+        archives.sort()
+        locks = {}
+        removed = 0
+        now = time()
+        try:
+            for mtime, size, image, name in archives:
+                if total - removed <= self.max_bytes or now - mtime < EVICTION_GRACE:
+                    break
+                if image not in locks:
+                    locks[image] = self.try_lock(image)
+                if locks[image] is None:
+                    continue
+                try:
+                    os.remove(join(self.root, image, "archives", name))
+                except OSError:
+                    continue
+                removed += size
+        finally:
+            for fd in locks.values():
+                if fd is not None:
+                    os.close(fd)
+        print(
+            "apt cache: evicted {:.1f} of {:.1f} MB".format(
+                removed / 2 ** 20, total / 2 ** 20
+            )
+        )
+        return removed
+
+    def try_lock(self, image):
+        # exclusive lock of the image cache or None if a container uses it
+        fd = os.open(join(self.root, image, LOCK), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
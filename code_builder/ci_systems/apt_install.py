@@ -1,5 +1,6 @@
 import json
 from .ci_helper import apt_install
+from .dep_index import DepIndex, index_path, install_packages
 
 
 class Context:
@@ -13,7 +14,16 @@ class Context:
 
 class Installer:
     def __init__(
-        self, repo_dir, build_dir, idx, ctx, name, project, dep_mapping_path, missing
+        self,
+        repo_dir,
+        build_dir,
+        idx,
+        ctx,
+        name,
+        project,
+        dep_mapping_path,
+        missing,
+        resolved=None,
     ):
         self.repository_path = repo_dir
         self.build_dir = build_dir
@@ -22,10 +32,19 @@ class Installer:
         self.output_log = ctx.out_log
         self.error_log = ctx.err_log
         self.project = project
-        with open(dep_mapping_path, "r") as f:
-            self.dependency_map = json.load(f)
+        # precomputed on the host, see dep_index.write_index, the mapping
+        # is only parsed if the index is missing or older than the mapping
+        self.dependency_index = DepIndex.load(
+            index_path(dep_mapping_path), dep_mapping_path
+        )
+        self.dependency_map = None
+        if self.dependency_index is None:
+            with open(dep_mapping_path, "r") as f:
+                self.dependency_map = json.load(f)
 
         self.missing = missing
+        # {dependency: [packages]} resolved on the host from the Contents index
+        self.resolved = resolved or {}
 
     def install(self, builder = None):
         # let's try to install using previous dependencies (if there are any)
@@ -34,21 +53,28 @@ class Installer:
             return
         pkgs_to_install = []
         for m, source in self.missing:
+            if m in self.resolved:
+                print("{} is provided by {}".format(m, self.resolved[m]))
+                pkgs_to_install.extend(self.resolved[m])
+                continue
             # compare dependencies both ways
-            matches = [
-                key
-                for key in self.dependency_map
-                if m.lower() in key.lower() or key.lower() in m.lower()
-            ]
+            if self.dependency_index is not None:
+                matches, packages = self.dependency_index.resolve(m)
+            else:
+                matches = [
+                    key
+                    for key in self.dependency_map
+                    if m.lower() in key.lower() or key.lower() in m.lower()
+                ]
+                # install the packages that were installed every time
+                packages = [
+                    pkg
+                    for match in matches
+                    for pkg in install_packages(self.dependency_map[match])
+                ]
             # if m in self.dependency_map:
             print("dependency serach matched to:\n", matches)
-            for match in matches:
-                # we can install the pkgs in here, maybe take those with more than min number of installs
-                installs = [i for _, i in self.dependency_map[match]["deps"].items()]
-                for pkg, number in self.dependency_map[match]["deps"].items():
-                    # install if this package was installed everytime
-                    if number == max(installs):
-                        pkgs_to_install.append(pkg)
+            pkgs_to_install.extend(packages)
 
             if not matches:
                 # maybe just try, problem is that apt search is garbage
@@ -2,7 +2,11 @@ import sys
 import subprocess
 import os
 import re
+from collections import OrderedDict
 from subprocess import CalledProcessError, CompletedProcess, PIPE
+from time import time
+
+from . import apt_cache
 
 
 def decode(stream):
@@ -167,10 +171,90 @@ def apt_install_1(logger, pkgs, project=None, verbose=True):
     return True
 
 
-def apt_install(logger, pkgs, project=None, verbose=True):
+# apt messages naming the requested package that can not be installed
+APT_MISSING_PATTERNS = [
+    re.compile(r"Unable to locate package (\S+)"),
+    re.compile(r"E: Package '(.*)' has no installation candidate"),
+    re.compile(r"E: Couldn't find any package by (?:glob|regex) '(.*)'"),
+    re.compile(r"E: Version '.*' for '(.*)' was not found"),
+]
+APT_INSTALL = "install -y --force-yes --no-install-recommends "
+# seconds an apt-get invocation costs on its own, estimated from the
+# invocations of the container, see record_apt_overhead
+_apt_overhead = None
+
+
+def apt_get(args, cwd=None):
+    # apt-get args, through the apt cache of the host if it is mounted
+    if apt_cache.cache_dir():
+        if args.startswith("update"):
+            return apt_cache.update(run, cwd)
+        return apt_cache.install(run, args, cwd)
+    return run(["bash", "-c", "apt-get " + args], cwd, stderr=PIPE)
+
+
+def record_apt_overhead(seconds):
+    # a failed install does all the work of an invocation except for
+    # installing, i.e. what batching saves per package. A successful batch
+    # also installs, its time says nothing about the overhead. The smallest
+    # estimate is kept
+    global _apt_overhead
+    if _apt_overhead is None or seconds < _apt_overhead:
+        _apt_overhead = seconds
+
+
+def apt_missing_packages(stderr, pkgs):
+    # packages of the batch apt refused by name, they fail on their own too
+    missing = set()
+    for line in stderr.splitlines():
+        for pattern in APT_MISSING_PATTERNS:
+            r = pattern.search(line)
+            if r:
+                name = r[1].strip()
+                # pkg=version and pkg/release are reported without the suffix
+                missing.update(
+                    p for p in pkgs if p == name or re.split("[=/]", p)[0] == name
+                )
+    return missing
+
+
+def apt_install_batch(pkgs, stats, verbose=True):
+    """Install pkgs with as few apt-get invocations as possible.
+
+    The whole batch is tried at once. Packages apt names as unknown are
+    dropped and the rest is retried, other failures (e.g. conflicts) are
+    bisected until the failing packages are isolated. Returns the set of
+    packages that can not be installed, the ones that also fail when
+    installed one by one.
+    """
+    if not pkgs:
+        return set()
+    if verbose:
+        print("apt install {}".format(" ".join(pkgs)))
+    start = time()
+    out = apt_get(APT_INSTALL + " ".join(pkgs))
+    stats["invocations"] += 1
+    if out.returncode == 0:
+        return set()
+    record_apt_overhead(time() - start)
+    if len(pkgs) == 1:
+        return set(pkgs)
+    missing = apt_missing_packages(out.stderr or "", pkgs)
+    if missing:
+        if verbose:
+            print("retrying without {}".format(" ".join(sorted(missing))))
+        rest = [p for p in pkgs if p not in missing]
+        return missing | apt_install_batch(rest, stats, verbose)
+    half = len(pkgs) // 2
+    return apt_install_batch(pkgs[:half], stats, verbose) | apt_install_batch(
+        pkgs[half:], stats, verbose
+    )
+
+
+def apt_install(logger, pkgs, project=None, verbose=True, batched=True):
     if project is not None and project["build"].get("apt_not_found") is None:
         project["build"]["apt_not_found"] = []
-    cmd = "apt-get install -y --force-yes --no-install-recommends "
+    cmd = APT_INSTALL
     if isinstance(pkgs, str):
         pkg_list = [i.strip() for i in pkgs.split(" ")]
     elif isinstance(pkgs, list):
@@ -187,10 +271,54 @@ def apt_install(logger, pkgs, project=None, verbose=True):
         return False
     if verbose:
         print("APT INSTALL: {}".format(pkgs))
+    if batched:
+        start = time()
+        stats = {"invocations": 0}
+        # an empty name installs nothing, it never fails on its own
+        batch = list(OrderedDict.fromkeys(p for p in pkg_list if p))
+        failed = apt_install_batch(batch, stats, verbose)
+        for pkg in pkg_list:
+            if pkg not in failed:
+                continue
+            if verbose:
+                logger.error_log.print_error(
+                    logger.idx, "apt package {} could not be installed".format(pkg)
+                )
+            if project is not None:
+                project["build"]["apt_not_found"].append(pkg)
+        # one invocation per distinct package otherwise, negative if
+        # bisecting took more invocations than packages
+        saved = len(batch) - stats["invocations"]
+        message = (
+            "apt: {} packages in {} invocations, {:.1f} seconds, "
+            "saved {} invocations".format(
+                len(batch), stats["invocations"], time() - start, saved
+            )
+        )
+        # no apt-get is run just to time it, without a failed invocation
+        # the saving is only known in invocations
+        saved_seconds = None
+        if _apt_overhead is not None:
+            saved_seconds = saved * _apt_overhead
+            message += " and about {:.1f} seconds".format(saved_seconds)
+        print(message)
+        if project is not None:
+            # accumulated over all apt_install calls of the build
+            totals = project["build"].setdefault(
+                "apt_batch",
+                {"packages": 0, "invocations": 0, "saved_invocations": 0,
+                 "saved_seconds": 0.0},
+            )
+            totals["packages"] += len(batch)
+            totals["invocations"] += stats["invocations"]
+            totals["saved_invocations"] += saved
+            if saved_seconds is not None:
+                totals["saved_seconds"] += saved_seconds
+        return True
     for pkg in pkg_list:
         if verbose:
             print("apt install {}".format(pkg))
-        out = run(["bash", "-c", cmd + pkg], stderr=PIPE)
+        out = apt_get(cmd + pkg)
         if out.returncode != 0:
             if verbose:
                 logger.error_log.print_error(
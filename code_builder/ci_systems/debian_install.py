@@ -1,5 +1,4 @@
-from .ci_helper import run
-from subprocess import PIPE
+from .ci_helper import apt_get
 
 # different paths inside docker
 try:
@@ -31,21 +30,13 @@ class CiSystem:
         self.name = name
 
     def install(self, builder = None):
-        out = run(
-            ["apt-get", "update", "-y"],
-            cwd=self.repository_path,
-            stderr=PIPE,
-        )
+        out = apt_get("update -y", cwd=self.repository_path)
         if out.returncode != 0:
             self.error_log.print_error(
                 self.idx, "error in apt uppdate: {}".format(out.stderr)
             )
             return False
-        out = run(
-            ["apt-get", "build-dep", "-y", self.name],
-            cwd=self.repository_path,
-            stderr=PIPE,
-        )
+        out = apt_get("build-dep -y " + self.name, cwd=self.repository_path)
         if out.returncode != 0:
             self.error_log.print_error(
                 self.idx, "error in apt build-dep: {}".format(out.stderr)
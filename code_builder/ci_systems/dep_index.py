@@ -0,0 +1,323 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+from array import array
+
+MAGIC = b"FBADEPX3"
+# magic, keys, suffixes, distinct key lengths, slots of the hash table,
+# digest of the keys and packages, size and mtime (ns) of the dep_mapping.json
+# it was built for, bytes of the keys, the lowercase keys and the packages
+HEADER = struct.Struct("<8sIIIIIQQIII")
+
+
+def index_path(dep_mapping_path):
+    # the index is shipped next to dep_mapping.json
+    if dep_mapping_path.endswith(".json"):
+        return dep_mapping_path[: -len(".json")] + "_index.bin"
+    return dep_mapping_path + "_index.bin"
+
+
+def _encode(s):
+    return s.encode("utf-8", "surrogatepass")
+
+
+def _slot(key, slots):
+    return zlib.crc32(key) & (slots - 1)
+
+
+def install_packages(entry):
+    # the packages of a dep_mapping entry that were installed every time
+    deps = entry.get("deps", {})
+    if not deps:
+        return []
+    most = max(deps.values())
+    return [pkg for pkg, number in deps.items() if number == most]
+
+
+def mapping_digest(dep_mapping):
+    # what the index holds of the mapping, the project lists do not matter
+    digest = 0
+    for key, entry in dep_mapping.items():
+        digest = zlib.crc32(
+            _encode(json.dumps([key, install_packages(entry)]) + "\n"), digest
+        )
+    return digest
+
+
+def mapping_stat(dep_mapping_path):
+    st = os.stat(dep_mapping_path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(dep_mapping, stat=(0, 0), digest=None):
+    """Precompute the lookups of the dependency mapping.
+
+    The file is HEADER followed by uint32 arrays and the utf-8 strings:
+
+    key_offsets, lowered_offsets, package_offsets: where key i, its
+    lowercase form and its packages ("\\n" separated) start in the blobs at
+    the end, n + 1 entries each
+    lengths: the distinct lengths of the lowercase keys
+    table: open addressing hash table (crc32) of the lowercase keys, key id
+    + 1 per slot, 0 for empty, for keys contained in a query
+    suffix_keys, suffix_offsets: key id and byte offset of every suffix of
+    every lowercase key, sorted by the suffix, for queries contained in a key
+    """
+    keys = list(dep_mapping)
+    encoded = [_encode(k) for k in keys]
+    lowered = [_encode(k.lower()) for k in keys]
+    packages = [_encode("\n".join(install_packages(dep_mapping[k]))) for k in keys]
+    # utf-8 keeps substrings and the order of code points, only suffixes
+    # starting at a character are needed
+    suffixes = [
+        (i, o)
+        for i, k in enumerate(lowered)
+        for o in range(len(k))
+        if k[o] & 0xC0 != 0x80
+    ]
+    suffixes.sort(key=lambda s: lowered[s[0]][s[1] :])
+    lengths = sorted(set(len(k) for k in lowered))
+    slots = 1
+    while slots < 2 * len(keys):
+        slots *= 2
+    table = array("I", [0]) * slots
+    for i, k in enumerate(lowered):
+        slot = _slot(k, slots)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i + 1
+
+    def offsets(blobs):
+        result = array("I", [0])
+        for b in blobs:
+            result.append(result[-1] + len(b))
+        return result
+
+    blobs = [b"".join(encoded), b"".join(lowered), b"".join(packages)]
+    parts = [
+        HEADER.pack(
+            MAGIC,
+            len(keys),
+            len(suffixes),
+            len(lengths),
+            slots,
+            mapping_digest(dep_mapping) if digest is None else digest,
+            stat[0],
+            stat[1],
+            len(blobs[0]),
+            len(blobs[1]),
+            len(blobs[2]),
+        ),
+        offsets(encoded).tobytes(),
+        offsets(lowered).tobytes(),
+        offsets(packages).tobytes(),
+        array("I", lengths).tobytes(),
+        table.tobytes(),
+        array("I", (s[0] for s in suffixes)).tobytes(),
+        array("I", (s[1] for s in suffixes)).tobytes(),
+    ]
+    return b"".join(parts + blobs)
+
+
+class DepIndex:
+    """Finds the keys of dep_mapping.json related to a missing dependency.
+
+    match(m) returns the same keys as
+    [k for k in dep_mapping if m.lower() in k.lower() or k.lower() in m.lower()]
+    without looking at every key: the keys inside m are looked up in a hash
+    table by sliding a window of every key length over m, the keys
+    containing m are a range of the sorted suffixes. The packages of the
+    keys are in the index too, the mapping itself is never parsed. The file
+    is memory mapped and checked against the size and mtime of the mapping,
+    opening it does not depend on the size of the mapping.
+    """
+
+    def __init__(self, data):
+        (
+            magic,
+            self.count,
+            suffix_count,
+            length_count,
+            self.slots,
+            self.digest,
+            self.mapping_size,
+            self.mapping_mtime,
+            keys_size,
+            lowered_size,
+            _,
+        ) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a dep_mapping index")
+        self.data = data
+        words = memoryview(data)[HEADER.size :]
+        pos = 0
+        arrays = []
+        for size in (
+            self.count + 1,
+            self.count + 1,
+            self.count + 1,
+            length_count,
+            self.slots,
+            suffix_count,
+            suffix_count,
+        ):
+            arrays.append(words[pos : pos + size * 4].cast("I"))
+            pos += size * 4
+        (
+            self.key_offsets,
+            self.lowered_offsets,
+            self.package_offsets,
+            self.lengths,
+            self.table,
+            self.suffix_keys,
+            self.suffix_offsets,
+        ) = arrays
+        self.keys_start = HEADER.size + pos
+        self.lowered_start = self.keys_start + keys_size
+        self.packages_start = self.lowered_start + lowered_size
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def load(cls, path, dep_mapping_path):
+        # None if there is no index for this dep_mapping.json, the caller
+        # falls back to comparing against every key
+        try:
+            index = cls.open(path)
+            stat = mapping_stat(dep_mapping_path)
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+        # dep_mapping.json is rewritten during a run, the index might be older
+        if (index.mapping_size, index.mapping_mtime) != stat:
+            return None
+        return index
+
+    def _string(self, start, offsets, i):
+        return self.data[start + offsets[i] : start + offsets[i + 1]]
+
+    def key(self, i):
+        return self._string(self.keys_start, self.key_offsets, i).decode(
+            "utf-8", "surrogatepass"
+        )
+
+    def lowered(self, i):
+        return self._string(self.lowered_start, self.lowered_offsets, i)
+
+    def packages(self, i):
+        packages = self._string(self.packages_start, self.package_offsets, i)
+        return packages.decode("utf-8", "surrogatepass").split("\n") if packages else []
+
+    def suffix(self, pos):
+        start = (
+            self.lowered_start
+            + self.lowered_offsets[self.suffix_keys[pos]]
+            + self.suffix_offsets[pos]
+        )
+        end = self.lowered_start + self.lowered_offsets[self.suffix_keys[pos] + 1]
+        return self.data[start:end]
+
+    def containing(self, query):
+        # ids of the keys that contain query, binary search for the first
+        # suffix >= query, all suffixes starting with query follow it
+        lo, hi = 0, len(self.suffix_keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.suffix(mid) < query:
+                lo = mid + 1
+            else:
+                hi = mid
+        ids = set()
+        while lo < len(self.suffix_keys) and self.suffix(lo).startswith(query):
+            ids.add(self.suffix_keys[lo])
+            lo += 1
+        return ids
+
+    def exact(self, key):
+        # ids of the keys whose lowercase form is key
+        ids = []
+        slot = _slot(key, self.slots)
+        while self.table[slot]:
+            i = self.table[slot] - 1
+            if self.lowered_offsets[i + 1] - self.lowered_offsets[i] == len(
+                key
+            ) and self.lowered(i) == key:
+                ids.append(i)
+            slot = (slot + 1) & (self.slots - 1)
+        return ids
+
+    def contained(self, query):
+        # ids of the keys that are substrings of query
+        ids = set()
+        for length in self.lengths:
+            if length > len(query):
+                break
+            for i in range(len(query) - length + 1):
+                ids.update(self.exact(query[i : i + length]))
+        return ids
+
+    def match_ids(self, m):
+        query = _encode(m.lower())
+        if not query:
+            # the empty string is in every key
+            return list(range(self.count))
+        return sorted(self.containing(query) | self.contained(query))
+
+    def match(self, m):
+        return [self.key(i) for i in self.match_ids(m)]
+
+    def resolve(self, m):
+        # (matching keys, packages to install for them)
+        ids = self.match_ids(m)
+        packages = []
+        for i in ids:
+            packages.extend(self.packages(i))
+        return [self.key(i) for i in ids], packages
+
+
+def update_index(dep_mapping_path):
+    # (re)build the index of a dep_mapping.json file unless it is up to date
+    if DepIndex.load(index_path(dep_mapping_path), dep_mapping_path) is not None:
+        return
+    with open(dep_mapping_path, "r") as f:
+        dep_mapping = json.load(f)
+    write_index(dep_mapping, dep_mapping_path)
+
+
+def write_index(dep_mapping, dep_mapping_path):
+    """Index dep_mapping, just written to dep_mapping_path.
+
+    The suffix sort is skipped if the keys and packages did not change
+    since the last index, only the size and mtime in the header are updated.
+    The file is replaced atomically, containers might be reading it.
+    """
+    path = index_path(dep_mapping_path)
+    stat = mapping_stat(dep_mapping_path)
+    digest = mapping_digest(dep_mapping)
+    data = None
+    try:
+        with open(path, "rb") as f:
+            old = f.read()
+        header = list(HEADER.unpack_from(old, 0))
+        if header[0] == MAGIC and header[5] == digest:
+            if (header[6], header[7]) == stat:
+                return
+            header[6], header[7] = stat
+            data = HEADER.pack(*header) + old[HEADER.size :]
+    except (IOError, OSError, struct.error):
+        pass
+    if data is None:
+        data = build_index(dep_mapping, stat, digest)
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    with os.fdopen(fd, "wb") as o:
+        o.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
@@ -24,8 +24,16 @@ from time import sleep
 import shutil
 
 from .statistics import Statistics
+from .stats_worker import StatisticsWorker
+from .supervisor import ContainerSupervisor
+from .journal import JOURNAL, Journal, load_build_dir, save_all_built
+from .scheduling import CostModel, ScheduleReport, load_history, order_projects
+from .resources import BuildResources, oom_retry_wanted
+from .ci_systems.dep_index import update_index
 from .database import get_database
 from .build_systems.build_systems import recognize_and_build
+from .contents_index import ContentsIndex
+from .dep_finder import DepFinder
 from .utils.driver import open_logfiles, recursively_get_files, recursively_get_files_containing
 
 init = False
@@ -59,6 +67,13 @@ class Context:
         self.err_log = err
 
 
+def start_workers(pool):
+    # fork the workers of pool now, before the main process starts threads:
+    # a child forked while one of them holds a lock (the catalog store, the
+    # statistics) would wait for it forever
+    pool.submit(int).result()
+
+
 def get_dir_size(start_path):
 
     # https://stackoverflow.com/questions/1392413/calculating-a-directorys-size-using-python
@@ -186,10 +201,13 @@ def download_and_build(
     global loggers
     ctx.set_loggers(loggers.stdout, loggers.stderr)
     try:
-        cloner.clone(idx, name, project)
+        # a retry builds the source of the first attempt again
+        if not (project.get("first_build") and exists(project["source"]["dir"])):
+            cloner.clone(idx, name, project)
     except Exception as e:
         print("error cloning {}:\n{}".format(name, e))
         project["status"] = "clone fail"
+        running_builds.pop(multiprocessing.current_process().name)
         return (idx, name, project)
     try:
         idx, name, new_project = recognize_and_build(
@@ -204,6 +222,78 @@ def download_and_build(
         )
         project["status"] = "docker_crash"
         new_project = project
+    running_builds.pop(multiprocessing.current_process().name)
+    print("| DONE building {}".format(name))
+    return (idx, name, new_project)
+
+
+def missing_deps_retry(name, project, cfg):
+    # (confident missing dependencies, resolved packages) of a failed build
+    # worth building once more with them installed, None otherwise
+    if cfg["build"].get("retry_missing_deps", "True") != "True":
+        return None
+    if (
+        project.get("missing_deps_retry")
+        or "build" not in project
+        or project["status"] in ("success", "crash", "docker_crash", "unrecognized")
+    ):
+        return None
+    contents_index = cfg["build"].get("contents_index") or None
+    finder = DepFinder(
+        ContentsIndex(contents_index)
+        if contents_index and exists(contents_index)
+        else None
+    )
+    try:
+        scanned = finder.scan_logs(project, name)
+    except Exception as e:
+        print("could not look for missing dependencies of {}: {}".format(name, e))
+        return None
+    if scanned is None:
+        return None
+    confident = scanned[0]
+    if not confident:
+        # no retry, Statistics.find_deps reuses the scan instead of reading
+        # the logs again
+        project["build"]["dep_scan"] = scanned
+        return None
+    return confident, finder.resolve(confident)
+
+
+def package_build(idx, name, project, target_dir, build_dir, ctx, running_builds):
+    # everything after the container exited: sizes, cleanup and upload of the
+    # artifacts. Runs in the package pool, the build slot is free already
+    running_builds[multiprocessing.current_process().name] = (idx, "packaging " + name)
+    global loggers
+    ctx.set_loggers(loggers.stdout, loggers.stderr)
+    new_project = project
+    if "source" not in project:
+        # the clone failed, nothing to package
+        running_builds.pop(multiprocessing.current_process().name)
+        running_builds["builds_left"] -= 1
+        return (idx, name, new_project)
+    if oom_retry_wanted(project, ctx.cfg):
+        # build_projects builds it again with more memory, a killed build is
+        # not worth packaging and the source stays for the retry
+        project["oom_retry_queued"] = True
+        running_builds.pop(multiprocessing.current_process().name)
+        running_builds["builds_left"] -= 1
+        return (idx, name, new_project)
+    retry = missing_deps_retry(name, project, ctx.cfg)
+    if retry is not None:
+        # build_projects queues it again, the source stays for the retry and
+        # the container installs the dependencies before building
+        project["missing_deps"], project["resolved_deps"] = retry
+        project["missing_deps_retry"] = True
+        project["first_build"] = project.pop("build")
+        # popped by whoever queues the retry, a failed retry never has it
+        project["retry_queued"] = True
+        running_builds.pop(multiprocessing.current_process().name)
+        running_builds["builds_left"] -= 1
+        print("| {} misses {}, queued for a retry".format(
+            name, ", ".join(dep for dep, _ in retry[0])
+        ))
+        return (idx, name, new_project)
     # save build dir and source dir size
     if "build" in project and "dir" in project["build"]:
         size, count = get_dir_size(project["build"]["dir"])
@@ -217,7 +307,6 @@ def download_and_build(
     if ctx.cfg["build"]["keep_source_files"] == "False":
         # delete source folder
         shutil.rmtree(project["source"]["dir"], ignore_errors=True)
-    print("| DONE building {}".format(name))
 
     # copy build artifacts to spcltorage server
     proj_build_dir = join(build_dir, basename(project["source"]["dir"]))
@@ -254,6 +343,7 @@ def download_and_build(
 
     running_builds.pop(multiprocessing.current_process().name)
     running_builds["builds_left"] -= 1
+    print("| DONE packaging {}".format(name))
     # print("\n| ".join("{}\t{}".format(k, v) for k, v in running_builds.items()))
     # print("|----------------")
     return (idx, name, new_project)
@@ -296,30 +386,78 @@ def build_projects(
     #     log.set_counter(ctx.projects_count)
     # ctx.set_loggers(loggers.stdout, loggers.stderr)
     start = time()
-    stats = Statistics(projects_count)
+    fuzzy_matching = cfg["build"].get("fuzzy_matching", "index")
+    contents_index = cfg["build"].get("contents_index") or None
+    # the catalog store can not be shared with the build processes,
+    # only the main statistics use it
+    stats = Statistics(
+        projects_count,
+        fuzzy_matching=fuzzy_matching,
+        catalog_store=cfg["build"].get("catalog_store") or None,
+        contents_index=contents_index,
+    )
+    # the containers look up dep_mapping.json through its index
+    try:
+        update_index(join(os.path.dirname(__file__), "dep_mapping.json"))
+    except (OSError, ValueError) as e:
+        print("could not index dep_mapping.json: {}".format(e))
     manager = Manager()
     running_builds = manager.dict()
     running_builds["builds_left"] = projects_count
 
-    previous_all_repositories = dict()
-    if exists(os.path.join(build_dir, "all_built.json")):
-        with open(os.path.join(build_dir, "all_built.json"), "r") as fin:
-            previous_all_repositories = json.load(fin)
-    
-    
-    if exists(os.path.join(build_dir, "intermediate_all_built.json")):
-        with open(os.path.join(build_dir, "intermediate_all_built.json"), "r") as fin:
-            temp_data = json.load(fin)
-            previous_all_repositories.update(temp_data)
+    # all_built.json and the journal of an interrupted run
+    previous_all_repositories = load_build_dir(build_dir)
+
+    # expected build times for the dispatch order, learned from earlier runs
+    schedule = cfg["build"].get("schedule", "longest_first")
+    history_files = [
+        p.strip() for p in cfg["build"].get("schedule_history", "").split(",") if p.strip()
+    ]
+    history = load_history(history_files)
+    history.update(previous_all_repositories)
+    cost_model = CostModel(history)
+    # cores of the host pinned to the containers and memory limits of the
+    # containers
+    resources = BuildResources(cfg, threads_count, cost_model, history)
+    retry_priority = cfg["build"].get("retry_priority", "last")
     
-    # print(f"Builds left: {running_builds['builds_left']}")
     # print(f"Previous all repo: {json.dumps(previous_all_repositories, indent=2)}")
-    with concurrent.futures.ProcessPoolExecutor(threads_count) as pool:
+    # the package stage: sizes, cleanup and upload of finished builds
+    package_workers = int(cfg["build"].get("package_workers", 2))
+    package_queue = int(cfg["build"].get("package_queue", 4))
+    with concurrent.futures.ProcessPoolExecutor(threads_count) as pool, \
+            concurrent.futures.ProcessPoolExecutor(package_workers) as package_pool:
+        start_workers(pool)
+        start_workers(package_pool)
+        # print(f"Builds left: {running_builds['builds_left']}")
+        stats_worker = StatisticsWorker(
+            stats,
+            log_dir,
+            cfg["output"]["time"],
+            Journal(os.path.join(build_dir, JOURNAL)),
+            projects_count,
+            flush_projects=int(cfg["build"].get("stats_flush_projects", 10)),
+            flush_interval=float(cfg["build"].get("stats_flush_interval", 60)),
+        )
+        stats_worker.start()
+        # one watcher for all containers: stalls, memory and oom, the build
+        # processes only wait for their container
+        ctx.container_stats = manager.dict()
+        supervisor = ContainerSupervisor(
+            ctx.container_stats,
+            float(cfg["build"].get("memory_sample_interval", 10)),
+        )
+        ctx.supervisor_run = supervisor.run_id
+        supervisor.start()
         database_processers = []
         # we need an instance of the statistics class for the dependency analysis
         # when we build twice
         all_repositories = {}
-        temporary_stats = Statistics(projects_count)
+        temporary_stats = Statistics(
+            projects_count,
+            fuzzy_matching=fuzzy_matching,
+            contents_index=contents_index,
+        )
         idx = 0
         for database, repositories in repositories_db.items():
             # my simple attempt:
@@ -329,84 +467,52 @@ def build_projects(
             # indices = list(range(repositories_idx + 1, repositories_idx + repo_count + 1))
             # idx = indices[0]
 
-            projects_to_build = random.sample(list(repositories.items()), len(list(repositories.items())))
-            projects_to_build = [(name, proj) for name, proj in projects_to_build if name not in previous_all_repositories] #TODO remove this in the end
+            projects_to_build = [
+                (name, proj)
+                for name, proj in repositories.items()
+                if name not in previous_all_repositories
+            ]
+            random.shuffle(projects_to_build)
+            projects_to_build = order_projects(projects_to_build, cost_model, schedule)
+            schedule_report = ScheduleReport(projects_to_build, cost_model, threads_count, schedule)
             
             running_builds["builds_left"] = len(projects_to_build)
             
+            # running builds and builds waiting for or in the package stage
             futures = []
+            package_futures = []
+            # submit times, reserved resources and projects of the running futures
+            dispatched = {}
+            allocated = {}
+            submitted = {}
+            # projects built again with their missing dependencies, once
+            deps_retried = set()
             idx_in_source = 0
 
-            while len(futures) < min(threads_count, len(projects_to_build)) and idx_in_source < len(projects_to_build):
-                name, proj = projects_to_build[idx_in_source]
-                if name in previous_all_repositories:
-                    idx_in_source += 1
-                    idx += 1
-                    running_builds["builds_left"] -= 1
-                    continue
-                future = pool.submit(
-                    initializer_func,
-                    ctx,
-                    download_and_build,
-                    (
-                        db_processor,
-                        idx,
-                        name,
-                        proj,
-                        target_dir,
-                        build_dir,
-                        ctx,
-                        temporary_stats,
-                        running_builds,
-                    ),
-                )
-                futures.append(future)
-                idx += 1
-                idx_in_source += 1
-            
-            while running_builds["builds_left"] > 0:
-                completed_futures, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
-
-                for future in completed_futures:
-                    future_idx, future_name, future_project = future.result()
-                    futures.remove(future)
-
-                    all_repositories[future_name] = future_project
-                    previous_all_repositories[future_name] = future_project
-                    print(f"Got back the result of the {future_name} project future. Writing to file...", flush = True)
-
-                    print(f"Writing intermediate_all_built to {os.path.join(build_dir, 'intermediate_all_built.json')}")
-                    with open(os.path.join(build_dir, "intermediate_all_built.json"), "w") as o:
-                        o.write(json.dumps(previous_all_repositories, indent = 2))
-
-                    if running_builds["builds_left"] % 5 == 0:
-                        print(f"Builds left: {running_builds['builds_left']}")
-
-                    start_stats_update = time()
-                    try:
-                        print(f"[{future_idx}/{projects_count}] stats for {future_name}")
-                        stats.update(future_project, future_name)
-                    except Exception as e:
-                        print("Error updating stats: {}".format(e))
-                    
-                    if not isdir(log_dir):
-                        makedirs(log_dir)
-                    timestamp = cfg["output"]["time"]
-                    stats.save_rebuild_json(log_dir, timestamp)
-                    stats.save_errors_json()
-                    stats.save_errorstat_json(log_dir, timestamp)
-                    stats.save_dependencies_json(log_dir, timestamp)
-    
-                    end_stats_update = time()
-                    print(f"Stats update for {future_name} took {end_stats_update - start_stats_update} seconds")
-
-                while idx_in_source < len(projects_to_build) and len(futures) < threads_count:
+            # driven by local state, builds_left is updated from several
+            # processes without a lock and only used for progress messages
+            while (
+                futures
+                or package_futures
+                or idx_in_source < len(projects_to_build)
+            ):
+                # start builds while there are containers, cores and memory left
+                # and the package stage keeps up, finished builds waiting for it
+                # take disk space
+                while (
+                    idx_in_source < len(projects_to_build)
+                    and len(futures) < threads_count
+                    and len(package_futures) < package_workers + package_queue
+                ):
                     name, proj = projects_to_build[idx_in_source]
                     if name in previous_all_repositories:
                         idx_in_source += 1
                         idx += 1
                         running_builds["builds_left"] -= 1
                         continue
+                    reservation = resources.admit(name, proj)
+                    if reservation is None:
+                        break
                     futures.append(pool.submit(
                         initializer_func,
                         ctx,
@@ -423,15 +529,110 @@ def build_projects(
                             running_builds,
                         ),
                     ))
+                    dispatched[futures[-1]] = time()
+                    allocated[futures[-1]] = reservation
+                    submitted[futures[-1]] = (name, proj)
+                    schedule_report.started(dispatched[futures[-1]])
                     idx += 1
                     idx_in_source += 1
+
+                if not futures and not package_futures:
+                    break
+                completed_futures, _ = concurrent.futures.wait(futures + package_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in completed_futures:
+                    if future in futures:
+                        # the container exited, its cores and memory are free for
+                        # the next build, the artifacts go to the package stage
+                        future_idx, future_name, future_project = future.result()
+                        futures.remove(future)
+                        now = time()
+                        schedule_report.finished(future_name, now - dispatched.pop(future), now)
+                        resources.release(allocated.pop(future))
+                        package_futures.append(package_pool.submit(
+                            initializer_func,
+                            ctx,
+                            package_build,
+                            (
+                                future_idx,
+                                future_name,
+                                future_project,
+                                target_dir,
+                                build_dir,
+                                ctx,
+                                running_builds,
+                            ),
+                        ))
+                        submitted[package_futures[-1]] = submitted.pop(future)
+                        continue
+
+                    future_idx, future_name, future_project = future.result()
+                    package_futures.remove(future)
+                    retried = submitted.pop(future)
+                    if future_project.pop("oom_retry_queued", False):
+                        # build it again right away
+                        resources.oom_retry(future_name, retried[1])
+                        projects_to_build.insert(idx_in_source, retried)
+                        running_builds["builds_left"] += 1
+                        continue
+                    if (
+                        future_project.pop("retry_queued", False)
+                        and future_name not in deps_retried
+                    ):
+                        deps_retried.add(future_name)
+                        # failed with missing dependencies, build it once more
+                        # with them, after the other projects or right away
+                        if retry_priority == "next":
+                            projects_to_build.insert(idx_in_source, (future_name, future_project))
+                        else:
+                            projects_to_build.append((future_name, future_project))
+                        running_builds["builds_left"] += 1
+                        continue
+
+                    all_repositories[future_name] = future_project
+                    previous_all_repositories[future_name] = future_project
+                    print(f"Got back the result of the {future_name} project future.", flush = True)
+
+                    if running_builds["builds_left"] % 5 == 0:
+                        print(f"Builds left: {running_builds['builds_left']}")
+
+                    # error analysis and writing the jsons happen in the background,
+                    # we can start the next build right away
+                    stats_worker.submit(future_idx, future_name, future_project)
+
+            schedule_report.print_report()
                 
+    supervisor.stop()
+    # wait for the statistics of the last projects
+    stats_worker.stop()
     end = time()
     print("Process repositorites in %f [s]" % (end - start))
+    save_results(
+        ctx,
+        stats,
+        build_dir,
+        log_dir,
+        previous_all_repositories,
+        all_repositories,
+        projects_count,
+    )
+
+
+def save_results(
+    ctx,
+    stats,
+    build_dir,
+    log_dir,
+    previous_all_repositories,
+    all_repositories,
+    projects_count,
+):
+    # all_built.json, the summary and the statistics files at the end of a
+    # run, also used by the coordinator of a build farm
+    cfg = ctx.cfg
     start = time()
     
-    with open(os.path.join(build_dir, "all_built.json"), "w") as o:
-        o.write(json.dumps(previous_all_repositories, indent = 2))
+    save_all_built(build_dir, previous_all_repositories)
 
     with open(os.path.join(build_dir, "current_build.json"), "w",) as o:
         o.write(json.dumps(all_repositories, indent=2))
@@ -469,6 +670,7 @@ def build_projects(
     stats.save_errors_json()
     stats.save_errorstat_json(log_dir, timestamp)
     stats.save_dependencies_json(log_dir, timestamp)
+    stats.export_catalogs()
     # timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
     with open(
         join(log_dir, "summary_{}_{}.txt".format(timestamp, projects_count)), "w"
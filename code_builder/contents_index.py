@@ -0,0 +1,163 @@
+import gzip
+import mmap
+import os
+import re
+import struct
+
+MAGIC = b"FBACIDX1"
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+
+HEADER_EXTENSIONS = (".h", ".hh", ".hpp", ".hxx", ".h++", ".inc", ".tcc")
+# a CMake dependency recorded with its version, e.g. Boost_1.55.0
+CMAKE_VERSION = re.compile(r"^(.+?)_(\d[\w.]*)$")
+
+
+def relevant_path(path):
+    # only the files a missing dependency can point to end up in the index
+    return (
+        path.startswith("usr/include/")
+        or (path.endswith(".pc") and "/pkgconfig/" in path)
+        or path.lower().endswith("config.cmake")
+        or path.startswith(("usr/bin/", "bin/", "usr/sbin/", "sbin/"))
+    )
+
+
+def parse_contents(lines, keep_all=False):
+    # Contents-<arch> lines: "path   section/pkg,section/pkg2"
+    for line in lines:
+        line = line.rstrip("\n")
+        parts = line.rsplit(None, 1)
+        if len(parts) != 2:
+            continue
+        path, locations = parts
+        path = path.strip()
+        # only the "./" prefix, paths may start with a dot
+        if path.startswith("./"):
+            path = path[2:]
+        # header of the old Contents format
+        if path == "FILE" and locations == "LOCATION":
+            continue
+        if not keep_all and not relevant_path(path):
+            continue
+        pkgs = [loc.rsplit("/", 1)[-1] for loc in locations.split(",")]
+        yield path, pkgs
+
+
+def build_index(contents_path, index_path, keep_all=False):
+    """Convert a Debian Contents file into the lookup file of ContentsIndex.
+
+    The records are sorted by the reversed path, so all paths with a given
+    suffix are a contiguous range. Returns the number of records.
+    """
+    opener = gzip.open if contents_path.endswith(".gz") else open
+    with opener(contents_path, "rt", errors="replace") as f:
+        records = sorted(
+            (path[::-1].encode(), ",".join(pkgs).encode())
+            for path, pkgs in parse_contents(f, keep_all)
+        )
+    tmp = index_path + ".tmp"
+    with open(tmp, "wb") as o:
+        o.write(HEADER.pack(MAGIC, len(records)))
+        offset = 0
+        for key, pkgs in records:
+            o.write(OFFSET.pack(offset))
+            offset += len(key) + len(pkgs) + 2
+        for key, pkgs in records:
+            o.write(key + b"\0" + pkgs + b"\n")
+    os.replace(tmp, index_path)
+    return len(records)
+
+
+class ContentsIndex:
+    """Memory mapped lookup from a path suffix to the Debian packages.
+
+    A lookup is a binary search over the offsets table, a few microseconds
+    and no memory besides the pages of the file the search touches. The file
+    is opened on the first lookup and not pickled, so the index can be part
+    of the statistics sent to the build processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+        self.count = 0
+        self.data_start = 0
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def open(self):
+        with open(self.path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a contents index".format(self.path))
+        self.data_start = HEADER.size + self.count * OFFSET.size
+
+    def record(self, i):
+        start = self.data_start + OFFSET.unpack_from(
+            self.mm, HEADER.size + i * OFFSET.size
+        )[0]
+        end = self.mm.find(b"\n", start)
+        key, _, pkgs = self.mm[start:end].partition(b"\0")
+        return key, pkgs
+
+    def lookup(self, suffix):
+        # [(path, [packages])] of all paths ending with suffix
+        if self.mm is None:
+            self.open()
+        prefix = suffix[::-1].encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        results = []
+        while lo < self.count:
+            key, pkgs = self.record(lo)
+            if not key.startswith(prefix):
+                break
+            results.append((key.decode()[::-1], pkgs.decode().split(",")))
+            lo += 1
+        return results
+
+    def candidates(self, dep, source=None):
+        # path suffixes the missing dependency could be provided by
+        if dep.endswith(HEADER_EXTENSIONS):
+            return ["/" + dep.lstrip("/")]
+        if dep.endswith(".pc"):
+            return ["/pkgconfig/" + dep]
+        if source == "bash":
+            # bin/, sbin/, usr/bin/ and usr/sbin/
+            return ["bin/" + dep]
+        m = CMAKE_VERSION.match(dep)
+        name = m[1] if m and source == "cmake" else dep
+        suffixes = [
+            "/{}Config.cmake".format(name),
+            "/{}-config.cmake".format(name.lower()),
+        ]
+        if source != "cmake":
+            suffixes.append("/pkgconfig/{}.pc".format(dep))
+        return suffixes
+
+    def resolve(self, dep, source=None):
+        # packages providing the missing dependency, [] if unknown. Of all
+        # matching paths, the ones with the least directories are the most
+        # likely, e.g. usr/include/zlib.h and not usr/include/foo/zlib.h
+        for suffix in self.candidates(dep, source):
+            matches = self.lookup(suffix)
+            if not matches:
+                continue
+            depth = min(path.count("/") for path, _ in matches)
+            pkgs = set()
+            for path, path_pkgs in matches:
+                if path.count("/") == depth:
+                    pkgs.update(path_pkgs)
+            return sorted(pkgs)
+        return []
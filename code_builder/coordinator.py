@@ -0,0 +1,252 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import makedirs
+from os.path import exists, join
+from time import sleep, time
+
+from .code_builder import Context, save_results
+from .journal import JOURNAL, Journal, load_build_dir
+from .scheduling import CostModel, load_history, order_projects
+from .statistics import Statistics
+from .stats_worker import StatisticsWorker
+
+
+def farm_config(cfg):
+    # the [farm] section of build.cfg, defaults without one
+    return cfg["farm"] if "farm" in cfg else {}
+
+
+class Coordinator:
+    """Owns the project queue and the journal of a run built by many hosts.
+
+    Build agents lease projects, build them with their local docker and
+    send the results back. A lease runs out after lease_time seconds unless
+    the agent renews it with a heartbeat; projects of an agent that stopped
+    sending them go back to the front of the queue, at most lease_retries
+    times. The run ends when every project came back or was given up.
+    """
+
+    def __init__(self, repositories_db, build_dir, log_dir, cfg):
+        farm = farm_config(cfg)
+        self.build_dir = build_dir
+        self.log_dir = log_dir
+        self.cfg = cfg
+        self.lease_time = float(farm.get("lease_time", 120))
+        self.lease_retries = int(farm.get("lease_retries", 3))
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not exists(build_dir):
+            makedirs(build_dir)
+        # all_built.json and the journal of an interrupted run
+        self.previous = load_build_dir(build_dir)
+        self.results = {}
+        projects = []
+        self.databases = {}
+        for database, repositories in repositories_db.items():
+            for name, project in repositories.items():
+                if name in self.previous:
+                    continue
+                projects.append((name, project))
+                self.databases[name] = database
+        history = load_history(
+            [
+                p.strip()
+                for p in cfg["build"].get("schedule_history", "").split(",")
+                if p.strip()
+            ]
+        )
+        history.update(self.previous)
+        self.queue = order_projects(
+            projects, CostModel(history), cfg["build"].get("schedule", "longest_first")
+        )
+        self.projects_count = len(self.queue)
+        self.indices = {name: idx for idx, (name, _) in enumerate(self.queue, 1)}
+        # name: (agent, expiry, project)
+        self.leases = {}
+        self.attempts = {}
+        self.heartbeats = {}
+        # agents told that the run is done
+        self.released = set()
+        self.lost = []
+        self.stats = Statistics(
+            self.projects_count,
+            fuzzy_matching=cfg["build"].get("fuzzy_matching", "index"),
+            catalog_store=cfg["build"].get("catalog_store") or None,
+            contents_index=cfg["build"].get("contents_index") or None,
+        )
+        self.stats_worker = StatisticsWorker(
+            self.stats,
+            log_dir,
+            cfg["output"]["time"],
+            Journal(join(build_dir, JOURNAL)),
+            self.projects_count,
+            flush_projects=int(cfg["build"].get("stats_flush_projects", 10)),
+            flush_interval=float(cfg["build"].get("stats_flush_interval", 60)),
+        )
+        if not self.queue:
+            self.finished.set()
+
+    def lease(self, agent, slots):
+        # up to slots projects for the agent, done once nothing is left
+        items = []
+        with self.lock:
+            self.heartbeats[agent] = time()
+            if self.finished.is_set():
+                self.released.add(agent)
+            while self.queue and len(items) < slots:
+                name, project = self.queue.pop(0)
+                self.leases[name] = (agent, time() + self.lease_time, project)
+                self.attempts[name] = self.attempts.get(name, 0) + 1
+                items.append(
+                    {
+                        "idx": self.indices[name],
+                        "name": name,
+                        "database": self.databases[name],
+                        "project": project,
+                    }
+                )
+            return {
+                "items": items,
+                "lease_time": self.lease_time,
+                # artifacts of all agents go to the same run on the server
+                "run": self.cfg["output"]["time"],
+                "done": self.finished.is_set(),
+            }
+
+    def heartbeat(self, agent, names):
+        # renew the leases of the agent, returns the names it lost
+        with self.lock:
+            now = time()
+            self.heartbeats[agent] = now
+            lost = []
+            for name in names:
+                lease = self.leases.get(name)
+                if lease is None or lease[0] != agent:
+                    lost.append(name)
+                else:
+                    self.leases[name] = (agent, now + self.lease_time, lease[2])
+            if self.finished.is_set():
+                self.released.add(agent)
+            return {"lost": lost, "done": self.finished.is_set()}
+
+    def result(self, agent, name, project):
+        # False if the project was done already, e.g. by the agent that got
+        # it after the lease of this one ran out
+        with self.lock:
+            if (
+                name in self.results
+                or name not in self.indices
+                or self.finished.is_set()
+            ):
+                return {"accepted": False}
+            lease = self.leases.pop(name, None)
+            if lease is None:
+                # the lease ran out but the project is back before anyone
+                # else got it, take the result anyway
+                self.queue = [p for p in self.queue if p[0] != name]
+                if name in self.lost:
+                    self.lost.remove(name)
+            self.results[name] = project
+            self.previous[name] = project
+            print(
+                "[{}/{}] {} built by {}".format(
+                    len(self.results), self.projects_count, name, agent
+                ),
+                flush=True,
+            )
+            self.check_finished()
+        self.stats_worker.submit(self.indices[name], name, project)
+        return {"accepted": True}
+
+    def expire(self):
+        # requeue the projects whose lease ran out
+        with self.lock:
+            now = time()
+            for name, (agent, expiry, project) in list(self.leases.items()):
+                if expiry > now:
+                    continue
+                del self.leases[name]
+                if self.attempts[name] > self.lease_retries:
+                    print("giving up {}, lost by {} agents".format(name, self.attempts[name]))
+                    self.lost.append(name)
+                    continue
+                print("lease of {} by {} ran out, requeued".format(name, agent))
+                self.queue.insert(0, (name, project))
+            self.check_finished()
+
+    def check_finished(self):
+        if not self.queue and not self.leases:
+            self.finished.set()
+
+    def serve(self, host, port):
+        server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+        server.coordinator = self
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print(
+            "coordinating {} projects on {}:{}".format(
+                self.projects_count, host, server.server_address[1]
+            ),
+            flush=True,
+        )
+        self.stats_worker.start()
+        start = time()
+        while not self.finished.wait(min(5.0, self.lease_time / 4)):
+            self.expire()
+        # agents asking now are told that the run is done
+        self.stats_worker.stop()
+        print("Process repositorites in %f [s]" % (time() - start))
+        if self.lost:
+            print("{} projects given up: {}".format(len(self.lost), ", ".join(self.lost)))
+        save_results(
+            Context(self.projects_count, self.cfg),
+            self.stats,
+            self.build_dir,
+            self.log_dir,
+            self.previous,
+            self.results,
+            self.projects_count,
+        )
+        # let the agents learn that the run is done before going away
+        deadline = time() + float(farm_config(self.cfg).get("linger", 30))
+        while time() < deadline and set(self.heartbeats) - self.released:
+            sleep(0.5)
+        server.shutdown()
+        server.server_close()
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    # POST /lease {agent, slots}, /heartbeat {agent, names} and /result
+    # {agent, name, project}, JSON in and out
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if self.path == "/lease":
+                reply = coordinator.lease(request["agent"], int(request["slots"]))
+            elif self.path == "/heartbeat":
+                reply = coordinator.heartbeat(request["agent"], request["names"])
+            elif self.path == "/result":
+                reply = coordinator.result(
+                    request["agent"], request["name"], request["project"]
+                )
+            else:
+                self.send_error(404)
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request is too much for a run of thousands of projects
+        pass
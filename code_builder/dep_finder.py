@@ -1,44 +1,84 @@
-from os.path import join
+from os.path import exists, getsize, join
 import re
 
+from . import log_reader
+from .patterns import PatternTable
+
+# todo: differentiate between definitive and maybe dependencies
+# (pattern, source), group 1 of the pattern is the dependency
+PATTERNS = PatternTable(
+    [
+        (r".*\s(.+?): [C|c]ommand not found", "bash"),
+        (re.escape("[Error] Package ") + r"(.*) is not installed", None,),
+        (r"error: no (.*) found", None),
+        # error: Libtool library used but 'LIBTOOL' is undefined
+        (r"error: (.*) library used but .* is undefined", "autotools"),
+        # match everyting until a (space) or .(space)
+        (re.escape("Error: missing ") + r"(.+?(?=\s|\.\s))", None),
+        (r"Cannot find (\S*)\.", None),
+        # Can't exec "autoreconf-dickey":
+        (re.escape("Can't exec ") + r"\"(.*?)\"", None),
+        # /bin/sh: 1: rake: not found
+        (r": .*: (.*?): not found", "bash"),
+        (r"configure: error: The (.*?) script could not be found", "debian"),
+        # debian/rules:8: /usr/share/cdbs/1/rules/utils.mk: No such file or directory
+        (r"^.*:\d+: /usr/share/.*/(.*?)\.mk: No such file or directory", "debian"),
+    ]
+)
+CONFIDENT_PATTERNS = PatternTable(
+    [
+        (re.escape("] ") + r"(.*)" + re.escape(" not found or too old"), None),
+        (re.escape("ImportError: No module named '") + r"(.*)\'", "python"),
+        (re.escape("Please install ") + r"(.*)\.", None),
+        (r"dh: unable to load addon (.*?):", "debian"),
+        # (r"you may need to install the (.*?) module", "debian"),
+        # clang header not found
+        # ./styles.h:26:10: fatal error: 'clxclient.h' file not found
+        (r"^.*\..*\:\d+\:\d+\:.*error\: '(.*?)'.*$", "clang"),
+        # find a better way to handle the following, but for now, see if is worth it
+        # Project ERROR: Unknown module(s) in QT: core gui printsupport svg
+        (r"Project ERROR: Unknown module\(s\) in (.*)", "debian"),
+        # debian/rules:8: /usr/share/cdbs/1/rules/utils.mk: No such file or directory
+        (r"^.*:\d+: /usr/share/(.*?)/.*: No such file or directory", "debian"),
+    ]
+)
+# cmake has multiline errors, so we check the errors found for that
+# also we can be pretty confident in cmake errors
+CMAKE_DEP_PATTERNS = PatternTable(
+    [
+        (re.escape('package configuration file provided by "') + r"(.+?(?=\"))",),
+        (re.escape("Could NOT find ") + r"(.+?(?=\s|\.\s))",),
+        (re.escape("Unable to find the ") + r"(.*)" + re.escape("header files."),),
+    ]
+)
+CMAKE_VERSION_RE = re.compile(
+    re.escape('Required is at least version "') + r"(.+?(?=\"))"
+)
+
 
 class DepFinder:
-    def __init__(self):
-        # todo: differentiate between definitive and maybe dependencies
-        self.patterns = [
-            (r".*\s(.+?): [C|c]ommand not found", "bash"),
-            (re.escape("[Error] Package ") + r"(.*) is not installed", None,),
-            (r"error: no (.*) found", None),
-            # error: Libtool library used but 'LIBTOOL' is undefined
-            (r"error: (.*) library used but .* is undefined", "autotools"),
-            # match everyting until a (space) or .(space)
-            (re.escape("Error: missing ") + r"(.+?(?=\s|\.\s))", None),
-            (r"Cannot find (\S*)\.", None),
-            # Can't exec "autoreconf-dickey":
-            (re.escape("Can't exec ") + r"\"(.*?)\"", None),
-            # /bin/sh: 1: rake: not found
-            (r": .*: (.*?): not found", "bash"),
-            (r"configure: error: The (.*?) script could not be found", "debian"),
-            # debian/rules:8: /usr/share/cdbs/1/rules/utils.mk: No such file or directory
-            (r"^.*:\d+: /usr/share/.*/(.*?)\.mk: No such file or directory", "debian"),
-        ]
-        self.confident_patterns = [
-            (re.escape("] ") + r"(.*)" + re.escape(" not found or too old"), None),
-            (re.escape("ImportError: No module named '") + r"(.*)\'", "python"),
-            (re.escape("Please install ") + r"(.*)\.", None),
-            (r"dh: unable to load addon (.*?):", "debian"),
-            # (r"you may need to install the (.*?) module", "debian"),
-            # clang header not found
-            # ./styles.h:26:10: fatal error: 'clxclient.h' file not found
-            (r"^.*\..*\:\d+\:\d+\:.*error\: '(.*?)'.*$", "clang"),
-            # find a better way to handle the following, but for now, see if is worth it
-            # Project ERROR: Unknown module(s) in QT: core gui printsupport svg
-            (r"Project ERROR: Unknown module\(s\) in (.*)", "debian"),
-            # debian/rules:8: /usr/share/cdbs/1/rules/utils.mk: No such file or directory
-            (r"^.*:\d+: /usr/share/(.*?)/.*: No such file or directory", "debian"),
-        ]
+    def __init__(self, contents_index=None):
+        self.patterns = PATTERNS
+        self.confident_patterns = CONFIDENT_PATTERNS
+        # maps missing files to Debian packages, see contents_index.py
+        self.contents_index = contents_index
+
+    def resolve(self, deps):
+        # {dependency: [packages]} for the dependencies the contents index
+        # knows a package for
+        resolved = {}
+        if self.contents_index is None:
+            return resolved
+        for dep, source in deps:
+            pkgs = self.contents_index.resolve(dep, source)
+            if pkgs:
+                resolved[dep] = pkgs
+        return resolved
 
-    def analyze_logs(self, project, name):
+    def analyze_logs(self, project, name, scanned=None):
+        # (confident, other) missing dependencies of a failed build, the
+        # matched lines go to dep_lines. scanned is a scan_logs result of the
+        # same build, e.g. done by the package stage for its retry decision
         deps = []
         safe_deps = []
         # keep track of lines matched, makes it easier to debug
@@ -47,57 +87,74 @@ class DepFinder:
             print("no logfiles found for {}\n{}".format(name, project))
             return ([], [])
         # if project["build_system"] == "cmake":
-        # cmake has multiline errors, so we check for that
-        # also we can be pretty confident in cmake errors
-        cmake_dep_strings = [
-            re.escape('package configuration file provided by "') + r"(.+?(?=\"))",
-            re.escape("Could NOT find ") + r"(.+?(?=\s|\.\s))",
-            re.escape("Unable to find the ") + r"(.*)" + re.escape("header files."),
-        ]
         for err in project["build"].get("errortypes", []):
-            for s in cmake_dep_strings:
-                name = re.search(s, err)
-                if name:
-                    project["build"]["dep_lines"].append(err)
-                    version = re.search(
-                        re.escape('Required is at least version "') + r"(.+?(?=\"))",
-                        err,
-                    )
-                    if version:
-                        safe_deps.append((name[1] + "_" + version[1], "cmake"))
-                    else:
-                        safe_deps.append((name[1], "cmake"))
+            for _, dep in CMAKE_DEP_PATTERNS.all_matches(err):
+                project["build"]["dep_lines"].append(err)
+                version = CMAKE_VERSION_RE.search(err)
+                if version:
+                    safe_deps.append((dep[1] + "_" + version[1], "cmake"))
+                else:
+                    safe_deps.append((dep[1], "cmake"))
+        if scanned is None:
+            scanned = self.scan_logs(project, name)
+        if scanned is None:
+            return [], []
+        # lists after a round trip through json
+        safe_deps.extend(tuple(d) for d in scanned[0])
+        deps.extend(tuple(d) for d in scanned[1])
+        project["build"]["dep_lines"].extend(scanned[2])
+        # remove duplicates
+        return list(set(safe_deps)), list(set(deps))
+
+    def scan_logs(self, project, name):
+        # (confident, other, matched lines) of the logs of a build, None if
+        # they can not be opened. Leaves project alone
+        deps = []
+        safe_deps = []
+        dep_lines = []
         # print("\nstarting dependency analysis for {}".format(name))
         # lognames = ["stderr", "docker_log", "stdout"]
-        # docker_log can be huge, skip it for now
+        # docker_log can be huge, only its error regions are checked below
         # errors get redirected to sterr anyway
         lognames = ["stderr"]
         for logfiles in lognames:
             try:
                 err_log = join(project["build"]["dir"], project["build"][logfiles])
-                with open(err_log, "r") as log:
-                    text = log.read()
+                if getsize(err_log) > log_reader.PREFILTER_SIZE:
+                    regions = list(log_reader.iter_log_regions(err_log))
+                else:
+                    with open(err_log, "r") as log:
+                        regions = [log.read().splitlines()]
                     # find lines about missing deps
             except (KeyError, FileNotFoundError):
                 print("dep_finder: error opening log files for {}".format(name))
-                return [], []
+                return None
             # found = False
-            # avoid lines which are too long, takes forever otherwise
-            lines = [l for l in text.splitlines() if len(l) < 1000]
-            for line in lines:
-                for pattern, source in self.confident_patterns:
-                    regex_result = re.search(pattern, line)
-                    if regex_result:
-                        safe_deps.append((regex_result[1].strip(), source))
-                        project["build"]["dep_lines"].append(line)
-                        # found = True
-                # if found:
-                #     continue
-                for pattern, source in self.patterns:
-                    regex_result = re.search(pattern, line)
-                    if regex_result:
-                        deps.append((regex_result[1].strip(), source))
-                        project["build"]["dep_lines"].append(line)
+            for region in regions:
+                # avoid lines which are too long, takes forever otherwise
+                lines = [l for l in region if len(l) < 1000]
+                self.match_lines(dep_lines, lines, safe_deps, deps)
+        # the regions of the docker log around error markers, bounded in size
+        # no matter how big the log is
+        docker_log = project["build"].get("docker_log")
+        if docker_log and exists(join(project["build"]["dir"], docker_log)):
+            path = join(project["build"]["dir"], docker_log)
+            for region in log_reader.iter_log_regions(path):
+                lines = [l for l in region if len(l) < 1000]
+                self.match_lines(dep_lines, lines, safe_deps, deps)
+        return list(set(safe_deps)), list(set(deps)), dep_lines
 
-        # remove duplicates
-        return list(set(safe_deps)), list(set(deps))
+    def match_lines(self, dep_lines, lines, safe_deps, deps):
+        for line in lines:
+            # only the patterns whose literal is in the line, see PatternTable
+            for idx, regex_result in self.confident_patterns.all_matches(line):
+                source = self.confident_patterns.entries[idx][1]
+                safe_deps.append((regex_result[1].strip(), source))
+                dep_lines.append(line)
+                # found = True
+            # if found:
+            #     continue
+            for idx, regex_result in self.patterns.all_matches(line):
+                source = self.patterns.entries[idx][1]
+                deps.append((regex_result[1].strip(), source))
+                dep_lines.append(line)
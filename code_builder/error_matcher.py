@@ -0,0 +1,213 @@
+import re
+import heapq
+
+from collections import defaultdict
+from fuzzywuzzy import fuzz, utils
+
+try:
+    from re import _parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse  # type: ignore
+
+
+def literal_runs(regex):
+    # returns the runs of literal characters on the top level of the regex.
+    # every run has to be part of any string the regex matches, so they can be
+    # used to rule out a pattern without running it.
+    # returns None if we can not say anything about the pattern
+    try:
+        parsed = sre_parse.parse(regex)
+    except Exception:
+        return None
+    state = getattr(parsed, "state", None) or getattr(parsed, "pattern", None)
+    if state is None or state.flags & re.IGNORECASE:
+        return None
+    runs = []
+    current = []
+    for op, value in parsed.data:
+        if op == sre_parse.LITERAL:
+            current.append(chr(value))
+            continue
+        if current:
+            runs.append("".join(current))
+            current = []
+    if current:
+        runs.append("".join(current))
+    return runs
+
+
+def complete_tokens(literal):
+    # whitespace separated tokens of the literal that are delimited by whitespace
+    # on both sides, they show up as whole tokens in log.split() if literal is in log
+    tokens = literal.split()
+    if not tokens:
+        return []
+    if not literal[0].isspace():
+        tokens = tokens[1:]
+    if tokens and not literal[-1].isspace():
+        tokens = tokens[:-1]
+    return tokens
+
+
+class ErrorSignature:
+    def __init__(self, regex):
+        self.regex = regex
+        self._compiled = None
+        runs = literal_runs(regex)
+        if runs:
+            # the longest literal is the most selective substring check
+            self.literal = max(runs, key=len)
+            self.tokens = set()
+            for run in runs:
+                self.tokens.update(complete_tokens(run))
+        else:
+            self.literal = None
+            self.tokens = set()
+
+    @property
+    def compiled(self):
+        # only compile the patterns that made it through the prefilter
+        if self._compiled is None:
+            self._compiled = re.compile(self.regex)
+        return self._compiled
+
+    def may_match(self, log, log_tokens):
+        if self.literal is None:
+            return True
+        if not self.tokens.issubset(log_tokens):
+            return False
+        return self.literal in log
+
+
+class ErrorMatcher:
+    """Matches a log against all regexes of the errortypes catalog.
+
+    The log is tokenized once, every catalog entry is first checked against
+    the literal text its regex requires and only the remaining candidates are
+    searched with the (lazily compiled) regex.
+    """
+
+    def __init__(self):
+        self.signatures = {}
+        # number of regexes searched during the last call to search
+        self.evaluated = 0
+        self.total_evaluated = 0
+        self.total_patterns = 0
+
+    def signature(self, err, regex):
+        sig = self.signatures.get(err)
+        # the regex of an entry is not supposed to change, but better be safe
+        if sig is None or sig.regex != regex:
+            sig = ErrorSignature(regex)
+            self.signatures[err] = sig
+        return sig
+
+    def search(self, catalog, log):
+        # returns [(err, match)] for all catalog entries whose regex matches
+        # the log, in catalog order, same as re.search over each entry
+        log_tokens = set(log.split())
+        matches = []
+        self.evaluated = 0
+        for err, data in catalog.items():
+            regex = data.get("regex")
+            if regex is None:
+                continue
+            self.total_patterns += 1
+            sig = self.signature(err, regex)
+            if not sig.may_match(log, log_tokens):
+                continue
+            self.evaluated += 1
+            match = sig.compiled.search(log)
+            if match is not None:
+                matches.append((err, match))
+        self.total_evaluated += self.evaluated
+        return matches
+
+
+class FuzzyIndex:
+    """Trigram index over the keys of the errortypes catalog.
+
+    Used to find the few keys that can reach the fuzzy matching threshold,
+    instead of scoring every key with fuzz.ratio. Filtering relies on the
+    q-gram lemma: a ratio of at least min_ratio bounds the number of
+    insertions/deletions between two strings, and every edit destroys at
+    most Q grams.
+    """
+
+    Q = 3
+
+    def __init__(self, min_score=90):
+        # fuzz.ratio rounds to an int, leave some slack to stay on the safe side
+        self.min_ratio = (min_score - 1) / 100
+        self.processed = {}
+        self.key_grams = {}
+        self.grams = defaultdict(set)
+        self.by_length = defaultdict(set)
+
+    @classmethod
+    def ngrams(cls, s):
+        return {s[i : i + cls.Q] for i in range(len(s) - cls.Q + 1)}
+
+    def add(self, key):
+        if key in self.processed:
+            return
+        processed = utils.full_process(key)
+        self.processed[key] = processed
+        # empty strings always get a score of 0, never a candidate
+        if not processed:
+            return
+        grams = self.ngrams(processed)
+        self.key_grams[key] = len(grams)
+        for g in grams:
+            self.grams[g].add(key)
+        self.by_length[len(processed)].add(key)
+
+    def sync(self, catalog):
+        # pick up entries that were added to the catalog behind our back
+        if len(catalog) != len(self.processed):
+            for key in catalog:
+                self.add(key)
+
+    def max_edits(self, total_length):
+        return int((1 - self.min_ratio) * total_length)
+
+    def candidates(self, query):
+        length = len(query)
+        if length == 0:
+            return set()
+        r = self.min_ratio
+        min_len = int(length * r / (2 - r))
+        max_len = int(length * (2 - r) / r) + 1
+        query_grams = self.ngrams(query)
+        result = set()
+        for l in range(min_len, max_len + 1):
+            # too short to rule anything out with grams
+            if len(query_grams) - self.Q * self.max_edits(length + l) <= 0:
+                result.update(self.by_length.get(l, ()))
+        counts = defaultdict(int)
+        for g in query_grams:
+            for key in self.grams.get(g, ()):
+                counts[key] += 1
+        for key, count in counts.items():
+            l = len(self.processed[key])
+            if l < min_len or l > max_len:
+                continue
+            needed = max(len(query_grams), self.key_grams[key]) - self.Q * (
+                self.max_edits(length + l)
+            )
+            if count >= needed:
+                result.add(key)
+        return result
+
+    def extract(self, query, catalog, limit=5):
+        # same result as process.extract(query, catalog.keys(), limit, fuzz.ratio)
+        # for all scores above the threshold
+        self.sync(catalog)
+        query = utils.full_process(query)
+        candidates = self.candidates(query)
+        if len(candidates) > limit:
+            # process.extract keeps the catalog order for equal scores,
+            # which decides what gets cut off by the limit
+            candidates = [key for key in catalog if key in candidates]
+        scored = [(key, fuzz.ratio(query, self.processed[key])) for key in candidates]
+        return heapq.nlargest(limit, scored, key=lambda i: i[1])
@@ -0,0 +1,211 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+
+from contextlib import contextmanager
+from os.path import exists, getmtime, join
+from time import time
+
+from .ci_systems.apt_cache import MOUNT as APT_CACHE_MOUNT, UPDATED
+
+# committed images are tagged REPOSITORY:<hash of base image and packages>
+REPOSITORY = "fbacode-deps"
+# printed by init.py once the build dependencies are installed, it waits for
+# COMMITTED in the build directory before going on
+MARKER = b"fbacode: build dependencies installed"
+INSTALLED = ".deps_installed.json"
+COMMITTED = ".deps_committed"
+# apt-get build-dep -s lines of packages it would install
+_INST = re.compile(r"^Inst (\S+)", re.M)
+
+
+class ImageCache:
+    """Images of a build image with the build dependencies of Debian packages.
+
+    A container of a package whose dependencies no cached image covers
+    installs them before fetching the source, is committed as an image
+    keyed by the base image and the installed packages, and then builds.
+    A package whose dependencies are a subset of the packages of a cached
+    image of the same base starts from that image, build-dep has nothing
+    left to do. The dependencies of a package are known from earlier
+    commits or simulated with apt-get build-dep -s on the shared apt lists,
+    if they are fresh. Images are evicted least recently used first when
+    their layers exceed max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, min_packages=20, apt_cache=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.min_packages = min_packages
+        # AptCache of the run, its lists make the simulation work
+        self.apt_cache = apt_cache
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cfg, apt_cache=None):
+        # None if image_cache is empty
+        root = cfg["build"].get("image_cache")
+        if not root:
+            return None
+        return cls(
+            root,
+            int(float(cfg["build"].get("image_cache_size", 100)) * 2 ** 30),
+            int(cfg["build"].get("image_cache_min_packages", 20)),
+            apt_cache,
+        )
+
+    @contextmanager
+    def index(self):
+        # the index, locked against the other build processes, saved on exit:
+        # {"images": {tag: {base, packages, size, last_used}},
+        #  "projects": {name: packages}}
+        fd = os.open(join(self.root, "index.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            path = join(self.root, "index.json")
+            index = {"images": {}, "projects": {}}
+            if exists(path):
+                with open(path, "r") as f:
+                    index = json.load(f)
+            yield index
+            with open(path + ".tmp", "w") as f:
+                json.dump(index, f)
+            os.replace(path + ".tmp", path)
+        finally:
+            os.close(fd)
+
+    def simulate(self, client, image, name):
+        # packages build-dep would install on image, None if apt can not tell
+        # cheaply. Without fresh shared lists the simulation would need its
+        # own apt-get update, slower than the plain build it is meant to
+        # save; the first build installs and records the packages instead
+        if self.apt_cache is None:
+            return None
+        stamp = join(self.apt_cache.prepare(image), UPDATED)
+        if not exists(stamp) or time() - getmtime(stamp) >= self.apt_cache.max_age:
+            return None
+        volumes = self.apt_cache.volumes(image)
+        command = "apt-get -o Dir::State::Lists={}/lists/ build-dep -s {}".format(
+            APT_CACHE_MOUNT, name
+        )
+        try:
+            out = client.containers.run(
+                image, entrypoint=["bash", "-c", command], volumes=volumes, remove=True
+            )
+        except Exception as e:
+            print("could not simulate the build-dep of {}: {}".format(name, e))
+            return None
+        return set(_INST.findall(out.decode(errors="replace")))
+
+    def select(self, client, image, name, build_dir):
+        """(image to run, whether to commit it after the install) for name."""
+        # left over by a container of an earlier run
+        for path in (INSTALLED, COMMITTED):
+            if exists(join(build_dir, path)):
+                os.remove(join(build_dir, path))
+        base = client.images.get(image).id
+        with self.index() as index:
+            packages = index["projects"].get(name)
+        if packages is None:
+            packages = self.simulate(client, image, name)
+        else:
+            packages = set(packages)
+        if packages is not None and len(packages) < self.min_packages:
+            # not worth an image
+            return image, False
+        if packages is not None:
+            with self.index() as index:
+                # the smallest image with all the dependencies
+                candidates = [
+                    (len(entry["packages"]), tag)
+                    for tag, entry in index["images"].items()
+                    if entry["base"] == base and packages.issubset(entry["packages"])
+                ]
+                for _, tag in sorted(candidates):
+                    try:
+                        client.images.get(tag)
+                    except Exception:
+                        # removed behind our back
+                        del index["images"][tag]
+                        continue
+                    index["images"][tag]["last_used"] = time()
+                    return tag, False
+        return image, True
+
+    def commit(self, client, container, image, name, build_dir):
+        """Wait for the dependencies of the container and commit it.
+
+        Reads the log stream until init.py reports the install, commits the
+        container unless an image with the same packages exists and lets
+        init.py go on. Returns the tag or None.
+        """
+        installed = join(build_dir, INSTALLED)
+        tag = None
+        try:
+            # a broken log stream still lets init.py go on, see finally
+            for chunk in container.logs(stream=True, follow=True):
+                if MARKER in chunk:
+                    break
+            else:
+                # the container exited before, e.g. the install failed
+                return None
+            with open(installed, "r") as f:
+                packages = sorted(json.load(f))
+            if len(packages) < self.min_packages:
+                with self.index() as index:
+                    index["projects"][name] = packages
+                return None
+            base = client.images.get(image).id
+            key = hashlib.sha256(
+                "\n".join([base] + packages).encode()
+            ).hexdigest()[:32]
+            tag = "{}:{}".format(REPOSITORY, key)
+            with self.index() as index:
+                index["projects"][name] = packages
+                known = tag in index["images"]
+            if not known:
+                # not under the lock of the index, committing takes a while
+                start = time()
+                committed = container.commit(repository=REPOSITORY, tag=key)
+                # the size of the new layer, the base image is shared
+                size = committed.history()[0].get("Size", 0)
+                print(
+                    "committed the {} dependencies of {} as {} ({:.0f} MB) in "
+                    "{:.0f} seconds".format(
+                        len(packages), name, tag, size / 2 ** 20, time() - start
+                    )
+                )
+                with self.index() as index:
+                    index["images"][tag] = {
+                        "base": base,
+                        "packages": packages,
+                        "size": size,
+                        "last_used": time(),
+                    }
+                    self.evict(client, index)
+        except Exception as e:
+            print("could not commit the dependencies of {}: {}".format(name, e))
+        finally:
+            # init.py waits for this
+            with open(join(build_dir, COMMITTED), "w"):
+                pass
+        return tag
+
+    def evict(self, client, index):
+        # remove least recently used images until the layers fit, images of
+        # running containers are skipped by docker
+        images = index["images"]
+        total = sum(entry["size"] for entry in images.values())
+        for tag, entry in sorted(images.items(), key=lambda i: i[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                client.images.remove(tag)
+            except Exception as e:
+                if "No such image" not in str(e):
+                    continue
+            total -= entry["size"]
+            del images[tag]
+            print("image cache: evicted {}".format(tag))
@@ -0,0 +1,129 @@
+import json
+import os
+
+from os.path import exists, join
+
+# in the build directory: the results of all runs, and the projects finished
+# by the current (or an interrupted) run since all_built.json was written
+ALL_BUILT = "all_built.json"
+JOURNAL = "all_built.jsonl"
+# written by older versions instead of the journal
+LEGACY_CHECKPOINT = "intermediate_all_built.json"
+
+
+class Journal:
+    """Append-only record of the finished projects of a run.
+
+    Every project is one JSON line [name, project], appended when its
+    statistics are done. Lines are written right away, sync makes them
+    durable and is called in batches by the StatisticsWorker. A line cut off
+    by a crash is dropped when the journal is opened again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if exists(path):
+            truncate_incomplete(path)
+        self.file = open(path, "a")
+        self.records = 0
+
+    def append(self, name, project):
+        self.file.write(json.dumps([name, project]) + "\n")
+        self.records += 1
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def truncate_incomplete(path, chunk_size=1 << 16):
+    # cut the file after its last newline, the rest is a record cut off by a
+    # crash. New records would be appended to the same line otherwise
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline != -1:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos != end:
+            print("{}: dropping an incomplete record of {} bytes".format(path, end - pos))
+            f.truncate(pos)
+
+
+def replay(path, projects):
+    # add the records of a journal to projects, later records win. Returns
+    # the number of records read
+    count = 0
+    with open(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                name, project = json.loads(line)
+            except ValueError:
+                print("{}:{}: skipping incomplete record".format(path, line_no))
+                continue
+            projects[name] = project
+            count += 1
+    return count
+
+
+def load_projects(path):
+    # all_built.json like file or journal
+    projects = {}
+    if path.endswith(".jsonl"):
+        replay(path, projects)
+    else:
+        with open(path, "r") as f:
+            projects.update(json.load(f))
+    return projects
+
+
+def load_build_dir(build_dir):
+    # all projects built into build_dir, to resume an interrupted run
+    projects = {}
+    all_built = join(build_dir, ALL_BUILT)
+    if exists(all_built):
+        with open(all_built, "r") as f:
+            projects = json.load(f)
+    legacy = join(build_dir, LEGACY_CHECKPOINT)
+    if exists(legacy):
+        with open(legacy, "r") as f:
+            projects.update(json.load(f))
+    journal = join(build_dir, JOURNAL)
+    if exists(journal):
+        count = replay(journal, projects)
+        print("resuming with {} projects of {}".format(count, journal))
+    return projects
+
+
+def save_all_built(build_dir, projects):
+    # write all_built.json and drop the journal it now contains. The file is
+    # replaced atomically, a crash leaves the old one and the journal
+    all_built = join(build_dir, ALL_BUILT)
+    tmp = all_built + ".tmp"
+    with open(tmp, "w") as o:
+        o.write(json.dumps(projects, indent=2))
+        o.flush()
+        os.fsync(o.fileno())
+    os.replace(tmp, all_built)
+    for name in (JOURNAL, LEGACY_CHECKPOINT):
+        if exists(join(build_dir, name)):
+            os.remove(join(build_dir, name))
+
+
+def compact(build_dir):
+    # merge the journal of an interrupted run into all_built.json
+    projects = load_build_dir(build_dir)
+    save_all_built(build_dir, projects)
+    return len(projects)
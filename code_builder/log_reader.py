@@ -0,0 +1,162 @@
+import io
+import mmap
+import os
+import re
+
+# upper bound on the characters of a block of lines handed to the analysis
+BLOCK_SIZE = 4 * 1024 * 1024
+# longer lines get truncated, the rest of the line is skipped
+MAX_LINE_LENGTH = 64 * 1024
+# logs bigger than this are not analyzed completely, only the regions
+# around error markers, see iter_log_regions
+PREFILTER_SIZE = 64 * 1024 * 1024
+# upper bound on the bytes of a log that end up in the regions
+MAX_REGION_BYTES = 16 * 1024 * 1024
+# lines of context kept before and after every marker, CMake errors
+# continue on the following lines
+CONTEXT_BEFORE = 5
+CONTEXT_AFTER = 20
+# everything the error and dependency analysis looks for contains one of
+# these, in any case ("ERROR: ...", "Project ERROR: Unknown module(s)")
+MARKERS = re.compile(
+    b"|".join(
+        re.escape(m)
+        for m in (
+            b"rror",
+            b"not found",
+            b"No such file",
+            b"Cannot find",
+            b"Can't exec",
+            b"Could NOT find",
+            b"Unable to find",
+            b"Please install",
+            b"unable to load addon",
+            b"library used but",
+            b"could not be found",
+            b"not installed",
+            b"undefined reference",
+            b"input unused",
+        )
+    ),
+    re.IGNORECASE,
+)
+
+
+def read_line(log, max_line_length=MAX_LINE_LENGTH):
+    # returns the next line without the newline, truncated to max_line_length
+    # without ever holding more than that in memory. None at the end of the file
+    line = log.readline(max_line_length)
+    if line == "":
+        return None
+    if line.endswith("\n"):
+        return line[:-1]
+    if len(line) == max_line_length:
+        # skip the remainder of the line
+        rest = log.readline(max_line_length)
+        while rest and not rest.endswith("\n"):
+            rest = log.readline(max_line_length)
+    return line
+
+
+def iter_lines(log, max_line_length=MAX_LINE_LENGTH):
+    line = read_line(log, max_line_length)
+    while line is not None:
+        yield line
+        line = read_line(log, max_line_length)
+
+
+def iter_log_blocks(path, block_size=BLOCK_SIZE, max_line_length=MAX_LINE_LENGTH):
+    # stream a log file in blocks of lines, so the analysis of a huge log
+    # never needs more than about block_size characters at a time
+    with io.open(path, "r", errors="replace") as log:
+        block = []
+        size = 0
+        for line in iter_lines(log, max_line_length):
+            block.append(line)
+            size += len(line) + 1
+            if size >= block_size:
+                yield block
+                block = []
+                size = 0
+        if block:
+            yield block
+
+
+def context_start(mm, offset, lines):
+    # start of the line `lines` lines before the line at offset
+    start = mm.rfind(b"\n", 0, offset) + 1
+    for _ in range(lines):
+        if start == 0:
+            break
+        start = mm.rfind(b"\n", 0, start - 1) + 1
+    return start
+
+
+def context_end(mm, offset, lines):
+    # end (the newline) of the line `lines` lines after the line at offset
+    end = mm.find(b"\n", offset)
+    for _ in range(lines):
+        if end < 0:
+            break
+        end = mm.find(b"\n", end + 1)
+    return len(mm) if end < 0 else end
+
+
+def find_regions(mm, before=CONTEXT_BEFORE, after=CONTEXT_AFTER, max_bytes=None):
+    # [(start, end)] byte ranges of the marker lines and their context,
+    # overlapping ranges are merged. Only the last max_bytes are kept, the
+    # errors that made the build fail are at the end of the log
+    regions = []
+    pos = 0
+    while True:
+        m = MARKERS.search(mm, pos)
+        if m is None:
+            break
+        start = context_start(mm, m.start(), before)
+        end = context_end(mm, m.start(), after)
+        if regions and start <= regions[-1][1] + 1:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+        # one hit per line is enough
+        line_end = mm.find(b"\n", m.end())
+        if line_end < 0:
+            break
+        pos = line_end + 1
+    if max_bytes is not None:
+        total = sum(end - start for start, end in regions)
+        while regions and total > max_bytes:
+            start, end = regions[0]
+            if total - (end - start) >= max_bytes:
+                regions.pop(0)
+                total -= end - start
+                continue
+            # keep the tail of the region, from a line start on
+            cut = mm.find(b"\n", start + total - max_bytes)
+            cut = end if cut < 0 else min(cut + 1, end)
+            regions[0][0] = cut
+            total -= cut - start
+            if cut >= end:
+                regions.pop(0)
+    return [(start, end) for start, end in regions]
+
+
+def iter_log_regions(
+    path,
+    before=CONTEXT_BEFORE,
+    after=CONTEXT_AFTER,
+    max_bytes=MAX_REGION_BYTES,
+    max_line_length=MAX_LINE_LENGTH,
+):
+    # yields the lines of every region around an error marker, one list per
+    # region. the log is memory mapped, scanning it costs no memory and the
+    # regions are bounded by max_bytes, no matter how big the log is
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start, end in find_regions(mm, before, after, max_bytes):
+                text = mm[start:end].decode("utf-8", errors="replace")
+                # same newline handling as the text mode of iter_log_blocks
+                region = io.StringIO(text, newline=None)
+                yield list(iter_lines(region, max_line_length))
@@ -0,0 +1,51 @@
+import re
+
+from .error_matcher import literal_runs
+
+
+class PatternTable:
+    """Ordered regexes, compiled once and prefiltered by their literal text.
+
+    A pattern is only searched if the longest literal it requires is in the
+    line, a plain substring check. Most lines of a log contain none of them
+    and never reach the regex engine. The results are the same as searching
+    the patterns one by one.
+    entries are tuples, the regex first, the rest is data for the caller.
+    """
+
+    def __init__(self, entries):
+        self.entries = [tuple(e) for e in entries]
+        self.patterns = [re.compile(e[0]) for e in self.entries]
+        # None if the pattern has no literal we can rely on, always searched
+        self.literals = []
+        for e in self.entries:
+            runs = literal_runs(e[0])
+            self.literals.append(max(runs, key=len) if runs else None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def candidates(self, line):
+        # indices of the patterns that might match the line, in table order
+        return [
+            i for i, lit in enumerate(self.literals) if lit is None or lit in line
+        ]
+
+    def first_match(self, line):
+        # (idx, match) of the first pattern in table order that matches the
+        # line, same as re.search over the patterns with a break. None if no
+        # pattern matches
+        for i in self.candidates(line):
+            match = self.patterns[i].search(line)
+            if match is not None:
+                return i, match
+        return None
+
+    def all_matches(self, line):
+        # [(idx, match)] of all patterns that match the line, in table order
+        matches = []
+        for i in self.candidates(line):
+            match = self.patterns[i].search(line)
+            if match is not None:
+                matches.append((i, match))
+        return matches
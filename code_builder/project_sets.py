@@ -0,0 +1,143 @@
+import array
+
+
+class ProjectNames:
+    """Interns project names to small integer ids.
+
+    There is one instance per process, ids are never sent to another
+    process, see ProjectSet.__reduce__.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        id = self.ids.get(name)
+        if id is None:
+            id = len(self.names)
+            self.ids[name] = id
+            self.names.append(name)
+        return id
+
+    def lookup(self, name):
+        return self.ids.get(name)
+
+
+project_names = ProjectNames()
+
+
+class ProjectSet:
+    """Projects list of an errortypes/dependency entry, stored as interned ids.
+
+    Behaves like the list it replaces (iteration in insertion order, `in`,
+    append of names that are not in the set yet), but membership is O(1)
+    once the set is dense enough to be worth a bitmap. Converted back to a
+    list by json_default when the catalogs are written.
+    """
+
+    # below this size the array of ids is searched directly
+    SMALL = 16
+
+    __slots__ = ("ids", "bits")
+
+    def __init__(self, names=()):
+        # ids in insertion order, 4 bytes per project
+        self.ids = array.array("I")
+        # one bit per interned id, only for dense sets, see _check_density
+        self.bits = None
+        for name in names:
+            self.append(name)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        names = project_names.names
+        for id in self.ids:
+            yield names[id]
+
+    def __contains__(self, name):
+        id = project_names.lookup(name)
+        return id is not None and self.has_id(id)
+
+    def __eq__(self, other):
+        if isinstance(other, ProjectSet):
+            return self.ids == other.ids
+        return list(self) == other
+
+    def __repr__(self):
+        return "ProjectSet({!r})".format(self.to_list())
+
+    def __reduce__(self):
+        # ids are only valid in this process
+        return (ProjectSet, (self.to_list(),))
+
+    def __copy__(self):
+        result = ProjectSet()
+        result.ids = array.array("I", self.ids)
+        if self.bits is not None:
+            result.bits = bytearray(self.bits)
+        return result
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def has_id(self, id):
+        if self.bits is None:
+            return id in self.ids
+        byte = id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (id & 7)))
+
+    def append(self, name):
+        # adds name if it is not in the set yet, returns True if it was added
+        id = project_names.intern(name)
+        if self.has_id(id):
+            return False
+        self.ids.append(id)
+        if self.bits is not None:
+            self._set_bit(id)
+        elif len(self.ids) > self.SMALL:
+            self._check_density()
+        return True
+
+    def to_list(self):
+        return list(self)
+
+    def _set_bit(self, id):
+        byte = id >> 3
+        if byte >= len(self.bits):
+            # grow ahead of the interned names to not resize on every insert
+            size = max(byte + 1, (len(project_names) >> 3) + 1)
+            self.bits.extend(bytes(size - len(self.bits)))
+        self.bits[byte] |= 1 << (id & 7)
+
+    def _check_density(self):
+        # a bitmap costs one bit per interned name, use it as soon as it is
+        # not bigger than the array of ids
+        if len(self.ids) * 32 < len(project_names):
+            return
+        self.bits = bytearray()
+        for id in self.ids:
+            self._set_bit(id)
+
+
+def intern_projects(catalog):
+    # replace the projects lists of the catalog entries in place
+    for entry in catalog.values():
+        projects = entry.get("projects")
+        if projects is not None and not isinstance(projects, ProjectSet):
+            entry["projects"] = ProjectSet(projects)
+    return catalog
+
+
+def json_default(obj):
+    # json.dumps(..., default=json_default) writes ProjectSets as lists
+    if isinstance(obj, ProjectSet):
+        return obj.to_list()
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(type(obj).__name__)
+    )
@@ -0,0 +1,123 @@
+import concurrent.futures
+import json
+import traceback
+
+from collections import OrderedDict
+from os.path import exists, join
+from time import time
+
+from .catalog_store import CatalogStore
+from .journal import load_projects
+from .statistics import Statistics
+
+# set in every worker process by init_worker
+_catalogs = None
+_fuzzy_matching = "index"
+_contents_index = None
+
+
+def load_build_results(paths):
+    # all_built.json, all_built.jsonl and build_details_*.json all map
+    # project names to the project records, later files win
+    projects = OrderedDict()
+    for path in paths:
+        projects.update(load_projects(path))
+    return projects
+
+
+def load_catalogs(catalog_store=None):
+    # read errortypes and dep_mapping without touching them
+    if catalog_store and exists(catalog_store):
+        store = CatalogStore(catalog_store)
+        catalogs = (store.load_errors(), store.load_dep_mapping())
+        store.close()
+        return catalogs
+    catalogs = []
+    for name in ("errortypes.json", "dep_mapping.json"):
+        path = join("code_builder", name)
+        if exists(path):
+            with open(path, "r") as f:
+                catalogs.append(json.load(f))
+        else:
+            catalogs.append({})
+    return tuple(catalogs)
+
+
+def shard_projects(names, shards):
+    # deterministic round-robin split of the sorted project names
+    names = sorted(names)
+    return [names[i::shards] for i in range(shards) if names[i::shards]]
+
+
+def init_worker(catalogs, fuzzy_matching, contents_index=None):
+    global _catalogs, _fuzzy_matching, _contents_index
+    _catalogs = catalogs
+    _fuzzy_matching = fuzzy_matching
+    _contents_index = contents_index
+
+
+def analyze_shard(shard_idx, projects, project_count):
+    stats = Statistics(
+        project_count,
+        fuzzy_matching=_fuzzy_matching,
+        catalogs=_catalogs,
+        contents_index=_contents_index,
+    )
+    for name, project in projects.items():
+        try:
+            stats.update(project, name)
+        except Exception as e:
+            print("Error updating stats for {}: {}".format(name, e))
+    stats.detach_catalogs()
+    return shard_idx, stats, projects
+
+
+def reanalyze(projects, stats, jobs, shards=None):
+    """Recompute the statistics of existing build results.
+
+    The projects are split into shards, every shard is analyzed by a worker
+    process against the catalogs of stats, the partial statistics are merged
+    into stats in shard order. Returns the updated project records.
+    """
+    if shards is None:
+        shards = jobs * 4
+    project_count = len(projects)
+    catalogs = (stats.errors_stdout, stats.persistent_dep_mapping)
+    start = time()
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs,
+        initializer=init_worker,
+        initargs=(catalogs, stats.fuzzy_matching, stats.contents_index),
+    ) as pool:
+        futures = [
+            pool.submit(
+                analyze_shard,
+                shard_idx,
+                OrderedDict((name, projects[name]) for name in shard),
+                project_count,
+            )
+            for shard_idx, shard in enumerate(shard_projects(projects, shards))
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                shard_idx, partial, shard_projects_done = future.result()
+            except Exception:
+                print("shard failed:\n{}".format(traceback.format_exc()))
+                continue
+            results[shard_idx] = (partial, shard_projects_done)
+            print(
+                "[{}/{}] shards analyzed after {:.1f} seconds".format(
+                    len(results), len(futures), time() - start
+                )
+            )
+    updated = OrderedDict()
+    for shard_idx in sorted(results):
+        partial, shard_projects_done = results[shard_idx]
+        stats.merge(partial)
+        updated.update(shard_projects_done)
+    # keep the order of the input
+    stats.all_projects = OrderedDict(
+        (name, updated[name]) for name in projects if name in updated
+    )
+    return stats.all_projects
@@ -0,0 +1,123 @@
+import json
+import re
+import zlib
+
+# whitespace between JSON tokens
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _StreamReader:
+    """Reads JSON values one by one from a file, buffering a chunk at a time."""
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        # append the next chunk, drop what was consumed. False at the end
+        more = self.f.read(self.chunk_size)
+        if not more:
+            return False
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # next non whitespace character, "" at the end
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos : self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("expected {!r}, found {!r}".format(char, found))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if not self.fill():
+                    raise
+                continue
+            # a number could go on in the next chunk, the values read here
+            # are strings and objects but make sure
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        # (key, value) of the object starting here, values read lazily by
+        # the caller through value() or members()
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_projects(path):
+    """(database, name, project) of a repositories database, one at a time.
+
+    Only one project is in memory at a time, the database is never loaded
+    as a whole.
+    """
+    with open(path, "r") as f:
+        reader = _StreamReader(f)
+        for database in reader.members():
+            for name in reader.members():
+                yield database, name, reader.value()
+
+
+def parse_shard(shard):
+    # "i/N" to (i, N), 0 <= i < N
+    index, _, count = shard.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError("shard {} is not of the form i/N with 0 <= i < N".format(shard))
+    return index, count
+
+
+def in_shard(name, index, count):
+    # stable across processes and hosts, unlike hash()
+    return zlib.crc32(name.encode()) % count == index
+
+
+def load_repositories(path, shard=None, limit=None):
+    """The projects of shard (i, N) of a repositories database, at most limit.
+
+    Every project is in exactly one of the N shards, no matter the order of
+    the database. The result has the layout of the database,
+    {database: {name: project}}. The selected projects are all kept, as
+    build_projects orders the projects of a database before building any of
+    them, so only a shard or a limit holds less than json.load of the whole
+    database would. What streaming saves is the text of the database next to
+    the parsed projects, and the projects of the other shards.
+    """
+    repositories = {}
+    count = 0
+    for database, name, project in iter_projects(path):
+        if shard is not None and not in_shard(name, *shard):
+            continue
+        if limit is not None and count >= limit:
+            break
+        repositories.setdefault(database, {})[name] = project
+        count += 1
+    return repositories
@@ -0,0 +1,234 @@
+import math
+import os
+
+
+def format_cpuset(cores):
+    # docker cpuset_cpus syntax, e.g. "0-3,8"
+    cores = sorted(cores)
+    ranges = []
+    start = prev = cores[0]
+    for core in cores[1:]:
+        if core != prev + 1:
+            ranges.append((start, prev))
+            start = core
+        prev = core
+    ranges.append((start, prev))
+    return ",".join(
+        str(a) if a == b else "{}-{}".format(a, b) for a, b in ranges
+    )
+
+
+def oom_retry_wanted(project, cfg):
+    # True if project, a finished build, ran out of memory and has retries
+    # left. Decided by package_build, which then skips packaging it
+    return (
+        bool(project.get("oom_killed"))
+        and project.get("status") != "success"
+        and project.get("oom_retries", 0) < int(cfg["build"].get("memory_oom_retries", 2))
+    )
+
+
+class CorePool:
+    """Host cores handed out to the build containers.
+
+    Every container is pinned to its own cores (cpuset) and runs as many
+    make jobs as it has cores, so the host is never oversubscribed. A
+    project gets more cores the longer it is expected to build, the typical
+    project gets its share of the cores, total / workers.
+    """
+
+    def __init__(self, total, workers, min_cores=2, max_cores=16, cores=None):
+        self.free = set(cores if cores is not None else range(total))
+        self.total = len(self.free)
+        self.min_cores = max(1, min(min_cores, self.total))
+        self.max_cores = max(self.min_cores, min(max_cores, self.total))
+        self.share = max(self.min_cores, self.total // max(1, workers))
+
+    @classmethod
+    def from_config(cls, cfg, workers):
+        # None if the cores are not managed, cpu_cores is empty
+        total = cfg["build"].get("cpu_cores", "0").strip()
+        if not total:
+            return None
+        available = sorted(os.sched_getaffinity(0))
+        total = int(total) or len(available)
+        return cls(
+            total,
+            workers,
+            int(cfg["build"].get("cpu_min_cores", 2)),
+            int(cfg["build"].get("cpu_max_cores", 16)),
+            cores=available[:total],
+        )
+
+    def wanted(self, estimate, typical):
+        # cores for a project expected to take estimate seconds, typical is
+        # the expected time of an ordinary project. Scales with the square
+        # root, builds do not get faster linearly with more jobs
+        if not estimate or not typical:
+            return self.share
+        cores = int(round(self.share * math.sqrt(estimate / typical)))
+        return max(self.min_cores, min(self.max_cores, cores))
+
+    def allocate(self, wanted):
+        # the lowest free cores, fewer than wanted if that is all there is.
+        # None if not even min_cores are free, the build has to wait
+        if len(self.free) < self.min_cores:
+            return None
+        cores = sorted(self.free)[: max(self.min_cores, wanted)]
+        self.free.difference_update(cores)
+        return cores
+
+    def release(self, cores):
+        self.free.update(cores)
+
+    def resources(self, cores, max_jobs):
+        # project["resources"], read by start_docker
+        return {
+            "cpuset": format_cpuset(cores),
+            "cores": len(cores),
+            "jobs": min(len(cores), max_jobs),
+        }
+
+
+GB = 2 ** 30
+
+
+def host_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class MemoryPool:
+    """Memory budgets of the running containers, kept under the host RAM.
+
+    The budget of a project is the peak memory of its last run plus some
+    headroom, twice the limit of the last run if it ran out of memory, and
+    the default for projects that were never built. The budget is the memory
+    limit of the container, without swap.
+    """
+
+    # granularity of the budgets
+    STEP = 256 * 2 ** 20
+
+    def __init__(self, total, default, history=None, headroom=1.25):
+        self.total = total
+        self.free = total
+        self.default = default
+        self.headroom = headroom
+        self.budgets = {}
+        for name, project in (history or {}).items():
+            budget = self.learned(project)
+            if budget:
+                self.budgets[name] = budget
+
+    @classmethod
+    def from_config(cls, cfg, history):
+        # None if the memory is not managed, memory_total is empty
+        total = cfg["build"].get("memory_total", "0").strip()
+        if not total:
+            return None
+        # leave some memory to the host and the builder itself
+        total = int(float(total) * GB) or int(host_memory() * 0.9)
+        return cls(
+            total,
+            int(float(cfg["build"].get("memory_default", 4)) * GB),
+            history,
+            float(cfg["build"].get("memory_headroom", 1.25)),
+        )
+
+    def learned(self, project):
+        # budget from the record of an earlier run, None if it has none
+        limit = (project.get("resources") or {}).get("memory")
+        if project.get("oom_killed") and limit:
+            return limit * 2
+        peak = project.get("memory_peak")
+        if peak:
+            return peak * self.headroom
+        return None
+
+    def budget(self, name, project):
+        # a retry after running out of memory carries its own budget
+        budget = (
+            project.get("memory_budget") or self.budgets.get(name) or self.default
+        )
+        budget = int(math.ceil(budget / self.STEP)) * self.STEP
+        # a project bigger than the host runs alone
+        return min(budget, self.total)
+
+    def allocate(self, budget):
+        if budget > self.free:
+            return False
+        self.free -= budget
+        return True
+
+    def release(self, budget):
+        self.free += budget
+
+
+class BuildResources:
+    """Cores and memory of the builds running on this host.
+
+    admit reserves them for a project before its container starts and sets
+    project["resources"], read by start_docker, release hands them back once
+    the container exited. Used by build_projects and the agents of a build
+    farm, from one thread.
+    """
+
+    def __init__(self, cfg, workers, cost_model, history=None):
+        self.jobs = int(cfg["build"]["jobs"])
+        self.cost_model = cost_model
+        # None to not limit them
+        self.core_pool = CorePool.from_config(cfg, workers)
+        self.memory_pool = MemoryPool.from_config(cfg, history)
+        self.oom_retries = int(cfg["build"].get("memory_oom_retries", 2))
+
+    def admit(self, name, project):
+        # reserve cores and memory for the project, (cores, memory), None if
+        # the build has to wait for a running one to finish
+        max_jobs = min(self.jobs, project.get("max_jobs", self.jobs))
+        resources = {}
+        cores = []
+        if self.core_pool is not None:
+            wanted = self.core_pool.wanted(
+                self.cost_model.estimate(name, project)[0], self.cost_model.default
+            )
+            cores = self.core_pool.allocate(wanted)
+            if cores is None:
+                return None
+            resources = self.core_pool.resources(cores, max_jobs)
+        elif "max_jobs" in project:
+            resources["jobs"] = max_jobs
+        memory = 0
+        if self.memory_pool is not None:
+            memory = self.memory_pool.budget(name, project)
+            if not self.memory_pool.allocate(memory):
+                if self.core_pool is not None:
+                    self.core_pool.release(cores)
+                return None
+            resources["memory"] = memory
+        project["resources"] = resources
+        return cores, memory
+
+    def release(self, reservation):
+        cores, memory = reservation
+        if self.core_pool is not None:
+            self.core_pool.release(cores)
+        if self.memory_pool is not None:
+            self.memory_pool.release(memory)
+
+    def oom_retry(self, name, project):
+        # set up project, whose finished build package_build queued
+        # for an oom retry, to build again with more memory and fewer jobs
+        project["oom_retries"] = project.get("oom_retries", 0) + 1
+        resources = project.get("resources", {})
+        if self.memory_pool is not None:
+            project["memory_budget"] = min(
+                self.memory_pool.total,
+                2 * resources.get("memory", self.memory_pool.default),
+            )
+        project["max_jobs"] = max(1, resources.get("jobs", self.jobs) // 2)
+        print(
+            "{} ran out of memory, retry {} of {}".format(
+                name, project["oom_retries"], self.oom_retries
+            ),
+            flush=True,
+        )
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+from functools import lru_cache
+from os.path import dirname, exists, isdir, isfile, join
+
+import docker
+
+# [build] options that change what a build produces
+FINGERPRINT_OPTIONS = (
+    "install_deps",
+    "skip_build",
+    "save_ir",
+    "save_ast",
+    "save_headers",
+    "clang_version",
+)
+# fields of a project record that belong to this run, not to the build
+RUN_FIELDS = (
+    "source",
+    "resources",
+    "memory_budget",
+    "memory_peak",
+    "oom_killed",
+    "oom_retries",
+    "max_jobs",
+    "result_cache",
+)
+WRAPPERS_DIR = join(dirname(__file__), "wrappers")
+
+
+# ids of the images found so far, a missing image is asked for again
+_image_digests = {}
+
+
+def image_digest(image):
+    # id of the local image, None if docker does not have it (yet)
+    if image in _image_digests:
+        return _image_digests[image]
+    try:
+        digest = docker.from_env().images.get(image).id
+    except Exception:
+        return None
+    _image_digests[image] = digest
+    return digest
+
+
+@lru_cache(maxsize=None)
+def wrappers_hash():
+    # the compiler wrappers mounted into every container
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(WRAPPERS_DIR)):
+        path = join(WRAPPERS_DIR, name)
+        if isfile(path):
+            digest.update(name.encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def source_version(project, source_dir):
+    # the version of a Debian package, the commit of a git checkout
+    if project.get("version"):
+        return project["version"]
+    out = subprocess.run(
+        ["git", "-C", source_dir, "rev-parse", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    if out.returncode != 0:
+        return None
+    return out.stdout.strip()
+
+
+def replace_paths(value, old, new):
+    # the record of a build holds absolute paths of the directories it ran in
+    if isinstance(value, str):
+        for o, n in zip(old, new):
+            if value == o or value.startswith(o + os.sep):
+                return n + value[len(o):]
+        return value
+    if isinstance(value, list):
+        return [replace_paths(v, old, new) for v in value]
+    if isinstance(value, dict):
+        return {k: replace_paths(v, old, new) for k, v in value.items()}
+    return value
+
+
+class ResultCache:
+    """Successful builds, keyed by everything that determines their result.
+
+    The key hashes the source (type, name and version or commit), the id of
+    the docker image, the clang version, the compiler wrappers, the build
+    options of FINGERPRINT_OPTIONS and the dependencies a retry installs. An entry holds the project record, the
+    AST and bitcode files and the log files of the build directory, so a hit
+    replaces the container run, also in another run directory.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    @classmethod
+    def from_config(cls, cfg):
+        # None if result_cache is empty
+        root = cfg["build"].get("result_cache")
+        if not root:
+            return None
+        return cls(root)
+
+    def key(self, name, project, source_dir, image, cfg, build_system, ci_system):
+        # None if the build can not be fingerprinted
+        version = source_version(project, source_dir)
+        digest = image_digest(image)
+        if version is None or digest is None:
+            return None
+        fingerprint = {
+            "type": project.get("type"),
+            "name": name,
+            "version": version,
+            "image": digest,
+            "wrappers": wrappers_hash(),
+            "build_system": build_system,
+            "ci_system": ci_system,
+            "options": {o: cfg["build"].get(o) for o in FINGERPRINT_OPTIONS},
+            # a missing dependencies retry is a different build than the first
+            "missing_deps": project.get("missing_deps"),
+            "resolved_deps": project.get("resolved_deps"),
+        }
+        return hashlib.sha256(
+            json.dumps(fingerprint, sort_keys=True).encode()
+        ).hexdigest()
+
+    def entry(self, key):
+        return join(self.root, key[:2], key)
+
+    def restore(self, key, project, build_dir, ast_dir, bitcodes_dir):
+        # fill in project and the directories from the cache, False on a miss
+        build_dir, ast_dir, bitcodes_dir = map(
+            os.path.abspath, (build_dir, ast_dir, bitcodes_dir)
+        )
+        entry = self.entry(key)
+        if not exists(join(entry, "record.json")):
+            return False
+        with open(join(entry, "record.json"), "r") as f:
+            record = json.load(f)
+        for sub, target in (("AST", ast_dir), ("bitcodes", bitcodes_dir)):
+            if isdir(join(entry, sub)):
+                shutil.rmtree(target, ignore_errors=True)
+                # copies, not links: a later build in the same directory
+                # truncates its files in place
+                shutil.copytree(join(entry, sub), target, symlinks=True)
+        for name in os.listdir(join(entry, "build")):
+            shutil.copy2(join(entry, "build", name), join(build_dir, name))
+        dirs = record["dirs"]
+        project.update(
+            replace_paths(
+                record["project"],
+                [dirs["build"], dirs["ast"], dirs["bitcodes"]],
+                [build_dir, ast_dir, bitcodes_dir],
+            )
+        )
+        # the record was last used now, for cleaning up old entries by hand
+        os.utime(join(entry, "record.json"))
+        return True
+
+    def store(self, key, project, build_dir, ast_dir, bitcodes_dir):
+        build_dir, ast_dir, bitcodes_dir = map(
+            os.path.abspath, (build_dir, ast_dir, bitcodes_dir)
+        )
+        entry = self.entry(key)
+        if exists(entry):
+            return
+        # written next to the entry and renamed, readers never see half of it
+        tmp = "{}.tmp{}".format(entry, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            os.makedirs(join(tmp, "build"))
+            for sub, src in (("AST", ast_dir), ("bitcodes", bitcodes_dir)):
+                if isdir(src):
+                    shutil.copytree(src, join(tmp, sub), symlinks=True)
+            # the logs, the build tree itself is not part of the result
+            for name in os.listdir(build_dir):
+                if isfile(join(build_dir, name)):
+                    shutil.copy2(join(build_dir, name), join(tmp, "build", name))
+            record = {
+                "key": key,
+                "project": {k: v for k, v in project.items() if k not in RUN_FIELDS},
+                "dirs": {"build": build_dir, "ast": ast_dir, "bitcodes": bitcodes_dir},
+            }
+            with open(join(tmp, "record.json"), "w") as f:
+                json.dump(record, f)
+            os.rename(tmp, entry)
+        except OSError as e:
+            # another process stored the same build first, or the disk is full
+            print("could not cache the build: {}".format(e))
+            shutil.rmtree(tmp, ignore_errors=True)
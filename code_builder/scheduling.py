@@ -0,0 +1,181 @@
+import heapq
+import json
+import random
+
+from os.path import exists
+
+
+def project_cost(project):
+    # seconds a project kept a worker busy in an earlier run: the clone and
+    # recognize_and_build, which includes the dependency install of the
+    # container (build.install_time). None if the project never got that far
+    build = project.get("build")
+    if not isinstance(build, dict) or "time" not in build:
+        return None
+    source = project.get("source") or {}
+    return build["time"] + (source.get("time") or 0)
+
+
+def project_sloc(project):
+    # lines of code reported by sources.debian.org, [[language, lines], ...]
+    sloc = (project.get("codebase_data") or {}).get("sloc")
+    if not isinstance(sloc, list):
+        return None
+    try:
+        return sum(int(lang[1]) for lang in sloc) or None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def project_size(project):
+    # bytes of the cloned source tree
+    return (project.get("source") or {}).get("size") or None
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+def load_history(paths):
+    # all_built.json like files of earlier runs, later files win
+    history = {}
+    for path in paths:
+        if not exists(path):
+            print("build history {} not found".format(path))
+            continue
+        with open(path, "r") as f:
+            history.update(json.load(f))
+    return history
+
+
+class CostModel:
+    """Expected build time of projects, learned from earlier runs.
+
+    A project built before is expected to take as long as it did then.
+    Other projects are estimated from their lines of code or, without those,
+    their source size, at the median seconds per line (byte) of the projects
+    in the history. Without any of these, the median build time is used.
+    """
+
+    # used without any history, only the order matters then
+    DEFAULT_COST = 60.0
+    DEFAULT_PER_LINE = 0.006
+
+    def __init__(self, history):
+        self.known = {}
+        per_line = []
+        per_byte = []
+        for name, project in history.items():
+            cost = project_cost(project)
+            if cost is None:
+                continue
+            self.known[name] = cost
+            sloc = project_sloc(project)
+            if sloc:
+                per_line.append(cost / sloc)
+            size = project_size(project)
+            if size:
+                per_byte.append(cost / size)
+        self.per_line = median(per_line)
+        self.per_byte = median(per_byte)
+        self.default = median(self.known.values()) or self.DEFAULT_COST
+
+    def estimate(self, name, project):
+        # (seconds, what the estimate is based on)
+        if name in self.known:
+            return self.known[name], "history"
+        sloc = project_sloc(project)
+        if sloc:
+            return sloc * (self.per_line or self.DEFAULT_PER_LINE), "sloc"
+        size = project_size(project)
+        if size and self.per_byte:
+            return size * self.per_byte, "size"
+        return self.default, "default"
+
+
+def order_projects(projects, model, policy="longest_first"):
+    """Dispatch order of [(name, project)].
+
+    longest_first starts the projects with the highest expected cost first,
+    so the long builds do not end up alone at the end of the run. random
+    keeps the given (shuffled) order.
+    """
+    if policy == "random":
+        return list(projects)
+    if policy != "longest_first":
+        print("unknown schedule {}, using longest_first".format(policy))
+    # sorted is stable, equal estimates stay in random order
+    return sorted(projects, key=lambda p: model.estimate(*p)[0], reverse=True)
+
+
+def makespan(costs, workers):
+    # time until the last job is done when the jobs are dispatched in order,
+    # each to the worker that becomes free first
+    if not costs:
+        return 0.0
+    finish = [0.0] * max(1, min(workers, len(costs)))
+    for cost in costs:
+        heapq.heappush(finish, heapq.heappop(finish) + cost)
+    return max(finish)
+
+
+class ScheduleReport:
+    """Predicted against actual makespan of the projects of a run."""
+
+    def __init__(self, projects, model, workers, policy):
+        self.workers = workers
+        self.policy = policy
+        self.estimates = {name: model.estimate(name, p) for name, p in projects}
+        costs = [self.estimates[name][0] for name, _ in projects]
+        self.predicted = makespan(costs, workers)
+        # the same projects in random order, for comparison
+        self.predicted_random = makespan(
+            random.sample(costs, len(costs)), workers
+        )
+        self.start = None
+        self.end = None
+        self.durations = {}
+
+    def started(self, now):
+        if self.start is None:
+            self.start = now
+
+    def finished(self, name, duration, now):
+        self.durations[name] = duration
+        self.end = now
+
+    def print_report(self):
+        if self.start is None or self.end is None:
+            return
+        bases = {}
+        for name in self.durations:
+            basis = self.estimates.get(name, (0, "default"))[1]
+            bases[basis] = bases.get(basis, 0) + 1
+        print(
+            "schedule {} on {} workers: predicted makespan {:.0f} s (random order "
+            "{:.0f} s), actual {:.0f} s".format(
+                self.policy,
+                self.workers,
+                self.predicted,
+                self.predicted_random,
+                self.end - self.start,
+            )
+        )
+        errors = [
+            abs(self.estimates[name][0] - duration)
+            for name, duration in self.durations.items()
+            if name in self.estimates
+        ]
+        if errors:
+            print(
+                "  estimates from {}, median error {:.0f} s per project".format(
+                    ", ".join("{} {}".format(n, b) for b, n in sorted(bases.items())),
+                    median(errors),
+                )
+            )
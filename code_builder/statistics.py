@@ -11,76 +11,232 @@ from datetime import datetime
 from collections import OrderedDict
 from fuzzywuzzy import process, fuzz
 from time import time
-from . import dep_finder
+from . import dep_finder, log_reader
+from .error_matcher import ErrorMatcher, FuzzyIndex
+from .catalog_store import CatalogStore, CatalogChanges
+from .project_sets import ProjectSet, intern_projects, json_default
+from .patterns import PatternTable
+from .ci_systems.dep_index import write_index
+from .contents_index import ContentsIndex
+
+PATH_REGEX = r"(?:\.\.|\.)?(?:[/]*/)+\S*\.\S+(?:\sline\s\d+:?)?(?=\s|$|\.)"
+PATH_RE = re.compile(PATH_REGEX)
+# file in beginning of line e.g. makefile 96:420:
+FILE_PREFIX_RE = re.compile(r"^\S*\.\S*(?:\:|\ )?\d+(?:\:\d+)?\:\ ")
+# the normal clang error line (filename.xx:line:col: error: )
+CLANG_ERROR_LINE_RE = re.compile(r"^.*\..*\:\d+\:\d+\:.*error\:.*$")
+CLANG_ERROR_RE = re.compile(r"error\:.*$")
+# catalog entries of crashes, set from the project status instead of being
+# learned from logs, a new crash category belongs here too
+DOCKER_CRASH_ERROR = "docker_crash"
+OOM_ERROR = "out_of_memory"
+FIXED_ENTRIES = ("unrecognized", DOCKER_CRASH_ERROR, OOM_ERROR)
+
+# figure out what to do with other error strings
+# (pattern, origin, title), the first matching pattern wins, so the most
+# generic ones are at the end. title extracts the error from the match
+NEW_ERROR_PATTERNS = PatternTable(
+    [
+        (
+            r".*\.o\:" + re.escape(" 'linker' input unused") + r".*$",
+            "clang_other",
+            re.compile(re.escape(".o: 'linker' input unused")),
+        ),
+        (
+            re.escape("[Error] Package ") + r".*" + re.escape(" is not installed"),
+            "cmake - dependency",
+            None,
+        ),
+        (re.escape("clang: error: ") + r".*$", "clang_other", None),
+        (
+            re.escape("ERROR - ") + r".*" + re.escape("not found"),
+            "dependency",
+            None,
+        ),
+        (
+            r".*\s(.+?)" + re.escape(": No such file or directory"),
+            "dependency",
+            None,
+        ),
+        (re.escape("configure: error :") + r".*$", "configure", None),
+        (re.escape("Errors while running CTest"), "testing", None),
+        (
+            re.escape("E: Unable to find a source package") + r".*$",
+            "debian",
+            re.compile(re.escape("E: Unable to find a source package")),
+        ),
+        (r"\.\/configure.*syntax\ error.*$", "configure", None),
+        (re.escape("ERROR - ") + r".*syntax\ error.*", "syntax error", None),
+        (
+            re.escape("ERROR - ")
+            + r".*"
+            + re.escape("Compatibility levels before "),
+            "compatibility error",
+            None,
+        ),
+        (re.escape("fatal error: ") + r".*$", "fatal_error", None),
+        (r".*" + re.escape("command not found"), "bash_command", None),
+        # debian/rules in there to avoid matching to the generic
+        # dpkg: error: debian/rules build subprocess returned exit status 2
+        (re.escape("error: ") + r"(?!debian/rules).*$", "general_error", None),
+        (re.escape("Error: ") + r".*$", "general_error", None),
+        (re.escape("ERROR: ") + r".*$", "general_error", None),
+    ]
+)
 
 
 class Statistics:
 
-    path_regex = r"(?:\.\.|\.)?(?:[/]*/)+\S*\.\S+(?:\sline\s\d+:?)?(?=\s|$|\.)"
+    path_regex = PATH_REGEX
 
-    def __init__(self, project_count):
+    def __init__(
+        self,
+        project_count,
+        fuzzy_matching="index",
+        catalog_store=None,
+        catalogs=None,
+        contents_index=None,
+    ):
         self.correct_projects = 0
         self.incorrect_projects = 0
         self.unrecognized_projects = []
         self.clone_time = 0
         self.build_time = 0
+        self.errortypes = {"unrecognized": {"amount": 0, "projects": ProjectSet()}}
+        # save the failed projects, so we can retry them later
+        self.rebuild_projects = {}
+        self.unrecognized_errs = []
+        self.new_errs = 0
+        self.project_count = project_count
+        # path of the index built by tools/build_contents_index.py, optional
+        self.contents_index = contents_index
+        index = None
+        if contents_index:
+            if os.path.exists(contents_index):
+                index = ContentsIndex(contents_index)
+            else:
+                print("contents index {} not found".format(contents_index))
+        self.dep_finder = dep_finder.DepFinder(index)
+        self.dependencies = {}
+        self.build_systems = {}
+        self.ci_systems = {}
+        self.all_projects = {}
+        self.dep_mapping = {}
+        self.catalog_store = None
+        self.catalog_changes = CatalogChanges()
+        if catalogs is not None:
+            # partial statistics, e.g. in a worker process of the reanalysis,
+            # get the catalogs from the caller and never write them
+            errors_stdout, persistent_dep_mapping = catalogs
+            self.errors_stdout = copy.deepcopy(errors_stdout)
+            self.persistent_dep_mapping = copy.deepcopy(persistent_dep_mapping)
+        else:
+            self.errors_stdout = self.load_errors_json()
+            if catalog_store is None:
+                self.save_errors_json()
+            self.persistent_dep_mapping = self.load_dep_mapping_json()
+        # with a catalog store, errortypes and dep_mapping live in the database,
+        # the JSON files are only imported once and exported on request
+        if catalog_store is not None:
+            self.catalog_store = CatalogStore(catalog_store)
+            # only if the store is empty
+            self.catalog_store.import_json(
+                self.errors_stdout, self.persistent_dep_mapping
+            )
+            self.errors_stdout = self.catalog_store.load_errors()
+            self.persistent_dep_mapping = self.catalog_store.load_dep_mapping()
+        # the projects lists are kept as sets of interned names while we run
+        intern_projects(self.errors_stdout)
+        intern_projects(self.persistent_dep_mapping)
+        # compiled once per run, matches logs against the regexes in errors_stdout
+        self.error_matcher = ErrorMatcher()
+        # "index": score only candidates from the trigram index
+        # "full": score every catalog entry
+        # "compare": do both, use the full result and count disagreements
+        self.fuzzy_matching = fuzzy_matching
+        self.fuzzy_index = FuzzyIndex()
+        self.fuzzy_index.sync(self.errors_stdout)
+        self.fuzzy_mismatches = 0
+
+        self.stat_time = 0
+        # apt-get invocations and seconds saved by batched installs, see
+        # ci_helper.apt_install
+        self.apt_saved_invocations = 0
+        self.apt_saved_seconds = 0.0
+        # lookups of the build result cache, see result_cache.py
+        self.result_cache_hits = 0
+        self.result_cache_misses = 0
+
+    def load_errors_json(self):
         if not os.path.exists("code_builder/errortypes.json"):
             with open("code_builder/errortypes.json", "w") as f:
                 f.write("{}")
         try:
             with open("code_builder/errortypes.json", "r") as f:
-                self.errors_stdout = json.load(f)
+                errors_stdout = json.load(f)
         except FileNotFoundError:
-            self.errors_stdout = {}
+            errors_stdout = {}
         except JSONDecodeError:
             print("error decoding errortypes.json, maybe corrupted?")
-            self.errors_stdout = {}
+            errors_stdout = {}
             shutil.copy(
                 "code_builder/errortypes.json",
                 "code_builder/errortypes.json_backup"
                 + datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
             )
-        for err in self.errors_stdout:
-            if "regex" not in self.errors_stdout[err]:
-                self.errors_stdout[err]["regex"] = re.escape(err)
-            if "amount" not in self.errors_stdout[err]:
-                self.errors_stdout[err]["amount"] = 0
-        self.save_errors_json()
-        self.errortypes = {"unrecognized": {"amount": 0, "projects": []}}
-        # save the failed projects, so we can retry them later
-        self.rebuild_projects = {}
-        self.unrecognized_errs = []
-        self.new_errs = 0
-        self.project_count = project_count
-        self.dep_finder = dep_finder.DepFinder()
-        self.dependencies = {}
-        self.build_systems = {}
-        self.ci_systems = {}
-        self.all_projects = {}
-        self.dep_mapping = {}
+        for err in errors_stdout:
+            if "regex" not in errors_stdout[err]:
+                errors_stdout[err]["regex"] = re.escape(err)
+            if "amount" not in errors_stdout[err]:
+                errors_stdout[err]["amount"] = 0
+        return errors_stdout
+
+    def load_dep_mapping_json(self):
         if not os.path.exists("code_builder/dep_mapping.json"):
             with open("code_builder/dep_mapping.json", "w") as f:
                 f.write("{}")
         try:
             with open("code_builder/dep_mapping.json", "r") as f:
-                self.persistent_dep_mapping = json.load(f)
+                dep_mapping = json.load(f)
         except FileNotFoundError:
-            self.persistent_dep_mapping = {}
+            dep_mapping = {}
         except JSONDecodeError:
             print("error decoding dep_mapping.json, maybe corrupted?")
-            self.errors_stdout = {}
+            dep_mapping = {}
             shutil.copy(
-                "code_builder/errortypes.json",
-                "code_builder/errortypes.json_backup"
+                "code_builder/dep_mapping.json",
+                "code_builder/dep_mapping.json_backup"
                 + datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
             )
-
-        self.stat_time = 0
+        return dep_mapping
 
     def print_stats(self, out):
         print("Repository clone time: %f seconds" % self.clone_time, file=out)
         print("Repository build time: %f seconds" % self.build_time, file=out)
         print("Analyzing time: {} seconds".format(self.stat_time), file=out)
+        print(
+            "apt-get invocations saved by batching: {} (about {:.0f} seconds where "
+            "an apt-get failed to time it)".format(
+                self.apt_saved_invocations, self.apt_saved_seconds
+            ),
+            file=out,
+        )
+        lookups = self.result_cache_hits + self.result_cache_misses
+        if lookups:
+            print(
+                "build result cache: {} hits of {} builds ({:.1f}%)".format(
+                    self.result_cache_hits,
+                    lookups,
+                    100.0 * self.result_cache_hits / lookups,
+                ),
+                file=out,
+            )
+        print(
+            "Error regexes evaluated: {} of {}".format(
+                self.error_matcher.total_evaluated, self.error_matcher.total_patterns
+            ),
+            file=out,
+        )
         print("Succesfull builds: %d" % self.correct_projects, file=out)
         print("Failed builds: %d" % self.incorrect_projects, file=out)
         print(
@@ -95,6 +251,10 @@ class Statistics:
         for p in self.unrecognized_projects:
             print("  {}".format(p), file=out)
         print("newly discovered errors: {}".format(self.new_errs), file=out)
+        if self.fuzzy_matching == "compare":
+            print(
+                "fuzzy index mismatches: {}".format(self.fuzzy_mismatches), file=out
+            )
         print("Types of build errors:", file=out)
         self.errortypes = OrderedDict(
             sorted(
@@ -150,6 +310,14 @@ class Statistics:
             self.clone_time += project["source"].get("time")
         if "build" in project:
             self.build_time += project["build"]["time"]
+            apt_batch = project["build"].get("apt_batch")
+            if apt_batch:
+                self.apt_saved_invocations += apt_batch["saved_invocations"]
+                self.apt_saved_seconds += apt_batch["saved_seconds"]
+        if project.get("result_cache") == "hit":
+            self.result_cache_hits += 1
+        elif project.get("result_cache") == "miss":
+            self.result_cache_misses += 1
         if project.get("double_build_done") and "build" in project and final_update:
             self.map_dependencies(
                 project["no_install_build"].get("missing_dependencies", []),
@@ -173,41 +341,40 @@ class Statistics:
                 self.ci_systems[i]["fail"] += 1
             self.add_incorrect_project()
             self.add_rebuild_data(project, name)
-            err = "docker_crash"
+            # the container was killed for exceeding its memory limit
+            err = OOM_ERROR if project.get("oom_killed") else DOCKER_CRASH_ERROR
             if err not in self.errors_stdout:
-                self.errors_stdout[err] = {
-                    "name": err,
-                    "projects": [name],
-                    "origin": "docker",
-                    # match to nothing, since crashes are not visible in logs
-                    "regex": None,
-                    "amount": 1,
-                }
+                self.add_new_error(
+                    err,
+                    {
+                        "name": err,
+                        "projects": [name],
+                        "origin": "docker",
+                        # match to nothing, since crashes are not visible in logs
+                        "regex": None,
+                        "amount": 0,
+                    },
+                )
+                self.add_error_amount(err)
             elif name not in self.errors_stdout[err]["projects"]:
                 self.errors_stdout[err]["projects"].append(name)
-                self.errors_stdout[err]["amount"] += 1
+                self.catalog_changes.add_error_project(err, name)
+                self.add_error_amount(err)
             if err in self.errortypes:
                 self.errortypes[err]["amount"] += 1
                 if name not in self.errortypes[err]["projects"]:
                     self.errortypes[err]["projects"].append(name)
             else:
-                self.errortypes[err] = copy.deepcopy(self.errors_stdout[err])
-                self.errortypes[err]["amount"] = 1
-                self.errortypes[err]["projects"] = [name]
+                self.add_errortype(err, name)
 
         else:
             if "build" in project:
-                # we pass the error log through all the stages,
-                # always removing the found errors from the string
+                # we stream the error log through all the stages,
+                # lines matched by a stage are skipped by the later ones
                 project["build"]["errortypes"] = []
                 # print("\nstarting error analysis for {}".format(name))
                 err_log = join(project["build"]["dir"], project["build"]["stderr"])
-                with open(err_log, "r") as log:
-                    text = log.read()
-                text = self.find_confident_errors(project, name, text)
-                text = self.match_error_with_regex(project, name, text)
-                text = self.match_error_fuzzy(project, name, text)
-                text = self.find_new_errors(project, name, text)
+                self.classify_log(project, name, err_log)
 
                 # found no errs yet, check docker log (stdout of build)
                 # this file can be big, so try to avoid
@@ -215,12 +382,7 @@ class Statistics:
                     docker_log = join(
                         project["build"]["dir"], project["build"]["docker_log"]
                     )
-                    with open(docker_log, "r") as log:
-                        text = log.read()
-                    text = self.find_confident_errors(project, name, text)
-                    text = self.match_error_with_regex(project, name, text)
-                    text = self.match_error_fuzzy(project, name, text)
-                    text = self.find_new_errors(project, name, text)
+                    self.classify_log(project, name, docker_log)
                     if not project["build"]["errortypes"]:
                         self.errortypes["unrecognized"]["amount"] += 1
                         if name not in self.errortypes["unrecognized"]["projects"]:
@@ -255,9 +417,15 @@ class Statistics:
         self.incorrect_projects += 1
 
     def add_errors(self, project, name, errors):
+        # skip errors that are part of an error we already found, one substring
+        # search over all of them instead of one per error
+        found = "\0".join(project["build"]["errortypes"])
         new_errors = []
         for e in errors:
-            if [i for i in project["build"]["errortypes"] if e in i] == []:
+            if "\0" in e:
+                if [i for i in project["build"]["errortypes"] if e in i] == []:
+                    new_errors.append(e)
+            elif not project["build"]["errortypes"] or e not in found:
                 new_errors.append(e)
         # new_errors = [e for e in errors if e not in project["build"]["errortypes"]]
         for err in new_errors:
@@ -266,90 +434,165 @@ class Statistics:
                 if name not in self.errortypes[err]["projects"]:
                     self.errortypes[err]["projects"].append(name)
             else:
-                self.errortypes[err] = copy.deepcopy(self.errors_stdout[err])
-                self.errortypes[err]["amount"] = 1
-                self.errortypes[err]["projects"] = [name]
+                self.add_errortype(err, name)
 
             if name not in self.errors_stdout[err]["projects"]:
                 self.errors_stdout[err]["projects"].append(name)
-            if "amount" in self.errors_stdout[err]:
-                self.errors_stdout[err]["amount"] += 1
-            else:
-                self.errors_stdout[err]["amount"] = 1
+                self.catalog_changes.add_error_project(err, name)
+            self.add_error_amount(err)
         project["build"]["errortypes"].extend(new_errors)
 
-    def match_error_with_regex(self, project, name, log):
-        log_lines = log.splitlines()
-        errors_matches = [
-            (err, re.search(self.errors_stdout[err]["regex"], log))
-            for err in self.errors_stdout
-            if self.errors_stdout[err]["regex"] is not None
-            and re.search(self.errors_stdout[err]["regex"], log) is not None
+    def add_errortype(self, err, name):
+        # first project of this run with the error, copy the catalog entry
+        # without the projects of the catalog, they get replaced anyway
+        entry = {}
+        for k, v in self.errors_stdout[err].items():
+            entry[k] = None if k == "projects" else copy.deepcopy(v)
+        entry["amount"] = 1
+        entry["projects"] = ProjectSet([name])
+        self.errortypes[err] = entry
+
+    def add_new_error(self, err, entry):
+        # new entry in the errortypes catalog
+        entry["projects"] = ProjectSet(entry.get("projects", []))
+        self.errors_stdout[err] = entry
+        self.catalog_changes.add_error(err, entry)
+        self.fuzzy_index.add(err)
+
+    def add_error_amount(self, err, amount=1):
+        self.errors_stdout[err]["amount"] = (
+            self.errors_stdout[err].get("amount", 0) + amount
+        )
+        self.catalog_changes.add_error_amount(err, amount)
+
+    def classify_log(self, project, name, path):
+        # single pass over the log, block by block. every block goes through
+        # the stages in order, consumed marks the lines already matched
+        if os.path.getsize(path) > log_reader.PREFILTER_SIZE:
+            # huge log, only look at the regions around error markers
+            blocks = log_reader.iter_log_regions(path)
+            regions = True
+            project["statistics"].setdefault("prefiltered_logs", []).append(
+                os.path.basename(path)
+            )
+        else:
+            blocks = log_reader.iter_log_blocks(path)
+            regions = False
+        cmake_state = {"match_next": False, "multiline_err": "", "first_line_err": ""}
+        for lines in blocks:
+            if regions:
+                # there is a gap between two regions, don't continue errors
+                cmake_state = {
+                    "match_next": False,
+                    "multiline_err": "",
+                    "first_line_err": "",
+                }
+            consumed = bytearray(len(lines))
+            self.find_confident_errors(project, name, lines, consumed, cmake_state)
+            self.match_error_with_regex(project, name, lines, consumed)
+            self.match_error_fuzzy(project, name, lines, consumed)
+            self.find_new_errors(project, name, lines, consumed)
+
+    @staticmethod
+    def remaining_lines(lines, consumed, max_length=None):
+        # (index, line) of the lines no stage has matched yet
+        return [
+            (i, l)
+            for i, l in enumerate(lines)
+            if not consumed[i] and (max_length is None or len(l) < max_length)
         ]
+
+    def match_error_with_regex(self, project, name, lines, consumed):
+        remaining = self.remaining_lines(lines, consumed)
+        log = "\n".join(l for _, l in remaining)
+        errors_matches = self.error_matcher.search(self.errors_stdout, log)
+        # keep track of how many regexes we actually had to run on this project
+        statistics = project.setdefault("statistics", {})
+        statistics["regex_evaluated"] = (
+            statistics.get("regex_evaluated", 0) + self.error_matcher.evaluated
+        )
         errors = []
         for err, match in errors_matches:
-            errlines = [i for i in log_lines if match[0] in i]
-            for e in errlines:
-                log = log.replace(e, "")
+            for i, l in remaining:
+                if match[0] in l:
+                    consumed[i] = 1
             errors.append(err)
         # we found the following errors
         self.add_errors(project, name, errors)
-        return log
 
-    def match_error_fuzzy(self, project, name, log):
-        orig_lines = [l for l in log.splitlines() if len(l) < 1000]
-        lines = [re.sub(self.path_regex, "PATH/FILE.TXT", l) for l in orig_lines]
+    def match_error_fuzzy(self, project, name, lines, consumed):
         errors = []
-        for i, l in enumerate(lines):
+        for i, orig_line in self.remaining_lines(lines, consumed, 1000):
+            l = PATH_RE.sub("PATH/FILE.TXT", orig_line)
             # check if string has any processable character, otherwise continue
             processed = fuzzywuzzy.utils.full_process(l)  # type: ignore
             if not processed:
                 continue
-            matches = process.extract(
-                processed, self.errors_stdout.keys(), limit=5, scorer=fuzz.ratio
-            )
+            matches = self.fuzzy_extract(processed)
             # what threshold??
             new_errs = [m[0] for m in matches if m[1] >= 90]
             if new_errs:
-                log.replace(orig_lines[i], "")
-                pass
+                consumed[i] = 1
                 # print("matched \n{}\nto\n{} using fuzzy".format(l, new_errs), sep='\n')
-            errors.extend([m[0] for m in matches if m[1] >= 90])
+            errors.extend(new_errs)
         # remove dups
         self.add_errors(project, name, list(set(errors)))
-        return log
+
+    def fuzzy_extract(self, processed):
+        if self.fuzzy_matching == "index":
+            return self.fuzzy_index.extract(processed, self.errors_stdout, limit=5)
+        matches = process.extract(
+            processed, self.errors_stdout.keys(), limit=5, scorer=fuzz.ratio
+        )
+        if self.fuzzy_matching == "compare":
+            indexed = self.fuzzy_index.extract(processed, self.errors_stdout, limit=5)
+            full_hits = {m for m in matches if m[1] >= 90}
+            if full_hits != {m for m in indexed if m[1] >= 90}:
+                self.fuzzy_mismatches += 1
+                print(
+                    "fuzzy index mismatch for '{}':\n  full: {}\n  index: {}".format(
+                        processed, matches, indexed
+                    )
+                )
+        return matches
 
     # we search for these errors anyway, since they are pretty safely "good"
-    def find_confident_errors(self, project, name, log):
+    def find_confident_errors(self, project, name, lines, consumed, cmake_state):
         # try to find the normal clang error line (match to filename.xx:line:col: error: )
-        errlines = re.findall(
-            r"^.*\..*\:\d+\:\d+\:.*error\:.*$", log, flags=re.MULTILINE
-        )
+        errlines = [
+            (i, l)
+            for i, l in self.remaining_lines(lines, consumed)
+            # cheap check for the literal part of the regex first
+            if "error:" in l and CLANG_ERROR_LINE_RE.search(l)
+        ]
         # if we have nicely formatted errs from clang, we just add to known errs
         if errlines:
-            for err in errlines:
+            for i, err in errlines:
                 # remove filename and lines etc.
-                log = log.replace(err, "")
-                err = re.sub(self.path_regex, "PATH/FILE.EXT", err)
-                err = re.search(r"error\:.*$", err).group(0)
+                consumed[i] = 1
+                err = PATH_RE.sub("PATH/FILE.EXT", err)
+                err = CLANG_ERROR_RE.search(err).group(0)
                 if err not in self.errors_stdout:
-                    self.errors_stdout[err] = {
-                        "name": err.replace("error: ", ""),
-                        "projects": [name],
-                        "origin": "clang",
-                        "regex": re.escape(err).replace(
-                            re.escape("PATH/FILE.EXT"), self.path_regex
-                        ),
-                    }
+                    self.add_new_error(
+                        err,
+                        {
+                            "name": err.replace("error: ", ""),
+                            "projects": [name],
+                            "origin": "clang",
+                            "regex": re.escape(err).replace(
+                                re.escape("PATH/FILE.EXT"), self.path_regex
+                            ),
+                        },
+                    )
                     self.new_errs += 1
                 self.add_errors(project, name, [err])
                 # remove error from log, so it does not get matched again
-        # now we look for cmake errors
-        errlines = [l for l in log.splitlines() if len(l) < 1000]
-        match_next = False
-        multiline_err = ""
-        first_line_err = ""  # used for the regex
-        for err in errlines:
+        # now we look for cmake errors, the state is kept across blocks
+        errlines = self.remaining_lines(lines, consumed, 1000)
+        match_next = cmake_state["match_next"]
+        multiline_err = cmake_state["multiline_err"]
+        first_line_err = cmake_state["first_line_err"]  # used for the regex
+        for i, err in errlines:
             # remove paths
             # err = re.sub(self.path_regex, "PATH/FILE.EXT", err)
             # remove file in beginning of line e.g. makefile 96:420:
@@ -360,7 +603,7 @@ class Statistics:
                     if multiline_err == "":
                         first_line_err = err.strip()
                     multiline_err += err.strip() + " "
-                    log = log.replace(err, "")
+                    consumed[i] = 1
                     continue
                 elif err.strip() == "":
                     # this is just a newline, sometimes this is here
@@ -369,14 +612,17 @@ class Statistics:
                     # this is no longer part of same err
                     if multiline_err.strip() != "":
                         if multiline_err not in self.errors_stdout:
-                            self.errors_stdout[multiline_err] = {
-                                "name": multiline_err,
-                                "projects": [name],
-                                "origin": "CMake",
-                                "regex": re.escape(first_line_err).replace(
-                                    re.escape("PATH/FILE.EXT"), self.path_regex
-                                ),
-                            }
+                            self.add_new_error(
+                                multiline_err,
+                                {
+                                    "name": multiline_err,
+                                    "projects": [name],
+                                    "origin": "CMake",
+                                    "regex": re.escape(first_line_err).replace(
+                                        re.escape("PATH/FILE.EXT"), self.path_regex
+                                    ),
+                                },
+                            )
                             self.new_errs += 1
                         self.add_errors(project, name, [multiline_err])
                     match_next = False
@@ -386,106 +632,68 @@ class Statistics:
             # and then the error in next line
             elif "CMake Error at" in err:
                 match_next = True
-                log = log.replace(err, "")
+                consumed[i] = 1
                 continue
-        return log
-
-    def find_new_errors(self, project, name, log):
-
-        errlines = [l for l in log.splitlines() if len(l) < 1000]
-        # figure out what to do with other error strings
-        # this dict contains the error match and then thi origin, at the
-        # end is the most generic one.
-        err_patterns = [
-            (
-                r".*\.o\:" + re.escape(" 'linker' input unused") + r".*$",
-                "clang_other",
-                re.escape(".o: 'linker' input unused"),
-            ),
-            (
-                re.escape("[Error] Package ") + r".*" + re.escape(" is not installed"),
-                "cmake - dependency",
-                False,
-            ),
-            (re.escape("clang: error: ") + r".*$", "clang_other", False),
-            (
-                re.escape("ERROR - ") + r".*" + re.escape("not found"),
-                "dependency",
-                False,
-            ),
-            (
-                r".*\s(.+?)" + re.escape(": No such file or directory"),
-                "dependency",
-                False,
-            ),
-            (re.escape("configure: error :") + r".*$", "configure", False),
-            (re.escape("Errors while running CTest"), "testing", False),
-            (
-                re.escape("E: Unable to find a source package") + r".*$",
-                "debian",
-                re.escape("E: Unable to find a source package"),
-            ),
-            (r"\.\/configure.*syntax\ error.*$", "configure", False),
-            (re.escape("ERROR - ") + r".*syntax\ error.*", "syntax error", False),
-            (
-                re.escape("ERROR - ")
-                + r".*"
-                + re.escape("Compatibility levels before "),
-                "compatibility error",
-                False,
-            ),
-            (re.escape("fatal error: ") + r".*$", "fatal_error", False),
-            (r".*" + re.escape("command not found"), "bash_command", False),
-            # debian/rules in there to avoid matching to the generic
-            # dpkg: error: debian/rules build subprocess returned exit status 2
-            (re.escape("error: ") + r"(?!debian/rules).*$", "general_error", False),
-            (re.escape("Error: ") + r".*$", "general_error", False),
-            (re.escape("ERROR: ") + r".*$", "general_error", False),
-        ]
+        cmake_state["match_next"] = match_next
+        cmake_state["multiline_err"] = multiline_err
+        cmake_state["first_line_err"] = first_line_err
 
-        for err in errlines:
-            # for the removal of the error from log
-            original_line = err
-            # remove paths
-            err = re.sub(self.path_regex, "PATH/FILE.EXT", err)
+    def find_new_errors(self, project, name, lines, consumed):
+
+        errlines = self.remaining_lines(lines, consumed, 1000)
+        for i, err in errlines:
+            # remove paths, they always contain a /
+            if "/" in err:
+                err = PATH_RE.sub("PATH/FILE.EXT", err)
             # remove file in beginning of line e.g. makefile 96:420:
-            err = re.sub(r"^\S*\.\S*(?:\:|\ )?\d+(?:\:\d+)?\:\ ", "", err)
-
-            for match, origin, title in err_patterns:
-                regex_result = re.search(match, err)
-                if regex_result:
-                    # regex to extract paths and filenames
-                    err = (
-                        re.search(title, err).group() if title else regex_result.group()
-                    )
-                    # print("matched err {}".format(err))
-                    if err not in self.errors_stdout:
-                        self.errors_stdout[err] = {
-                            "name": err,
-                            "projects": [name],
-                            "origin": origin,
-                            "regex": re.escape(err).replace(
-                                re.escape("PATH/FILE.EXT"), self.path_regex
-                            ),
-                        }
-                        self.new_errs += 1
-                    # elif name not in self.errors_stdout[err]["projects"]:
-                    #     self.errors_stdout[err]["projects"].append(name)
-                    self.add_errors(project, name, [err])
-                    log = log.replace(original_line, "")
-                    break
-        return log
+            err = FILE_PREFIX_RE.sub("", err)
+
+            # one pass over the line for all patterns
+            found = NEW_ERROR_PATTERNS.first_match(err)
+            if found is None:
+                continue
+            idx, regex_result = found
+            _, origin, title = NEW_ERROR_PATTERNS.entries[idx]
+            # regex to extract paths and filenames
+            err = title.search(err).group() if title else regex_result.group()
+            # print("matched err {}".format(err))
+            if err not in self.errors_stdout:
+                self.add_new_error(
+                    err,
+                    {
+                        "name": err,
+                        "projects": [name],
+                        "origin": origin,
+                        "regex": re.escape(err).replace(
+                            re.escape("PATH/FILE.EXT"), self.path_regex
+                        ),
+                    },
+                )
+                self.new_errs += 1
+            # elif name not in self.errors_stdout[err]["projects"]:
+            #     self.errors_stdout[err]["projects"].append(name)
+            self.add_errors(project, name, [err])
+            consumed[i] = 1
 
     def find_deps(self, project, name):
-        confident_deps, dependencies = self.dep_finder.analyze_logs(project, name)
+        # the logs were scanned by the package stage already if it checked
+        # the build for a missing dependencies retry
+        confident_deps, dependencies = self.dep_finder.analyze_logs(
+            project, name, project["build"].pop("dep_scan", None)
+        )
         dependencies = confident_deps + dependencies
         self.add_depencenies(dependencies, name)
         project["build"]["missing_dependencies"] = dependencies
+        # packages of the missing files, installed by the retry build
+        resolved = self.dep_finder.resolve(dependencies)
+        if resolved:
+            project["build"]["resolved_dependencies"] = resolved
         if not project.get("is_first_build", False):
             try:
-                self.rebuild_projects[project["type"]][name][
-                    "missing_deps"
-                ] = dependencies
+                rebuild_data = self.rebuild_projects[project["type"]][name]
+                rebuild_data["missing_deps"] = dependencies
+                if resolved:
+                    rebuild_data["resolved_deps"] = resolved
             except KeyError:
                 pass
 
@@ -498,7 +706,7 @@ class Statistics:
             else:
                 self.dependencies[dep] = {}
                 self.dependencies[dep]["count"] = 1
-                self.dependencies[dep]["projects"] = [name]
+                self.dependencies[dep]["projects"] = ProjectSet([name])
 
     def map_dependencies(self, missing: list, installed: list, name: str) -> None:
         if installed == []:
@@ -511,14 +719,17 @@ class Statistics:
                 self.persistent_dep_mapping[m] = {}
                 self.persistent_dep_mapping[m]["deps"] = {}
                 self.persistent_dep_mapping[m]["source"] = src
-                self.persistent_dep_mapping[m]["projects"] = []
+                self.persistent_dep_mapping[m]["projects"] = ProjectSet()
+                self.catalog_changes.add_dependency(m, src)
             for i in installed:
                 self.dep_mapping[m][i] = self.dep_mapping[m].get(i, 0) + 1
                 self.persistent_dep_mapping[m]["deps"][i] = (
                     self.persistent_dep_mapping[m]["deps"].get(i, 0) + 1
                 )
+                self.catalog_changes.add_dependency_install(m, i)
                 if name not in self.persistent_dep_mapping[m]["projects"]:
                     self.persistent_dep_mapping[m]["projects"].append(name)
+                    self.catalog_changes.add_dependency_project(m, name)
 
     def add_rebuild_data(self, project, name):
         # we don't want the projects first build if we build twice
@@ -540,6 +751,100 @@ class Statistics:
             self.rebuild_projects[project["type"]] = {}
         self.rebuild_projects[project["type"]][name] = rebuild_data
 
+    def detach_catalogs(self):
+        # drop the catalogs before a partial result is sent to another process,
+        # everything merge needs is in the catalog changes
+        self.errors_stdout = {}
+        self.persistent_dep_mapping = {}
+        self.fuzzy_index = FuzzyIndex()
+        self.error_matcher.signatures = {}
+
+    def merge(self, other):
+        # add the partial statistics of another instance. merging partials in
+        # a fixed order gives the same result, no matter which finished first
+        self.correct_projects += other.correct_projects
+        self.incorrect_projects += other.incorrect_projects
+        self.unrecognized_projects.extend(other.unrecognized_projects)
+        self.clone_time += other.clone_time
+        self.build_time += other.build_time
+        self.stat_time += other.stat_time
+        self.apt_saved_invocations += other.apt_saved_invocations
+        self.apt_saved_seconds += other.apt_saved_seconds
+        self.result_cache_hits += other.result_cache_hits
+        self.result_cache_misses += other.result_cache_misses
+        self.fuzzy_mismatches += other.fuzzy_mismatches
+        self.error_matcher.total_evaluated += other.error_matcher.total_evaluated
+        self.error_matcher.total_patterns += other.error_matcher.total_patterns
+        for systems, other_systems in (
+            (self.build_systems, other.build_systems),
+            (self.ci_systems, other.ci_systems),
+        ):
+            for system, counts in other_systems.items():
+                if system not in systems:
+                    systems[system] = {"success": 0, "fail": 0}
+                systems[system]["success"] += counts["success"]
+                systems[system]["fail"] += counts["fail"]
+        for err, data in other.errortypes.items():
+            if err not in self.errortypes:
+                self.errortypes[err] = copy.deepcopy(data)
+                continue
+            self.errortypes[err]["amount"] += data["amount"]
+            for name in data["projects"]:
+                if name not in self.errortypes[err]["projects"]:
+                    self.errortypes[err]["projects"].append(name)
+        for source, projects in other.rebuild_projects.items():
+            if source not in self.rebuild_projects:
+                self.rebuild_projects[source] = {}
+            self.rebuild_projects[source].update(projects)
+        for dep, data in other.dependencies.items():
+            if dep not in self.dependencies:
+                self.dependencies[dep] = copy.deepcopy(data)
+                continue
+            for name in data["projects"]:
+                if name not in self.dependencies[dep]["projects"]:
+                    self.dependencies[dep]["count"] += 1
+                    self.dependencies[dep]["projects"].append(name)
+        for m, deps in other.dep_mapping.items():
+            if m not in self.dep_mapping:
+                self.dep_mapping[m] = {}
+            for pkg, count in deps.items():
+                self.dep_mapping[m][pkg] = self.dep_mapping[m].get(pkg, 0) + count
+        self.all_projects.update(other.all_projects)
+
+        # the same new error can be found by several partials, keep the first
+        changes = other.catalog_changes
+        for err, entry in changes.new_errors.items():
+            if err not in self.errors_stdout:
+                entry = copy.deepcopy(entry)
+                entry["projects"] = []
+                entry["amount"] = 0
+                self.add_new_error(err, entry)
+                self.new_errs += 1
+        for err, names in changes.error_projects.items():
+            for name in names:
+                if name not in self.errors_stdout[err]["projects"]:
+                    self.errors_stdout[err]["projects"].append(name)
+                    self.catalog_changes.add_error_project(err, name)
+        for err, amount in changes.error_amounts.items():
+            self.add_error_amount(err, amount)
+        for m, src in changes.dep_sources.items():
+            if m not in self.persistent_dep_mapping:
+                self.persistent_dep_mapping[m] = {
+                    "deps": {},
+                    "source": src,
+                    "projects": ProjectSet(),
+                }
+                self.catalog_changes.add_dependency(m, src)
+        for (m, pkg), count in changes.dep_counts.items():
+            deps = self.persistent_dep_mapping[m]["deps"]
+            deps[pkg] = deps.get(pkg, 0) + count
+            self.catalog_changes.add_dependency_install(m, pkg, count)
+        for m, names in changes.dep_projects.items():
+            for name in names:
+                if name not in self.persistent_dep_mapping[m]["projects"]:
+                    self.persistent_dep_mapping[m]["projects"].append(name)
+                    self.catalog_changes.add_dependency_project(m, name)
+
     def save_errorstat_json(self, path, timestamp):
         path = join(
             path, "errorstats_{}_{}.json".format(timestamp, self.project_count),
@@ -552,7 +857,7 @@ class Statistics:
             )
         )
         with open(path, "w") as o:
-            o.write(json.dumps(self.errortypes, indent=2))
+            o.write(json.dumps(self.errortypes, indent=2, default=json_default))
 
     def save_rebuild_json(self, path, timestamp):
         rebuild_with_missing = {}
@@ -572,7 +877,31 @@ class Statistics:
         with open(name_with_missing, "w") as o:
             o.write(json.dumps(rebuild_with_missing, indent=2))
 
+    def save_catalog_changes(self):
+        # write the changed entries to the store and pick up the
+        # entries other runs added in the meantime
+        if self.catalog_changes:
+            self.catalog_store.apply(self.catalog_changes)
+        new_errors = intern_projects(self.catalog_store.load_new_errors())
+        for err, entry in new_errors.items():
+            if err not in self.errors_stdout:
+                self.errors_stdout[err] = entry
+                self.fuzzy_index.add(err)
+
+    def export_catalogs(self):
+        # write errortypes.json and dep_mapping.json from the catalog store
+        if self.catalog_store is None:
+            return
+        self.save_catalog_changes()
+        self.catalog_store.export_errors_json(join("code_builder", "errortypes.json"))
+        self.catalog_store.export_dep_mapping_json(
+            join("code_builder", "dep_mapping.json")
+        )
+
     def save_errors_json(self, path=None):
+        if self.catalog_store is not None and path is None:
+            self.save_catalog_changes()
+            return
         if path is None:
             path = join("code_builder", "errortypes.json")
         self.errors_stdout = OrderedDict(
@@ -583,9 +912,11 @@ class Statistics:
             )
         )
         with open(path, "w") as o:
-            o.write(json.dumps(self.errors_stdout, indent=2))
+            o.write(json.dumps(self.errors_stdout, indent=2, default=json_default))
+        # only needed with a catalog store
+        self.catalog_changes.clear()
 
-    def save_dependencies_json(self, path, timestamp):
+    def save_dependencies_json(self, path, timestamp, save_mapping=True):
         name = join(
             path, "dependencies_{}_{}.json".format(timestamp, self.project_count),
         )
@@ -600,8 +931,28 @@ class Statistics:
             )
         )
         with open(name, "w") as o:
-            o.write(json.dumps(self.dependencies, indent=2))
+            o.write(json.dumps(self.dependencies, indent=2, default=json_default))
         with open(map_name, "w") as o:
             o.write(json.dumps(self.dep_mapping, indent=2))
+        if not save_mapping:
+            return
+        if self.catalog_store is not None:
+            # the containers of this run read the mapping and its index from
+            # the file, not from the store. Rewritten only when the packages
+            # of the mapping changed, new project names do not matter to them
+            changed = bool(
+                self.catalog_changes.dep_sources or self.catalog_changes.dep_counts
+            )
+            self.save_catalog_changes()
+            if changed:
+                self.catalog_store.export_dep_mapping_json(
+                    join("code_builder", "dep_mapping.json")
+                )
+            return
         with open("code_builder/dep_mapping.json", "w") as o:
-            o.write(json.dumps(self.persistent_dep_mapping, indent=2))
+            o.write(
+                json.dumps(self.persistent_dep_mapping, indent=2, default=json_default)
+            )
+        # used by the build containers to look up the mapping
+        write_index(self.persistent_dep_mapping, "code_builder/dep_mapping.json")
+        self.catalog_changes.clear()
@@ -0,0 +1,106 @@
+import queue
+import threading
+import traceback
+
+from os import makedirs
+from os.path import isdir
+from time import time
+
+
+class StatisticsWorker(threading.Thread):
+    """Runs the error analysis of finished projects off the build loop.
+
+    build_projects only hands the finished projects over, the worker updates
+    the statistics and appends the projects to the journal of the run. The
+    journal is synced and the JSON files are written every flush_projects
+    projects or flush_interval seconds, whatever comes first.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        stats,
+        log_dir,
+        timestamp,
+        journal,
+        projects_count,
+        flush_projects=10,
+        flush_interval=60,
+    ):
+        super().__init__(name="statistics", daemon=True)
+        self.stats = stats
+        self.log_dir = log_dir
+        self.timestamp = timestamp
+        self.journal = journal
+        self.projects_count = projects_count
+        self.flush_projects = flush_projects
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.last_flush = time()
+
+    def submit(self, idx, name, project):
+        # the project must not be modified by the caller afterwards
+        self.queue.put((idx, name, project))
+
+    def stop(self):
+        # process everything still queued, flush and wait for the thread
+        self.queue.put(self._STOP)
+        self.join()
+
+    def run(self):
+        while True:
+            if self.pending:
+                timeout = max(0, self.flush_interval - (time() - self.last_flush))
+            else:
+                timeout = None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self.flush()
+                continue
+            if item is self._STOP:
+                break
+            self.analyze(*item)
+            if (
+                self.pending >= self.flush_projects
+                or time() - self.last_flush >= self.flush_interval
+            ):
+                self.flush()
+        if self.pending:
+            self.flush()
+        self.journal.close()
+
+    def analyze(self, idx, name, project):
+        start = time()
+        try:
+            print(f"[{idx}/{self.projects_count}] stats for {name}")
+            self.stats.update(project, name)
+        except Exception as e:
+            print("Error updating stats: {}".format(e))
+        try:
+            self.journal.append(name, project)
+        except Exception as e:
+            print("Error writing {} to the journal: {}".format(name, e))
+        self.pending += 1
+        print(f"Stats update for {name} took {time() - start} seconds")
+
+    def flush(self):
+        start = time()
+        try:
+            # the finished projects survive a crash from here on
+            self.journal.sync()
+            if not isdir(self.log_dir):
+                makedirs(self.log_dir)
+            self.stats.save_rebuild_json(self.log_dir, self.timestamp)
+            self.stats.save_errors_json()
+            self.stats.save_errorstat_json(self.log_dir, self.timestamp)
+            self.stats.save_dependencies_json(self.log_dir, self.timestamp)
+        except Exception:
+            print("Error saving statistics:\n{}".format(traceback.format_exc()))
+        print(
+            f"Saved statistics of {self.pending} projects in {time() - start} seconds"
+        )
+        self.pending = 0
+        self.last_flush = time()
@@ -0,0 +1,235 @@
+import asyncio
+import functools
+import threading
+import traceback
+import uuid
+
+from datetime import datetime, timezone
+from time import time
+
+import docker
+
+# labels of the build containers, set by start_docker
+NAME_LABEL = "code_builder.name"
+TIMEOUT_LABEL = "code_builder.timeout"
+# the supervisor of the run, containers of other runs on the host are left alone
+RUN_LABEL = "code_builder.run"
+# key of the results set once the supervisor stopped watching, start_docker
+# checks the progress of its container itself then
+FAILED = "supervisor_failed"
+
+
+def container_memory(container):
+    # memory used by the container right now, its peak on cgroup v1. 0 if
+    # docker does not tell
+    try:
+        try:
+            stats = container.stats(stream=False, one_shot=True)
+        except TypeError:
+            # docker-py < 5
+            stats = container.stats(stream=False)
+    except Exception:
+        return 0
+    memory = stats.get("memory_stats") or {}
+    return max(memory.get("max_usage", 0), memory.get("usage", 0))
+
+
+def last_log_time(container):
+    # unix time of the last line the container printed, None if none yet
+    logs = container.logs(timestamps=True, tail=1)
+    if not logs:
+        return None
+    # RFC 3339 with nanoseconds, e.g. 2024-01-01T12:00:00.123456789Z
+    stamp = logs.split(b" ", 1)[0].decode().rstrip("Z")
+    seconds, _, fraction = stamp.partition(".")
+    parsed = datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S")
+    return (
+        parsed.replace(tzinfo=timezone.utc).timestamp()
+        + float("0." + (fraction or "0"))
+    )
+
+
+class ContainerSupervisor(threading.Thread):
+    """Watches all build containers from one asyncio loop in the main process.
+
+    The containers are found through the start events of the docker events
+    stream, by the RUN_LABEL of this supervisor, run_id. A container that
+    printed nothing for its timeout (docker_timeout minutes) is stopped,
+    checked by a timer that fires when the last log line gets too old, not by
+    polling. Running out of memory is an event too, but the peak memory is
+    not: the cgroup of a container is gone by the time its die event
+    arrives, so the memory of every container is still sampled every
+    memory_interval seconds (0 to not sample). What the build
+    processes need after container.wait() returned ends up in results,
+    a Manager dict shared with them: {container id: {"memory_peak": bytes,
+    "oom": bool, "stalled": bool}}, dropped once the container is removed. If
+    the supervisor fails, its error is in error and in results[FAILED].
+    """
+
+    def __init__(self, results, memory_interval=10):
+        super().__init__(name="container supervisor", daemon=True)
+        self.results = results
+        self.memory_interval = memory_interval
+        # value of RUN_LABEL, start_docker labels the containers with it
+        self.run_id = uuid.uuid4().hex
+        self.client = docker.from_env()
+        self.events = None
+        self.loop = None
+        self.tasks = {}
+        self.ready = threading.Event()
+        self.stopping = False
+        self.error = None
+
+    def start(self):
+        super().start()
+        # containers started before the subscription would go unwatched
+        while not self.ready.wait(1):
+            if not self.is_alive():
+                # died before run() got to its finally, nothing would set ready
+                raise RuntimeError("container supervisor died while starting")
+
+    def stop(self):
+        # ends the events stream, the loop stops with it
+        self.stopping = True
+        if self.events is not None:
+            self.events.close()
+        self.join()
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+            if not self.stopping:
+                self.fail(self.error or "the docker events stream ended")
+        except Exception:
+            self.fail(traceback.format_exc())
+        finally:
+            self.ready.set()
+
+    def fail(self, error):
+        # the builds go on, their containers are no longer watched from here
+        self.error = error
+        print("container supervisor failed, builds check their containers "
+              "themselves:\n{}".format(error), flush=True)
+        try:
+            self.results[FAILED] = str(error)
+        except Exception:
+            pass
+
+    async def call(self, f, *args, **kwargs):
+        # the docker client blocks, run it in the default executor
+        return await self.loop.run_in_executor(
+            None, functools.partial(f, *args, **kwargs)
+        )
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self.events = self.client.events(
+            decode=True,
+            filters={
+                "type": "container",
+                "event": ["start", "die", "oom", "destroy"],
+                "label": "{}={}".format(RUN_LABEL, self.run_id),
+            },
+        )
+        reader = self.loop.run_in_executor(None, self.read_events, queue)
+        # containers of an earlier supervisor, e.g. after a restart
+        running = await self.call(
+            self.client.containers.list,
+            filters={"label": "{}={}".format(RUN_LABEL, self.run_id)},
+        )
+        for container in running:
+            self.watch(container.id, container.labels)
+        self.ready.set()
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            self.handle(event)
+        for tasks in self.tasks.values():
+            for task in tasks:
+                task.cancel()
+        await reader
+
+    def read_events(self, queue):
+        # runs in a thread, the events stream blocks until stop closes it
+        try:
+            for event in self.events:
+                self.loop.call_soon_threadsafe(queue.put_nowait, event)
+        except Exception as e:
+            # closing the stream on stop raises too
+            if not self.stopping:
+                self.error = "docker events stream failed: {}".format(e)
+        self.loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    def handle(self, event):
+        action = event.get("Action") or event.get("status")
+        actor = event.get("Actor") or {}
+        container_id = actor.get("ID") or event.get("id")
+        if action == "start":
+            self.watch(container_id, actor.get("Attributes") or {})
+        elif action == "oom":
+            self.update(container_id, oom=True)
+        elif action == "die":
+            for task in self.tasks.pop(container_id, ()):
+                task.cancel()
+        elif action == "destroy":
+            # start_docker read the results before removing the container,
+            # events after that would otherwise stay in the dict
+            self.results.pop(container_id, None)
+
+    def update(self, container_id, **values):
+        # nested values of a Manager dict have to be written as a whole
+        result = dict(self.results.get(container_id, {}))
+        result.update(values)
+        self.results[container_id] = result
+
+    def watch(self, container_id, labels):
+        if container_id in self.tasks:
+            return
+        name = labels.get(NAME_LABEL, container_id[:12])
+        timeout = float(labels.get(TIMEOUT_LABEL, 0))
+        tasks = [self.loop.create_task(self.watch_progress(container_id, name, timeout))]
+        if self.memory_interval:
+            tasks.append(self.loop.create_task(self.watch_memory(container_id)))
+        self.tasks[container_id] = tasks
+
+    async def watch_progress(self, container_id, name, timeout):
+        # stop the container once it printed nothing for timeout seconds,
+        # the next check is when the last line becomes too old
+        if not timeout:
+            return
+        container = await self.call(self.client.containers.get, container_id)
+        started = time()
+        deadline = started + timeout
+        while True:
+            await asyncio.sleep(max(0.0, deadline - time()))
+            try:
+                last = await self.call(last_log_time, container)
+            except Exception:
+                # the container is gone
+                return
+            last = max(last or 0, started)
+            if time() - last >= timeout:
+                print(
+                    "stopping container of {}, no progress in {:.0f} min".format(
+                        name, timeout / 60
+                    )
+                )
+                self.update(container_id, stalled=True)
+                try:
+                    await self.call(container.stop, timeout=3)
+                except Exception:
+                    pass
+                return
+            deadline = last + timeout
+
+    async def watch_memory(self, container_id):
+        container = await self.call(self.client.containers.get, container_id)
+        peak = 0
+        while True:
+            memory = await self.call(container_memory, container)
+            if memory > peak:
+                peak = memory
+                self.update(container_id, memory_peak=peak)
+            await asyncio.sleep(self.memory_interval)
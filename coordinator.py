@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from sys import argv, exit, stderr
+from datetime import datetime
+from os import path
+
+from code_builder.coordinator import Coordinator, farm_config
+from code_builder.repositories import load_repositories, parse_shard
+from code_builder.utils.driver import open_config
+
+parser = ArgumentParser(description='Coordinator of a build farm, hands out projects to agent.py')
+parser.add_argument('repositories_db', type=str, help='Load repositories database from file')
+parser.add_argument('--build-dir', dest='build_dir', default='build', action='store',
+        help='Directory for all_built.json and the journal of the run')
+parser.add_argument('--log_dir', dest='log_dir', default='buildlogs', action='store',
+        help='Directory used to store the logs and build stats')
+parser.add_argument('--host', dest='host', default=None, action='store',
+        help='Address to listen on, host in the farm section of the config by default')
+parser.add_argument('--port', dest='port', default=None, type=int, action='store',
+        help='Port to listen on, port in the farm section of the config by default')
+parser.add_argument('--user-config-file', dest='user_config_file', default='user.cfg', action='store',
+        help='User config file')
+parser.add_argument('--config-file', dest='config_file', default='build.cfg', action='store',
+        help='Application config file')
+parser.add_argument('--verbose', dest='verbose', action='store_true',
+        help='Verbose output.')
+parser.add_argument('--shard', dest='shard', default=None, action='store',
+        help='Hand out only shard i/N of the database, e.g. 0/4, to split it between farms')
+parser.add_argument('--limit', dest='limit', default=None, type=int, action='store',
+        help='Hand out at most this many projects (of the shard)')
+
+parsed_args = parser.parse_args(argv[1:])
+cfg = open_config(parsed_args, path.dirname(path.realpath(__file__)))
+cfg['output'] = {'verbose' : parsed_args.verbose}
+cfg['output']['time'] = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+farm = farm_config(cfg)
+
+try:
+    shard = parse_shard(parsed_args.shard) if parsed_args.shard else None
+except ValueError as e:
+    print(e, file=stderr)
+    exit(1)
+# read project by project, like builder.py
+repositories = load_repositories(parsed_args.repositories_db, shard, parsed_args.limit)
+
+coordinator = Coordinator(repositories, parsed_args.build_dir, parsed_args.log_dir, cfg)
+coordinator.serve(
+    parsed_args.host or farm.get('host', '0.0.0.0'),
+    parsed_args.port if parsed_args.port is not None else int(farm.get('port', 8750)),
+)
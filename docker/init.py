@@ -7,7 +7,7 @@ import subprocess
 from subprocess import PIPE
 import json
 
-from time import time
+from time import sleep, time
 from shutil import move, copyfile, copy2
 from datetime import datetime
 
@@ -18,6 +18,12 @@ from utils.driver import open_logfiles  # type: ignore
 from build_systems.utils import run  # type: ignore
 
 DOCKER_MOUNT_POINT = "/home/fba_code"
+# the protocol with ImageCache of code_builder/image_cache.py, keep in sync
+DEPS_MARKER = "fbacode: build dependencies installed"
+DEPS_INSTALLED = ".deps_installed.json"
+DEPS_COMMITTED = ".deps_committed"
+# packages of the image before the build dependencies, kept by a commit
+DEPS_PREINSTALLED = "/var/lib/fbacode_preinstalled.json"
 
 
 class Context:
@@ -53,6 +59,8 @@ external_ast_dir = os.environ.get("AST_DIR")
 # install_deps = not (os.environ.get("DEPENDENCY_INSTALL", "") == "False")
 install_deps = True
 skip_build = os.environ.get("SKIP_BUILD", "") == "True"
+# "commit": install the build dependencies first, the host commits them
+deps_image = os.environ.get("DEPS_IMAGE", "")
 
 json_input = json.load(open(sys.argv[1], "r"))
 idx = json_input["idx"]
@@ -71,6 +79,8 @@ chown_dirs = [build_dir, source_dir]
 
 cfg = {"output": {"verbose": verbose, "file": f"{DOCKER_MOUNT_POINT}/"}}
 ctx = Context(cfg)
+# logs of the container a cached image was committed from
+stale_logs = set(glob.glob("*.log"))
 timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
 loggers = open_logfiles(cfg, name.replace("/", "_"), timestamp = timestamp)
 ctx.set_loggers(loggers.stdout, loggers.stderr)
@@ -82,6 +92,10 @@ preinstalled_pkgs = out.stdout.splitlines()
 preinstalled_pkgs = [
     i.replace("install", "").strip() for i in preinstalled_pkgs if "deinstall" not in i
 ]
+if os.path.exists(DEPS_PREINSTALLED):
+    # a cached image, its build dependencies are installed by this build too
+    with open(DEPS_PREINSTALLED, "r") as f:
+        preinstalled_pkgs = json.load(f)
 
 # Updated -> Configure
 project = {
@@ -102,11 +116,32 @@ if "version" in json_input["project"]:
 
 builder = builder_class(source_dir, build_dir, idx, ctx, name, project)
 ci = ci_class(source_dir, build_dir, idx, ctx, name, project, builder.COPY_SRC_TO_BUILD)
-start = time()
-copied_src = builder.copy_src()
-end = time()
-copy_time = end - start
-if copied_src and install_deps:
+
+
+def link_wrapper(wrapper, path):
+    # point path at the compiler wrapper, replacing whatever is there
+    tmp = path + ".fbacode"
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/{wrapper}", tmp)
+    os.replace(tmp, path)
+
+
+def relink_wrappers(bin_dir="/usr/bin"):
+    # the links the image sets up (ln -fs in the dockerfiles), the versioned
+    # clang binaries only where a package installed them
+    for wrapper, names in (("clang", ("cc", "gcc")), ("clang++", ("c++", "cpp", "g++"))):
+        for name in names:
+            link_wrapper(wrapper, os.path.join(bin_dir, name))
+    versions = "4.6 4.7 4.8 4.9 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19".split()
+    for wrapper in ("clang", "clang++"):
+        for name in [wrapper] + ["{}-{}".format(wrapper, v) for v in versions]:
+            path = os.path.join(bin_dir, name)
+            if os.path.lexists(path):
+                link_wrapper(wrapper, path)
+
+
+def install_dependencies():
     print_section(idx, ctx, "installing dependencies with {}".format(ci_system))
     # by default, get dependencies with ci system
     start = time()
@@ -119,6 +154,45 @@ if copied_src and install_deps:
     end = time()
     project["build"]["install_time"] = end - start
     print_section(idx, ctx, "done installing dependencies")
+    return success
+
+
+def commit_dependencies():
+    # let the host commit the container with the dependencies before the
+    # source is fetched, the image is shared by other packages
+    out = run(["dpkg", "--get-selections"], capture_output = True, text = True)
+    installed = [
+        i.replace("install", "").strip()
+        for i in out.stdout.splitlines()
+        if "deinstall" not in i
+    ]
+    with open(DEPS_PREINSTALLED, "w") as f:
+        json.dump(preinstalled_pkgs, f)
+    with open(os.path.join(build_dir, DEPS_INSTALLED), "w") as f:
+        json.dump(sorted(set(installed) - set(preinstalled_pkgs)), f)
+    print(DEPS_MARKER)
+    committed = os.path.join(build_dir, DEPS_COMMITTED)
+    deadline = time() + 30 * 60
+    while not os.path.exists(committed) and time() < deadline:
+        sleep(1)
+    for path in (DEPS_INSTALLED, DEPS_COMMITTED):
+        if os.path.exists(os.path.join(build_dir, path)):
+            os.unlink(os.path.join(build_dir, path))
+
+
+installed_deps = False
+if deps_image == "commit" and install_deps:
+    # the debian installer does not need the source
+    installed_deps = True
+    if install_dependencies():
+        commit_dependencies()
+start = time()
+copied_src = builder.copy_src()
+end = time()
+copy_time = end - start
+if copied_src and install_deps:
+    if not installed_deps:
+        install_dependencies()
     # check if there are missing dependencies fields in the project file
     if "missing_deps" in json_input["project"]:
         print_section(idx, ctx, "installing missing dependencies from prev. build")
@@ -131,27 +205,13 @@ if copied_src and install_deps:
             project,
             dependency_map,
             json_input["project"]["missing_deps"],
+            json_input["project"].get("resolved_deps"),
         )
         installer.install()
         print_section(idx, ctx, "done installing dependencies from prev. build")
         
-        os.unlink("/usr/bin/clang")
-        os.unlink("/usr/bin/clang++")
-        os.unlink("/usr/bin/cc")
-        os.unlink("/usr/bin/gcc")
-        os.unlink("/usr/bin/g++")
-
-        os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang", "/usr/bin/cc")
-        os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang++", "/usr/bin/c++")
-        os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang++", "/usr/bin/cpp")
-        os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang", "/usr/bin/gcc")
-        os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang++", "/usr/bin/g++")
-
-        for version in "4.6 4.7 4.8 4.9 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19".split():
-            os.unlink(f"/usr/bin/clang-{version}")
-            os.unlink(f"/usr/bin/clang++-{version}")
-            os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang", f"/usr/bin/clang-{version}")
-            os.symlink(f"{DOCKER_MOUNT_POINT}/wrappers/clang++", f"/usr/bin/clang++-{version}")
+        # the packages might have replaced the compiler links of the image
+        relink_wrappers()
 
         print_section(idx, ctx, "finished redoing the clang wrapper")
 
@@ -258,6 +318,8 @@ with open("output.json", "w") as f:
 
 # move logs to build directory
 for file in glob.glob("*.log"):
+    if file in stale_logs:
+        continue
     move(file, build_dir)
 copy2("output.json", os.path.join(build_dir, "output.json"))
 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import json
+
+from argparse import ArgumentParser
+from datetime import datetime
+from os import makedirs, path
+from sys import argv, stdout
+
+from code_builder.reanalysis import load_build_results, load_catalogs, reanalyze
+from code_builder.statistics import Statistics
+from code_builder.utils.driver import open_config
+
+parser = ArgumentParser(description='Recompute error and dependency statistics of existing builds')
+parser.add_argument('build_results', type=str, nargs='+',
+        help='all_built.json, all_built.jsonl or build_details_*.json files of previous runs')
+parser.add_argument('--user-config-file', dest='user_config_file', default='user.cfg', action='store',
+        help='User config file')
+parser.add_argument('--config-file', dest='config_file', default='build.cfg', action='store',
+        help='Application config file')
+parser.add_argument('--log_dir', dest='log_dir', default='buildlogs', action='store',
+        help='Directory used to store the stats')
+parser.add_argument('-j', dest='jobs', default=4, type=int, action='store',
+        help='Number of worker processes')
+parser.add_argument('--shards', dest='shards', default=None, type=int, action='store',
+        help='Number of shards the projects are split into, default 4 per process')
+parser.add_argument('--save-catalogs', dest='save_catalogs', action='store_true',
+        help='Add newly discovered errors and dependencies to the persistent catalogs')
+
+parsed_args = parser.parse_args(argv[1:])
+cfg = open_config(parsed_args, path.dirname(path.realpath(__file__)))
+timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+fuzzy_matching = cfg["build"].get("fuzzy_matching", "index")
+catalog_store = cfg["build"].get("catalog_store") or None
+contents_index = cfg["build"].get("contents_index") or None
+
+projects = load_build_results(parsed_args.build_results)
+print("Reanalyzing {} projects".format(len(projects)))
+if parsed_args.save_catalogs:
+    stats = Statistics(len(projects), fuzzy_matching=fuzzy_matching, catalog_store=catalog_store,
+            contents_index=contents_index)
+else:
+    # leave errortypes.json and dep_mapping.json alone
+    stats = Statistics(len(projects), fuzzy_matching=fuzzy_matching,
+            catalogs=load_catalogs(catalog_store), contents_index=contents_index)
+projects = reanalyze(projects, stats, parsed_args.jobs, parsed_args.shards)
+
+log_dir = parsed_args.log_dir
+if not path.isdir(log_dir):
+    makedirs(log_dir)
+stats.print_stats(stdout)
+stats.save_rebuild_json(log_dir, timestamp)
+stats.save_errorstat_json(log_dir, timestamp)
+stats.save_dependencies_json(log_dir, timestamp, save_mapping=parsed_args.save_catalogs)
+if parsed_args.save_catalogs:
+    stats.save_errors_json()
+    stats.export_catalogs()
+with open(path.join(log_dir, "summary_{}_{}.txt".format(timestamp, len(projects))), "w") as o:
+    stats.print_stats(o)
+with open(path.join(log_dir, "build_details_{}_{}.json".format(timestamp, len(projects))), "w") as o:
+    o.write(json.dumps(projects, indent=2))
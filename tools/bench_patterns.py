@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+
+from argparse import ArgumentParser
+from time import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder import dep_finder, statistics  # noqa: E402
+from code_builder.log_reader import iter_log_blocks  # noqa: E402
+
+parser = ArgumentParser(
+    description="Lines per second of the error and dependency pattern tables, "
+    "compared to searching the patterns one by one"
+)
+parser.add_argument("logs", nargs="+", help="Build logs, e.g. stderr files of a run")
+parser.add_argument(
+    "--repeat", dest="repeat", default=3, type=int, help="Best of this many runs"
+)
+parser.add_argument(
+    "--max-lines",
+    dest="max_lines",
+    default=20000,
+    type=int,
+    help="Only use the first lines of the logs, searching one by one is slow",
+)
+args = parser.parse_args(sys.argv[1:])
+
+
+def new_errors_one_by_one(lines):
+    # what find_new_errors did per line before the pattern table
+    table = statistics.NEW_ERROR_PATTERNS.entries
+    found = []
+    for err in lines:
+        err = re.sub(statistics.PATH_REGEX, "PATH/FILE.EXT", err)
+        err = re.sub(r"^\S*\.\S*(?:\:|\ )?\d+(?:\:\d+)?\:\ ", "", err)
+        for match, origin, title in table:
+            regex_result = re.search(match, err)
+            if regex_result:
+                found.append(title.search(err).group() if title else regex_result.group())
+                break
+    return found
+
+
+def new_errors_table(lines):
+    found = []
+    for err in lines:
+        if "/" in err:
+            err = statistics.PATH_RE.sub("PATH/FILE.EXT", err)
+        err = statistics.FILE_PREFIX_RE.sub("", err)
+        match = statistics.NEW_ERROR_PATTERNS.first_match(err)
+        if match is not None:
+            title = statistics.NEW_ERROR_PATTERNS.entries[match[0]][2]
+            found.append(title.search(err).group() if title else match[1].group())
+    return found
+
+
+def deps_one_by_one(lines):
+    found = []
+    for line in lines:
+        for table in (dep_finder.CONFIDENT_PATTERNS, dep_finder.PATTERNS):
+            for pattern, source in table.entries:
+                regex_result = re.search(pattern, line)
+                if regex_result:
+                    found.append((regex_result[1].strip(), source))
+    return found
+
+
+def deps_table(lines):
+    found = []
+    for line in lines:
+        for table in (dep_finder.CONFIDENT_PATTERNS, dep_finder.PATTERNS):
+            for idx, regex_result in table.all_matches(line):
+                found.append((regex_result[1].strip(), table.entries[idx][1]))
+    return found
+
+
+def best_time(func, lines):
+    result = None
+    best = None
+    for _ in range(args.repeat):
+        start = time()
+        result = func(lines)
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+lines = [
+    line
+    for path in args.logs
+    for block in iter_log_blocks(path)
+    for line in block
+    if len(line) < 1000
+][: args.max_lines]
+print("{} lines".format(len(lines)))
+for stage, before, after in (
+    ("find_new_errors", new_errors_one_by_one, new_errors_table),
+    ("DepFinder", deps_one_by_one, deps_table),
+):
+    before_time, before_result = best_time(before, lines)
+    after_time, after_result = best_time(after, lines)
+    print(
+        "{}: {:.0f} -> {:.0f} lines/s, same results: {}".format(
+            stage,
+            len(lines) / max(before_time, 1e-9),
+            len(lines) / max(after_time, 1e-9),
+            before_result == after_result,
+        )
+    )
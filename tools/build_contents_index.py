@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+from argparse import ArgumentParser
+from time import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder.contents_index import ContentsIndex, build_index  # noqa: E402
+
+parser = ArgumentParser(
+    description="Build the file to package index from a Debian Contents file"
+)
+parser.add_argument(
+    "--contents",
+    dest="contents",
+    default=None,
+    help="Contents-<arch> or Contents-<arch>.gz of the distribution used by the "
+    "build images, e.g. from http://deb.debian.org/debian/dists/buster/main/",
+)
+parser.add_argument(
+    "--output",
+    dest="output",
+    default=os.path.join(PROJECT_DIR, "code_builder", "contents_index.bin"),
+    help="Output file, set contents_index in build.cfg to it",
+)
+parser.add_argument(
+    "--all",
+    dest="keep_all",
+    action="store_true",
+    help="Index every file, not only headers, pkg-config, CMake and binaries",
+)
+parser.add_argument(
+    "--query",
+    dest="query",
+    nargs="*",
+    default=[],
+    help="Dependencies to resolve with the index, as dep or dep:source",
+)
+args = parser.parse_args(sys.argv[1:])
+
+if args.contents:
+    start = time()
+    count = build_index(args.contents, args.output, args.keep_all)
+    print(
+        "indexed {} files in {:.1f} seconds, {} bytes".format(
+            count, time() - start, os.path.getsize(args.output)
+        )
+    )
+
+if args.query:
+    index = ContentsIndex(args.output)
+    for query in args.query:
+        dep, _, source = query.partition(":")
+        start = time()
+        pkgs = index.resolve(dep, source or None)
+        print(
+            "{}: {} ({:.0f} us)".format(
+                dep, ", ".join(pkgs) or "-", (time() - start) * 1e6
+            )
+        )
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+
+from argparse import ArgumentParser
+from time import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder.supervisor import FAILED, ContainerSupervisor  # noqa: E402
+
+parser = ArgumentParser(
+    description="Start and stop the container supervisor of build_projects "
+    "against the local docker, fails if it hangs or dies"
+)
+parser.add_argument(
+    "--timeout",
+    dest="timeout",
+    default=30,
+    type=float,
+    help="Seconds starting and stopping may take",
+)
+args = parser.parse_args()
+
+results = {}
+supervisor = ContainerSupervisor(results, memory_interval=0)
+start = time()
+# start() blocks until the events stream is subscribed, never forever here
+starter = threading.Thread(target=supervisor.start, daemon=True)
+starter.start()
+starter.join(args.timeout)
+if starter.is_alive() or not supervisor.is_alive():
+    print("supervisor did not start: {}".format(supervisor.error or "timeout"))
+    sys.exit(1)
+print("supervisor {} started in {:.2f} seconds".format(supervisor.run_id, time() - start))
+start = time()
+stopper = threading.Thread(target=supervisor.stop, daemon=True)
+stopper.start()
+stopper.join(args.timeout)
+if stopper.is_alive():
+    print("supervisor did not stop")
+    sys.exit(1)
+if FAILED in results:
+    print("supervisor failed: {}".format(results[FAILED]))
+    sys.exit(1)
+print("supervisor stopped in {:.2f} seconds".format(time() - start))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+from argparse import ArgumentParser
+from time import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder.journal import compact  # noqa: E402
+
+parser = ArgumentParser(
+    description="Merge the journal of an interrupted run into all_built.json"
+)
+parser.add_argument(
+    "--build-dir",
+    dest="build_dir",
+    default="build",
+    help="Build directory of the run, as passed to builder.py",
+)
+args = parser.parse_args(sys.argv[1:])
+
+start = time()
+count = compact(args.build_dir)
+print(
+    "wrote {} projects to {} in {:.1f} seconds".format(
+        count, os.path.join(args.build_dir, "all_built.json"), time() - start
+    )
+)
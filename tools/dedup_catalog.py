@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+
+from argparse import ArgumentParser
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder.catalog_dedup import dedup_catalog, matching_time  # noqa: E402
+from code_builder.catalog_store import write_json_atomic  # noqa: E402
+from code_builder.log_reader import iter_log_blocks  # noqa: E402
+
+parser = ArgumentParser(
+    description="Merge near duplicate entries of the errortypes catalog"
+)
+parser.add_argument(
+    "--errortypes",
+    dest="errortypes",
+    default=os.path.join(PROJECT_DIR, "code_builder", "errortypes.json"),
+    help="Error catalog to deduplicate",
+)
+parser.add_argument(
+    "--output",
+    dest="output",
+    default=os.path.join(PROJECT_DIR, "code_builder", "errortypes_dedup.json"),
+    help="Output file for the slimmed catalog",
+)
+parser.add_argument(
+    "--mapping",
+    dest="mapping",
+    default=os.path.join(PROJECT_DIR, "code_builder", "errortypes_mapping.json"),
+    help="Output file for the mapping from old to new keys",
+)
+parser.add_argument(
+    "--threshold",
+    dest="threshold",
+    default=0.9,
+    type=float,
+    help="Minimal cosine similarity of merged entries",
+)
+parser.add_argument(
+    "--ngram", dest="ngram", default=3, type=int, help="Length of the n-grams"
+)
+parser.add_argument(
+    "--logs",
+    dest="logs",
+    nargs="*",
+    default=[],
+    help="Build logs used to time the matching, the catalog keys if not given",
+)
+args = parser.parse_args(sys.argv[1:])
+
+with open(args.errortypes, "r") as f:
+    catalog = json.load(f)
+slim, mapping = dedup_catalog(catalog, args.threshold, args.ngram)
+write_json_atomic(args.output, slim)
+write_json_atomic(args.mapping, mapping)
+
+if args.logs:
+    lines = [line for path in args.logs for block in iter_log_blocks(path) for line in block]
+else:
+    lines = list(catalog)
+before = matching_time(catalog, lines)
+after = matching_time(slim, lines)
+print("entries: {} -> {}".format(len(catalog), len(slim)))
+print(
+    "size: {} -> {} bytes".format(
+        os.path.getsize(args.errortypes), os.path.getsize(args.output)
+    )
+)
+print("regex matching: {:.3f} -> {:.3f} seconds".format(before[0], after[0]))
+print("fuzzy matching: {:.3f} -> {:.3f} seconds".format(before[1], after[1]))
+print("written {} and {}".format(args.output, args.mapping))
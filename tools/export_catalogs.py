@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+from argparse import ArgumentParser
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.pardir)
+sys.path.insert(0, PROJECT_DIR)
+
+from code_builder.catalog_store import CatalogStore  # noqa: E402
+
+parser = ArgumentParser(
+    description="Export errortypes.json and dep_mapping.json from the catalog store"
+)
+parser.add_argument(
+    "--store",
+    dest="store",
+    default=os.path.join(PROJECT_DIR, "code_builder", "catalogs.db"),
+    help="Catalog store database",
+)
+parser.add_argument(
+    "--errortypes",
+    dest="errortypes",
+    default=os.path.join(PROJECT_DIR, "code_builder", "errortypes.json"),
+    help="Output file for the error catalog",
+)
+parser.add_argument(
+    "--dep-mapping",
+    dest="dep_mapping",
+    default=os.path.join(PROJECT_DIR, "code_builder", "dep_mapping.json"),
+    help="Output file for the dependency mapping",
+)
+args = parser.parse_args(sys.argv[1:])
+
+if not os.path.exists(args.store):
+    print("catalog store {} not found".format(args.store))
+    sys.exit(1)
+store = CatalogStore(args.store)
+store.export_errors_json(args.errortypes)
+print("exported errors to {}".format(args.errortypes))
+store.export_dep_mapping_json(args.dep_mapping)
+print("exported dependency mapping to {}".format(args.dep_mapping))
+store.close()